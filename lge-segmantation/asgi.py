@@ -0,0 +1,417 @@
+"""
+Async (ASGI) front end for server.py with the same routes and responses:  uvicorn asgi:app --host 0.0.0.0 --port 5001
+
+The event loop only parses requests and moves bytes. Binary volumes (application/x-lge-volume) are copied chunk by
+chunk into the voxel array as they arrive. JSON and NIfTI bodies are decoded on a small thread pool. Segmentation
+runs on server.py's inference pool and is awaited without holding a thread. /health, /metrics and the job endpoints
+therefore answer at once while large uploads and multi-minute inferences are in flight.
+
+Prefork:  gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import asyncio
+import contextlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Route
+
+import server
+
+# Threads for base64 / NIfTI decoding, JSON encoding of mask payloads and mask cache reads.
+DECODE_WORKERS = int(os.environ.get("LGE_DECODE_WORKERS", "2"))
+
+_decode_executor = ThreadPoolExecutor(max_workers=DECODE_WORKERS, thread_name_prefix="decode")
+
+
+def _offload(fn, *args):
+    """Run fn(*args) on the decode pool; returns an awaitable."""
+    return asyncio.get_running_loop().run_in_executor(_decode_executor, fn, *args)
+
+
+def _error_response(message: str, status: int, headers: dict = None) -> Response:
+    return Response(json.dumps({"error": message}), status_code=status, media_type="application/json", headers=headers)
+
+
+def _exception_response(e: Exception) -> Response:
+    status, message, headers = server._error_status(e)
+    return _error_response(message, status, headers)
+
+
+def _json_response(text: str, status: int = 200) -> Response:
+    return Response(text, status_code=status, media_type="application/json")
+
+
+def _resolve(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+async def _client_disconnected(request) -> None:
+    """Return once the client has gone (the body has been read, so the next ASGI message is http.disconnect)."""
+    while (await request.receive())["type"] != "http.disconnect":
+        pass
+
+
+async def _job_result(job, request):
+    """Await a pool job without blocking the event loop; returns its result, raises server._HTTPError if it failed.
+    If the client disconnects first, the job is cancelled and server._Cancelled is raised."""
+    loop = asyncio.get_running_loop()
+    done = loop.create_future()
+    job.add_done_callback(lambda _: loop.call_soon_threadsafe(_resolve, done))
+    disconnected = asyncio.ensure_future(_client_disconnected(request))
+    try:
+        await asyncio.wait({done, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        disconnected.cancel()
+    if not done.done():
+        server._inference_pool.cancel(job, "client disconnected")
+        raise server._Cancelled("client disconnected")
+    if job.error is not None:
+        raise server._HTTPError(job.error, job.error_status)
+    return job.result
+
+
+async def _read_body(request) -> bytearray:
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+    return body
+
+
+def _content_length(request):
+    value = request.headers.get("content-length")
+    return int(value) if value is not None else None
+
+
+async def _read_raw_volume(request, clock: "server._StageClock"):
+    """Binary upload: the body is received straight into the voxel array, chunk by chunk, on the event loop."""
+    try:
+        header = server._raw_volume_header(request.query_params)
+        server._inference_pool.admit(server._volume_memory(header["dimensions"], server._volume_dtype(header["dtype"])))
+        arr = server._raw_volume_buffer(_content_length(request), header)
+    except ValueError as e:
+        raise server._BadRequest(str(e)) from e
+    view = memoryview(arr).cast("B")
+    pos = 0
+    async for chunk in request.stream():
+        if pos + len(chunk) > view.nbytes:
+            raise server._BadRequest(f"body is longer than dimensions and dtype allow ({view.nbytes} bytes)")
+        view[pos : pos + len(chunk)] = chunk
+        pos += len(chunk)
+    if pos != view.nbytes:
+        raise server._BadRequest(f"body ended after {pos} bytes (expected {view.nbytes})")
+    clock.mark("decode")
+    input_img = server._nifti_from_flat(arr, header["dimensions"], header["spacing"], header["origin"])
+    return input_img, list(header["dimensions"][:3])
+
+
+def _decode_json_volume(body: bytearray, clock: "server._StageClock"):
+    try:
+        data = json.loads(body)
+    except ValueError:
+        data = None
+    if not isinstance(data, dict) or "data" not in data or "dimensions" not in data:
+        raise server._BadRequest("JSON body must include dimensions and data (base64)")
+    try:
+        dtype = server._volume_dtype(data.get("dtype", "float32"))
+        server._inference_pool.admit(server._volume_memory(data["dimensions"], dtype))
+        return server._nifti_from_json(data, clock), list(data["dimensions"][:3])
+    except (ValueError, TypeError) as e:  # incl. binascii.Error (bad base64) and short / mismatched data
+        raise server._BadRequest(str(e)) from e
+
+
+def _decode_nifti(volume_bytes: bytearray):
+    server._inference_pool.admit(server._nifti_memory(volume_bytes))
+    return server._nifti_from_bytes(volume_bytes)
+
+
+async def _read_segment_input(request, clock: "server._StageClock" = None):
+    """Async counterpart of server._read_segment_input. Returns (input_img, frontend_dims)."""
+    clock = clock or server._StageClock()
+    content_type = request.headers.get("content-type", "").split(";")[0].strip().lower()
+    if content_type == server.RAW_VOLUME_CONTENT_TYPE:
+        input_img, frontend_dims = await _read_raw_volume(request, clock)
+    elif content_type == "application/json":
+        input_img, frontend_dims = await _offload(_decode_json_volume, await _read_body(request), clock)
+    else:
+        # Raw NIfTI bytes
+        volume_bytes = await _read_body(request)
+        if not volume_bytes:
+            raise server._BadRequest("Empty body: send NIfTI bytes or JSON with dimensions/data")
+        clock.mark("decode")
+        input_img, frontend_dims = await _offload(_decode_nifti, volume_bytes), None
+    clock.mark("nifti")
+    return input_img, frontend_dims
+
+
+async def segment(request):
+    """POST /segment, see server.segment."""
+    try:
+        deadline = server._request_deadline(request.headers)
+        encoding = server._parse_mask_encoding(request.query_params.get("encoding"))
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        input_img, frontend_dims = await _read_segment_input(request)
+        job = server._inference_pool.submit(
+            "interactive", server._segment_volume, input_img, frontend_dims, encoding, None, heart_mode,
+            track=False, memory=server._image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        return _json_response(await _offload(json.dumps, await _job_result(job, request)))
+    except Exception as e:
+        return _exception_response(e)
+
+
+async def segment_stream(request):
+    """POST /segment/stream, see server.segment_stream."""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def emit(kind, data):
+        loop.call_soon_threadsafe(events.put_nowait, (kind, data))
+
+    clock = server._StageClock(lambda event: emit("stage", event))
+
+    def run(input_img):
+        emit("result", server._segment_volume(input_img, frontend_dims, encoding, clock, heart_mode))
+
+    def on_done(job):
+        if job.error is not None:  # failed, or expired before it ran
+            emit("error", {"error": job.error})
+
+    try:
+        deadline = server._request_deadline(request.headers)
+        encoding = server._parse_mask_encoding(request.query_params.get("encoding"))
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        input_img, frontend_dims = await _read_segment_input(request, clock)
+        job = server._inference_pool.submit(
+            "interactive", run, input_img, track=False, memory=server._image_memory(input_img), deadline=deadline
+        )
+        del input_img
+    except Exception as e:
+        return _exception_response(e)
+    job.add_done_callback(on_done)
+
+    async def generate():
+        kind = None
+        try:
+            while kind in (None, "stage"):
+                try:
+                    kind, data = await asyncio.wait_for(events.get(), server.SSE_KEEPALIVE_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"  # keeps proxies from closing an idle stream during inference
+                    continue
+                text = json.dumps(data) if kind == "stage" else await _offload(json.dumps, data)
+                yield f"event: {kind}\ndata: {text}\n\n"
+        finally:
+            if kind in (None, "stage"):  # Starlette cancels the stream when the client disconnects
+                server._inference_pool.cancel(job, "client disconnected")
+
+    return StreamingResponse(
+        generate(), media_type="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+async def segment_job_submit(request):
+    """POST /segment/jobs, see server.segment_job_submit."""
+    try:
+        deadline = server._request_deadline(request.headers)
+        encoding = server._parse_mask_encoding(request.query_params.get("encoding"))
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        input_img, frontend_dims = await _read_segment_input(request)
+        lane = request.query_params.get("priority", "interactive")
+        job = server._inference_pool.submit(
+            lane, server._segment_volume, input_img, frontend_dims, encoding, None, heart_mode,
+            memory=server._image_memory(input_img), deadline=deadline,
+        )
+    except Exception as e:
+        return _exception_response(e)
+    return _json_response(json.dumps(job.to_dict()), 202)
+
+
+def _mask_view_json(volume_key, frontend_dims, encoding, heart_mode):
+    payload = server._mask_view_payload(volume_key, frontend_dims, encoding, heart_mode)
+    return None if payload is None else json.dumps(payload)
+
+
+async def segment_mask_view(request):
+    """GET /segment/masks/<volume_key>, see server.segment_mask_view."""
+    try:
+        volume_key = server._parse_volume_key(request.path_params["volume_key"])
+        encoding = server._parse_mask_encoding(request.query_params.get("encoding"))
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        dims = request.query_params.get("dimensions")
+        frontend_dims = [int(v) for v in dims.split(",")][:3] if dims else None
+    except ValueError as e:
+        return _error_response(str(e), 400)
+    text = await _offload(_mask_view_json, volume_key, frontend_dims, encoding, heart_mode)
+    if text is None:
+        return _error_response(f"volume {volume_key} is not in the mask cache; POST it to /segment", 404)
+    return _json_response(text)
+
+
+async def segment_mesh(request):
+    """POST /segment/mesh, see server.segment_mesh."""
+    if server.measure is None:
+        return _error_response("surface meshes need scikit-image (pip install scikit-image)", 501)
+    try:
+        deadline = server._request_deadline(request.headers)
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        input_img, _ = await _read_segment_input(request)
+        job = server._inference_pool.submit(
+            "interactive", server._segment_mesh, input_img, heart_mode,
+            track=False, memory=server._image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        body = await _job_result(job, request)
+    except Exception as e:
+        return _exception_response(e)
+    return Response(body, media_type=server.MESH_CONTENT_TYPE, headers={"X-Mesh-Mode": heart_mode})
+
+
+async def segment_contours(request):
+    """POST /segment/contours, see server.segment_contours."""
+    if server.measure is None:
+        return _error_response("contours need scikit-image (pip install scikit-image)", 501)
+    try:
+        deadline = server._request_deadline(request.headers)
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        axis = server._parse_contour_axis(request.query_params.get("axis"))
+        input_img, frontend_dims = await _read_segment_input(request)
+        job = server._inference_pool.submit(
+            "interactive", server._segment_contours, input_img, frontend_dims, heart_mode, axis,
+            track=False, memory=server._image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        body = await _job_result(job, request)
+    except Exception as e:
+        return _exception_response(e)
+    return Response(body, media_type=server.CONTOUR_CONTENT_TYPE)
+
+
+async def centerline(request):
+    """POST /centerline, see server.centerline."""
+    if server.morphology is None or server.ndimage is None:
+        return _error_response("centerlines need scikit-image and scipy (pip install scikit-image)", 501)
+    try:
+        deadline = server._request_deadline(request.headers)
+        heart_mode = server._parse_heart_mode(request.query_params.get("mode"))
+        label, min_branch_mm = server._parse_centerline_args(request.query_params)
+        input_img, _ = await _read_segment_input(request)
+        lane = request.query_params.get("priority", "interactive")
+        job = server._inference_pool.submit(
+            lane, server._segment_centerline, input_img, heart_mode, label, min_branch_mm,
+            track=False, memory=server._image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        return _json_response(json.dumps(await _job_result(job, request)))
+    except Exception as e:
+        return _exception_response(e)
+
+
+async def segment_job_status(request):
+    job_id = request.path_params["job_id"]
+    job = server._inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    return _json_response(json.dumps(job.to_dict()))
+
+
+async def segment_job_cancel(request):
+    """DELETE /segment/jobs/<job_id>, see server.segment_job_cancel."""
+    job_id = request.path_params["job_id"]
+    job = server._inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    if not server._inference_pool.cancel(job, "job deleted"):
+        server._inference_pool.forget(job_id)
+    return _json_response(json.dumps(job.to_dict()), 200 if job.finished else 202)
+
+
+async def segment_job_result(request):
+    """GET /segment/jobs/<job_id>/result, see server.segment_job_result."""
+    job_id = request.path_params["job_id"]
+    job = server._inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    if job.status != "done":
+        return _json_response(json.dumps(job.to_dict()), 202)
+    return _json_response(await _offload(json.dumps, job.result))
+
+
+async def segment_job_stats(request):
+    return _json_response(json.dumps(server._inference_pool.stats()))
+
+
+async def health(request):
+    server._readiness.health_checked()
+    server.start_warmup()
+    return _json_response('{"status":"ok"}')
+
+
+async def ready(request):
+    """GET /ready, see server.ready."""
+    server.start_warmup()
+    payload = server._readiness.to_dict()
+    return _json_response(json.dumps(payload), 200 if payload["ready"] else 503)
+
+
+async def metrics(request):
+    return Response(server._metrics.render(), media_type="text/plain; version=0.0.4")
+
+
+async def cache_stats(request):
+    return _json_response(json.dumps(server._mask_cache.stats()))
+
+
+async def model_reload(request):
+    """POST /model/reload, see server.model_reload; the load runs off the event loop."""
+    try:
+        payload = await asyncio.to_thread(server.reload_models)
+    except Exception as e:
+        return _exception_response(e)
+    return _json_response(json.dumps(payload))
+
+
+@contextlib.asynccontextmanager
+async def _lifespan(app):
+    # Accept connections right away; the model loads and warms up in the background (GET /ready).
+    server.start_warmup()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/segment", segment, methods=["POST"]),
+        Route("/segment/stream", segment_stream, methods=["POST"]),
+        Route("/segment/jobs", segment_job_submit, methods=["POST"]),
+        Route("/segment/jobs", segment_job_stats, methods=["GET"]),
+        Route("/segment/masks/{volume_key}", segment_mask_view, methods=["GET"]),
+        Route("/segment/mesh", segment_mesh, methods=["POST"]),
+        Route("/segment/contours", segment_contours, methods=["POST"]),
+        Route("/centerline", centerline, methods=["POST"]),
+        Route("/segment/jobs/{job_id}", segment_job_status, methods=["GET"]),
+        Route("/segment/jobs/{job_id}", segment_job_cancel, methods=["DELETE"]),
+        Route("/segment/jobs/{job_id}/result", segment_job_result, methods=["GET"]),
+        Route("/health", health, methods=["GET"]),
+        Route("/ready", ready, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/cache/stats", cache_stats, methods=["GET"]),
+        Route("/model/reload", model_reload, methods=["POST"]),
+    ],
+    middleware=[Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"])],
+    lifespan=_lifespan,
+)
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host="0.0.0.0", port=5001)
@@ -0,0 +1,366 @@
+"""
+Offline benchmark of the /segment pipeline (server.py) with a stub segmenter.
+
+Runs synthetic volumes of several sizes and dtypes through the same code path as POST /segment
+(_nifti_from_json -> reorient -> _run_segmentation -> undo_canonical -> mask encoding), with
+totalsegmentator() replaced by a stub, so it measures the server's own overhead without a GPU,
+model weights or network. Prints per-stage timings, throughput and peak memory as JSON.
+
+    python3.10 benchmark.py --sizes 128x128x64,256x256x120 --dtypes int16,float32 --repeats 3 -o bench.json
+    python3.10 benchmark.py --baseline bench.json --tolerance 0.25   # exit 1 if a stage got slower
+
+Also checks the input memory ceiling: the tracemalloc peak of decode + NIfTI build must stay within
+--max-input-memory (default 1.2) times the voxel payload, else exit 1.
+
+--stub spheres (default) draws one sphere per chamber; --stub empty returns an empty label map;
+--stub package.module:function plugs in any callable with the totalsegmentator(input=..., task=..., ...) signature
+that returns a label-map Nifti1Image.
+
+--startup measures a real server instead (model, weights and device included): it starts --startup-cmd and reports
+the seconds from spawn to the first 200 from /health and from /ready (model loaded and warm-up inference done),
+plus the server's own /ready phase timings. Exit 1 if /ready is not reached within --startup-timeout.
+
+    python3.10 benchmark.py --startup --startup-cmd "python3.10 server.py"
+
+--onnx-parity runs the warm predictor with both backends (torch on DEVICE, ONNX Runtime on the CPU) on --parity-volume
+(a NIfTI file; default: the synthetic warm-up volume) and reports the fraction of voxels whose labels differ, Dice per
+label and the timing of each backend. Needs the model weights. Exit 1 if the mismatch exceeds --parity-tolerance.
+
+    python3.10 benchmark.py --onnx-parity --parity-volume case.nii.gz
+
+--warm-parity runs _run_segmentation on --parity-volume per call (totalsegmentator(), WARM_MODEL = False) and on the
+resident predictors (WARM_MODEL = True, loaded before timing), and reports the label mismatch, Dice per label and the
+median seconds of each (p50 over --repeats). Needs the model weights. Exit 1 if the mismatch exceeds --parity-tolerance.
+
+    python3.10 benchmark.py --warm-parity --parity-volume case.nii.gz --repeats 5
+"""
+
+import argparse
+import base64
+import contextlib
+import importlib
+import json
+import platform
+import shlex
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import numpy as np
+import nibabel as nib
+
+# server.py logs to stdout; keep stdout for the JSON report.
+with contextlib.redirect_stdout(sys.stderr):
+    import server
+
+
+def _sphere_segmenter(input, task=None, **kwargs):
+    """Stub for totalsegmentator(): one sphere per chamber (or one heart sphere for total_mr) around the center."""
+    shape = input.shape[:3]
+    labels = np.zeros(shape, dtype=np.uint8)
+    if task == "heartchambers_highres":
+        ids = [server.CHAMBER_CLASS_IDS[fname[: -len(".nii.gz")]] for fname, _ in server.HEART_CHAMBER_FILES]
+    else:
+        ids = [{name: idx for idx, name in server.class_map[server.TASK].items()}["heart"]]
+    radius = max(1, min(shape) // 8)
+    offsets = [(-1, -1, 0), (1, -1, 0), (-1, 1, 0), (1, 1, 0)]
+    for class_id, offset in zip(ids, offsets):
+        center = [s // 2 + o * radius for s, o in zip(shape, offset)]
+        box = tuple(slice(max(0, c - radius), min(s, c + radius + 1)) for c, s in zip(center, shape))
+        grid = np.ogrid[box]
+        dist2 = sum((g - c) ** 2 for g, c in zip(grid, center))
+        labels[box][dist2 <= radius * radius] = class_id
+    return nib.Nifti1Image(labels, input.affine)
+
+
+def _empty_segmenter(input, **kwargs):
+    """Stub for totalsegmentator(): empty label map."""
+    return nib.Nifti1Image(np.zeros(input.shape[:3], dtype=np.uint8), input.affine)
+
+
+STUBS = {"spheres": _sphere_segmenter, "empty": _empty_segmenter}
+
+
+def _load_stub(name: str):
+    if name in STUBS:
+        return STUBS[name]
+    module, _, func = name.partition(":")
+    if not func:
+        raise SystemExit(f"--stub must be one of {', '.join(STUBS)} or module:function, got {name!r}")
+    return getattr(importlib.import_module(module), func)
+
+
+def _synthetic_body(dims, dtype: str, rng) -> dict:
+    """JSON /segment body for a random volume (first dimension fastest, like the viewer sends)."""
+    n = int(np.prod(dims))
+    if dtype == "float32":
+        data = rng.random(n, dtype=np.float32) * 1000
+    else:
+        info = np.iinfo(dtype)
+        data = rng.integers(max(info.min, 0), min(info.max, 1000), n).astype(dtype)
+    return {
+        "dimensions": list(dims),
+        "spacing": [1.25, 1.25, 1.5],
+        "origin": [0.0, 0.0, 0.0],
+        "dtype": dtype,
+        "data": base64.b64encode(data.tobytes()).decode("ascii"),
+    }
+
+
+def _run_case(dims, dtype: str, repeats: int, encoding: tuple, rng) -> dict:
+    body = _synthetic_body(dims, dtype, rng)
+    payload_bytes = len(body["data"]) * 3 // 4
+    runs = []
+    peaks = []
+    input_peaks = []
+    for _ in range(repeats):
+        stages = {}
+        clock = server._StageClock(lambda event: stages.__setitem__(event["stage"], event["seconds"]))
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        img = server._nifti_from_json(body, clock)
+        clock.mark("nifti")
+        input_peaks.append(tracemalloc.get_traced_memory()[1])
+        server._segment_volume(img, body["dimensions"], encoding, clock)
+        total = time.perf_counter() - t0
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        stages.pop("queue", None)  # no pool here; time between nifti and the pipeline start
+        stages["total"] = total
+        runs.append(stages)
+        del img
+    stage_names = list(runs[0])
+    stages = {
+        name: {
+            "median": statistics.median(r[name] for r in runs),
+            "min": min(r[name] for r in runs),
+            "max": max(r[name] for r in runs),
+        }
+        for name in stage_names
+    }
+    total = stages["total"]["median"]
+    return {
+        "dimensions": list(dims),
+        "dtype": dtype,
+        "voxels": int(np.prod(dims)),
+        "payload_bytes": payload_bytes,
+        "repeats": repeats,
+        "stages": stages,
+        "voxels_per_second": int(np.prod(dims)) / total if total else None,
+        "payload_mb_per_second": payload_bytes / 2**20 / total if total else None,
+        "tracemalloc_peak_bytes": max(peaks),
+        "input_peak_ratio": max(input_peaks) / payload_bytes,
+    }
+
+
+def _compare(results: dict, baseline: dict, tolerance: float) -> list:
+    """Stages whose median is more than `tolerance` (fraction) slower than in the baseline."""
+    regressions = []
+    base_cases = {(tuple(c["dimensions"]), c["dtype"]): c for c in baseline.get("cases", [])}
+    for case in results["cases"]:
+        base = base_cases.get((tuple(case["dimensions"]), case["dtype"]))
+        if base is None:
+            continue
+        for stage, timing in case["stages"].items():
+            if stage not in base["stages"]:
+                continue
+            before, after = base["stages"][stage]["median"], timing["median"]
+            if before > 0 and after > before * (1 + tolerance):
+                regressions.append(
+                    {"dimensions": case["dimensions"], "dtype": case["dtype"], "stage": stage, "baseline": before, "current": after}
+                )
+    return regressions
+
+
+def _get(url: str):
+    """(status, body) of a GET, or None if nothing is listening yet."""
+    try:
+        with urllib.request.urlopen(url, timeout=5) as r:
+            return r.status, r.read()
+    except urllib.error.HTTPError as e:
+        return e.code, e.read()
+    except (urllib.error.URLError, ConnectionError):
+        return None
+
+
+def _measure_startup(cmd: str, url: str, timeout: float) -> dict:
+    """Start the server and time spawn -> first /health 200 and spawn -> /ready 200."""
+    t0 = time.perf_counter()
+    proc = subprocess.Popen(shlex.split(cmd), cwd=Path(__file__).resolve().parent, stdout=sys.stderr, stderr=sys.stderr)
+    result = {"command": cmd, "health_seconds": None, "ready_seconds": None, "server": None}
+    try:
+        while time.perf_counter() - t0 < timeout and proc.poll() is None:
+            if result["health_seconds"] is None:
+                response = _get(url + "/health")
+                if response is not None and response[0] == 200:
+                    result["health_seconds"] = round(time.perf_counter() - t0, 3)
+            else:
+                status, body = _get(url + "/ready") or (None, b"null")
+                if status == 200 or (json.loads(body) or {}).get("status") == "failed":
+                    result["ready_seconds"] = round(time.perf_counter() - t0, 3) if status == 200 else None
+                    result["server"] = json.loads(body)
+                    break
+            time.sleep(0.05)
+    finally:
+        proc.terminate()
+        proc.wait()
+    return result
+
+
+def _dice(a: np.ndarray, b: np.ndarray) -> float:
+    total = int(a.sum()) + int(b.sum())
+    return round(2 * int(np.logical_and(a, b).sum()) / total, 6) if total else 1.0
+
+
+def _onnx_parity(volume: Path, repeats: int) -> dict:
+    """Same canonical volume through the torch and the ONNX Runtime warm predictor; label agreement and timings."""
+    img = nib.load(str(volume)) if volume else server._warmup_volume()
+    img_can = server._reorient_to_canonical(img)
+    labels, seconds = {}, {}
+    for backend in ("torch", "onnx"):
+        predictor = server._WarmPredictor(backend=backend)
+        predictor.load()
+        times = []
+        for _ in range(max(1, repeats)):
+            t0 = time.perf_counter()
+            labels[backend] = predictor.predict(img_can)
+            times.append(time.perf_counter() - t0)
+        seconds[backend] = {"load": round(predictor.load_seconds, 3), "median": round(statistics.median(times), 3)}
+    expected, actual = labels["torch"], labels["onnx"]
+    ids = sorted((set(np.unique(expected)) | set(np.unique(actual))) - {0})
+    return {
+        "volume": str(volume) if volume else "synthetic",
+        "shape": list(img_can.shape[:3]),
+        "label_mismatch": float(np.mean(expected != actual)),
+        "dice": {int(i): _dice(expected == i, actual == i) for i in ids},
+        "seconds": seconds,
+    }
+
+
+def _warm_parity(volume: Path, repeats: int) -> dict:
+    """Same canonical volume through the per-call totalsegmentator() pipeline and the warm one; agreement and p50."""
+    img = nib.load(str(volume)) if volume else server._warmup_volume()
+    img_can = server._reorient_to_canonical(img)
+    server.ROI_CROP = False
+    labels, seconds = {}, {}
+    for mode, warm in (("per_call", False), ("warm", True)):
+        server.WARM_MODEL = warm
+        if warm:
+            server.preload_model()
+        times = []
+        for _ in range(max(1, repeats)):
+            t0 = time.perf_counter()
+            labels[mode] = np.asarray(server._run_segmentation(img_can, server._StageClock(record=False)).dataobj)
+            times.append(time.perf_counter() - t0)
+        seconds[mode] = {"p50": round(statistics.median(times), 3), "min": round(min(times), 3)}
+    expected, actual = labels["per_call"], labels["warm"]
+    ids = sorted((set(np.unique(expected)) | set(np.unique(actual))) - {0})
+    return {
+        "volume": str(volume) if volume else "synthetic",
+        "shape": list(img_can.shape[:3]),
+        "label_mismatch": float(np.mean(expected != actual)),
+        "dice": {int(i): _dice(expected == i, actual == i) for i in ids},
+        "seconds": seconds,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the LGE /segment pipeline with a stub segmenter")
+    parser.add_argument("--sizes", default="128x128x64,256x256x120", help="comma-separated d0xd1xd2 volume sizes")
+    parser.add_argument("--dtypes", default="int16,float32", help=f"comma-separated, from {', '.join(server.VOLUME_DTYPES)}")
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--stub", default="spheres", help="spheres | empty | module:function")
+    parser.add_argument("--heart-mode", default=server.HEART_MODE, choices=["four_chambers", "left_only", "heart"])
+    parser.add_argument("--encoding", default="", help="mask encoding as for /segment?encoding= (default: plain)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", type=Path, help="write JSON here (default: stdout)")
+    parser.add_argument("--baseline", type=Path, help="earlier JSON output to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown per stage vs baseline (fraction)")
+    parser.add_argument("--max-input-memory", type=float, default=1.2, help="allowed decode + NIfTI peak memory / voxel payload")
+    parser.add_argument("--startup", action="store_true", help="measure server startup instead of the pipeline")
+    parser.add_argument("--startup-cmd", default=f"{sys.executable} server.py", help="command that starts the server")
+    parser.add_argument("--url", default="http://127.0.0.1:5001", help="where the started server listens")
+    parser.add_argument("--startup-timeout", type=float, default=600, help="seconds to wait for /ready")
+    parser.add_argument("--onnx-parity", action="store_true", help="compare the ONNX Runtime backend with torch")
+    parser.add_argument("--warm-parity", action="store_true", help="compare the warm predictors with per-call runs")
+    parser.add_argument("--parity-volume", type=Path, help="NIfTI volume for --onnx-parity / --warm-parity (default: synthetic)")
+    parser.add_argument("--parity-tolerance", type=float, default=0.001, help="allowed fraction of differing labels")
+    args = parser.parse_args()
+
+    if args.onnx_parity or args.warm_parity:
+        with contextlib.redirect_stdout(sys.stderr):
+            parity = _onnx_parity if args.onnx_parity else _warm_parity
+            result = parity(args.parity_volume, args.repeats)
+        result["tolerance"] = args.parity_tolerance
+        text = json.dumps(result, indent=2)
+        if args.output:
+            args.output.write_text(text)
+        else:
+            print(text)
+        if result["label_mismatch"] > args.parity_tolerance:
+            sys.exit(1)
+        return
+
+    if args.startup:
+        result = _measure_startup(args.startup_cmd, args.url.rstrip("/"), args.startup_timeout)
+        text = json.dumps(result, indent=2)
+        if args.output:
+            args.output.write_text(text)
+        else:
+            print(text)
+        if result["ready_seconds"] is None:
+            sys.exit(1)
+        return
+
+    # Pipeline as in server.py, minus the model and all disk side effects.
+    server.totalsegmentator = _load_stub(args.stub)
+    server.WARM_MODEL = False
+    server.MASK_CACHE = False
+    server.ARCHIVE_RESULTS = False
+    server.ROI_CROP = False
+    server.HEART_MODE = args.heart_mode
+    encoding = server._parse_mask_encoding(args.encoding)
+
+    rng = np.random.default_rng(args.seed)
+    cases = []
+    with contextlib.redirect_stdout(sys.stderr):
+        for size in args.sizes.split(","):
+            dims = [int(v) for v in size.lower().split("x")]
+            for dtype in args.dtypes.split(","):
+                cases.append(_run_case(dims, dtype, args.repeats, encoding, rng))
+                print(f"{size} {dtype}: {cases[-1]['stages']['total']['median']:.3f}s")
+
+    results = {
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "nibabel": nib.__version__,
+        "machine": platform.machine(),
+        "stub": args.stub,
+        "heart_mode": args.heart_mode,
+        "encoding": args.encoding,
+        "cases": cases,
+    }
+    results["memory_violations"] = [
+        {"dimensions": c["dimensions"], "dtype": c["dtype"], "input_peak_ratio": c["input_peak_ratio"]}
+        for c in cases
+        if c["input_peak_ratio"] > args.max_input_memory
+    ]
+    if args.baseline:
+        results["regressions"] = _compare(results, json.loads(args.baseline.read_text()), args.tolerance)
+
+    text = json.dumps(results, indent=2)
+    if args.output:
+        args.output.write_text(text)
+    else:
+        print(text)
+    if results.get("regressions") or results["memory_violations"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+"""
+In-process DICOM series loader (pydicom), used instead of TotalSegmentator's dcm2niix conversion.
+
+    img = load_series(dicom_dir, cache_dir=Path("LGE3D_TS/dicom_cache"))   # nibabel Nifti1Image, RAS affine
+
+Headers are read first (no pixel data) to group files by SeriesInstanceUID and sort slices along the slice
+normal; pixel data is then decoded in a thread pool straight into one preallocated volume. With cache_dir,
+the volume is stored as <SeriesInstanceUID>.nii.gz and later loads of the same series skip decoding.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pydicom
+
+# Threads decoding pixel data (file reads and most codecs release the GIL).
+DICOM_READ_WORKERS = min(8, os.cpu_count() or 1)
+# Header elements needed to group, sort and place slices.
+HEADER_TAGS = [
+    "SeriesInstanceUID",
+    "ImagePositionPatient",
+    "ImageOrientationPatient",
+    "PixelSpacing",
+    "Rows",
+    "Columns",
+    "NumberOfFrames",
+    "RescaleSlope",
+    "RescaleIntercept",
+    "BitsAllocated",
+    "PixelRepresentation",
+]
+
+
+def _read_header(path: Path):
+    """Header of one file, or None if it is not a DICOM image slice."""
+    try:
+        ds = pydicom.dcmread(str(path), stop_before_pixels=True, specific_tags=HEADER_TAGS)
+    except (pydicom.errors.InvalidDicomError, OSError):
+        return None
+    if "ImagePositionPatient" not in ds or "ImageOrientationPatient" not in ds or "Rows" not in ds:
+        return None
+    return ds
+
+
+def read_headers(dicom_dir: Path, workers: int = DICOM_READ_WORKERS) -> dict:
+    """{SeriesInstanceUID: [(path, header), ...]} for every image slice in dicom_dir (not recursive)."""
+    paths = sorted(p for p in Path(dicom_dir).iterdir() if p.is_file() and not p.name.startswith("."))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        headers = list(pool.map(_read_header, paths))
+    series = {}
+    for path, ds in zip(paths, headers):
+        if ds is not None:
+            series.setdefault(str(ds.get("SeriesInstanceUID", "")), []).append((path, ds))
+    return series
+
+
+def _geometry(slices: list):
+    """Sort slices along the slice normal; returns (sorted slices, 4x4 LPS affine for (column, row, slice) indices)."""
+    first = slices[0][1]
+    orientation = np.array([float(v) for v in first.ImageOrientationPatient])
+    row_cos, col_cos = orientation[:3], orientation[3:]
+    normal = np.cross(row_cos, col_cos)
+    for _, ds in slices:
+        if int(ds.get("NumberOfFrames", 1) or 1) > 1:
+            raise ValueError("multi-frame (enhanced) DICOM is not supported")
+        if not np.allclose([float(v) for v in ds.ImageOrientationPatient], orientation, atol=1e-4):
+            raise ValueError("slices have different orientations")
+        if (ds.Rows, ds.Columns) != (first.Rows, first.Columns):
+            raise ValueError("slices have different sizes")
+    positions = [np.array([float(v) for v in ds.ImagePositionPatient]) for _, ds in slices]
+    order = np.argsort([p @ normal for p in positions])
+    slices = [slices[i] for i in order]
+    positions = [positions[i] for i in order]
+    if len(slices) > 1:
+        gaps = np.diff([p @ normal for p in positions])
+        if np.any(gaps < 1e-3):
+            raise ValueError("several slices share one position (multiple phases/echoes in the series)")
+        step = (positions[-1] - positions[0]) / (len(slices) - 1)
+    else:
+        step = normal * float(first.get("SliceThickness", 1.0) or 1.0)
+    row_spacing, col_spacing = (float(v) for v in first.PixelSpacing)
+    affine = np.eye(4)
+    affine[:3, 0] = row_cos * col_spacing  # along a row = increasing column index
+    affine[:3, 1] = col_cos * row_spacing
+    affine[:3, 2] = step
+    affine[:3, 3] = positions[0]
+    return slices, affine
+
+
+def _volume_dtype(slices: list) -> np.dtype:
+    """Stored integer type when no slice rescales, else float32."""
+    for _, ds in slices:
+        if float(ds.get("RescaleSlope", 1) or 1) != 1 or float(ds.get("RescaleIntercept", 0) or 0) != 0:
+            return np.dtype(np.float32)
+    first = slices[0][1]
+    signed = int(first.get("PixelRepresentation", 0)) == 1
+    bits = int(first.get("BitsAllocated", 16))
+    return np.dtype(f"{'int' if signed else 'uint'}{bits}") if bits in (8, 16, 32) else np.dtype(np.float32)
+
+
+def _decode_slice(volume: np.ndarray, k: int, path: Path, dtype: np.dtype) -> None:
+    ds = pydicom.dcmread(str(path))
+    pixels = ds.pixel_array
+    if dtype.kind == "f":
+        slope = float(ds.get("RescaleSlope", 1) or 1)
+        intercept = float(ds.get("RescaleIntercept", 0) or 0)
+        pixels = pixels.astype(np.float32) * slope + intercept
+    volume[:, :, k] = pixels.T  # (rows, columns) -> (column, row) index order of the affine
+
+
+def load_series(dicom_dir: Path, series_uid: str = None, cache_dir: Path = None, workers: int = DICOM_READ_WORKERS) -> "nib.Nifti1Image":
+    """Load one DICOM series from dicom_dir as a NIfTI image (RAS affine, stored pixel dtype when not rescaled).
+
+    series_uid picks a series when the folder holds several (default: the one with most slices).
+    Raises ValueError for folders the loader cannot turn into one 3D volume.
+    """
+    series = read_headers(dicom_dir, workers)
+    if not series:
+        raise ValueError(f"no DICOM image slices in {dicom_dir}")
+    if series_uid is None:
+        series_uid = max(series, key=lambda uid: len(series[uid]))
+    elif series_uid not in series:
+        raise ValueError(f"series {series_uid} not found in {dicom_dir}")
+    slices = series[series_uid]
+
+    cache_file = Path(cache_dir) / f"{series_uid}.nii.gz" if cache_dir and series_uid else None
+    if cache_file is not None and cache_file.exists():
+        img = nib.load(str(cache_file))
+        if img.shape[2:3] == (len(slices),):
+            return img
+
+    slices, affine = _geometry(slices)
+    dtype = _volume_dtype(slices)
+    first = slices[0][1]
+    volume = np.empty((first.Columns, first.Rows, len(slices)), dtype=dtype)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        # list() re-raises the first decoding error
+        list(pool.map(lambda item: _decode_slice(volume, item[0], item[1][0], dtype), enumerate(slices)))
+
+    affine[:2] *= -1  # DICOM patient space is LPS; NIfTI is RAS
+    img = nib.Nifti1Image(volume, affine)
+    img.header.set_xyzt_units("mm")
+
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp = cache_file.with_name(cache_file.name + ".part.nii.gz")
+        nib.save(img, str(tmp))
+        os.replace(tmp, cache_file)
+    return img
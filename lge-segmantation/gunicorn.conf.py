@@ -0,0 +1,73 @@
+"""
+Prefork serving for server.py:  gunicorn -c gunicorn.conf.py server:app
+Async front end (asgi.py):       gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+The master imports server.py and loads the nnU-Net weights once (preload_app), then forks
+LGE_WORKERS worker processes that share the weight pages copy-on-write. Each worker gets
+pinned torch / OpenMP thread counts so workers do not compete for cores, then runs its
+warm-up inference in the background (GET /ready turns 200 per worker once it is done).
+"""
+
+import gc
+import os
+
+_cpus = os.cpu_count() or 1
+
+workers = int(os.environ.get("LGE_WORKERS", "2"))
+# Threads per worker for torch intra-op and OpenMP/MKL; default splits the cores evenly.
+threads_per_worker = int(os.environ.get("LGE_WORKER_THREADS", str(max(1, _cpus // workers))))
+
+bind = os.environ.get("LGE_BIND", "0.0.0.0:5001")
+preload_app = True
+worker_class = "gthread"
+threads = 4  # HTTP threads per worker; inference itself is serialized by server.INFERENCE_WORKERS
+timeout = 900  # segmentation can take minutes on CPU
+graceful_timeout = 60
+
+# Must be set before torch / OpenMP initialise, i.e. before the app (and torch) is preloaded.
+os.environ.setdefault("LGE_INFERENCE_WORKERS", "1")
+os.environ.setdefault("LGE_ORT_INTRA_THREADS", str(threads_per_worker))  # ONNX backend (LGE_INFERENCE_BACKEND=onnx)
+# server.MEMORY_BUDGET_MB is per process: split its default (3/4 of physical memory) between the workers.
+try:
+    _physical_mb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+except (AttributeError, ValueError, OSError):  # not reported on this platform: leave the budget off
+    _physical_mb = 0
+os.environ.setdefault("LGE_MEMORY_BUDGET_MB", str(_physical_mb * 3 // 4 // workers))
+for _var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"):
+    os.environ[_var] = str(threads_per_worker)
+
+
+def when_ready(server):
+    # Runs in the master after the app is preloaded and before workers are forked.
+    import server as lge_server
+
+    lge_server.preload_model()
+    # Move everything allocated so far out of the GC's reach so collections in the workers
+    # do not touch (and copy) the shared pages.
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    import server as lge_server
+
+    lge_server.PREFORK_WORKERS = server.num_workers  # /model/reload is refused when it cannot reach every worker
+    try:
+        import torch
+    except ImportError:
+        torch = None
+    if torch is not None:
+        torch.set_num_threads(threads_per_worker)
+        try:
+            torch.set_num_interop_threads(1)
+        except RuntimeError:
+            pass  # already set (inter-op pool started in the master)
+        server.log.info("worker %s: %s torch threads", worker.pid, threads_per_worker)
+    # Threads do not survive fork: the warm-up (and the inference pool it starts) belongs to each worker.
+    lge_server.start_warmup()
+
+
+def worker_exit(server, worker):
+    # Archived cases still queued in this worker are written before it exits (bounded by ARCHIVE_DRAIN_SECONDS).
+    import server as lge_server
+
+    lge_server._archiver.drain()
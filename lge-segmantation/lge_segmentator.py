@@ -1,17 +1,34 @@
 import argparse
+import json
+import os
 import tempfile
+import time
+from concurrent.futures import FIRST_COMPLETED, CancelledError, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
 from pathlib import Path
 
 import nibabel as nib
 from totalsegmentator.python_api import totalsegmentator
 
+from dicom_loader import load_series
+
 # ========= НАСТРОЙКИ =========
 DICOM_DIR = Path(r"/Users/denisbelov/rep_work/denis-belov/3d-render/lge-segmantation/LGE3D_TS/dicom_selected_series")              # папка с DICOM серии 3D LGE
 OUT_DIR = Path(r"/Users/denisbelov/rep_work/denis-belov/3d-render/lge-segmantation/LGE3D_TS/result")                   # выходная папка
 
 DEVICE = "gpu"  # или "cpu"
+DICOM_CACHE_DIR = OUT_DIR.parent / "dicom_cache"  # загруженные серии по SeriesInstanceUID (None — без кэша)
+
+# Batch mode (--batch ROOT / --manifest FILE)
+BATCH_WORKERS = 1            # параллельных процессов сегментации (--workers)
+BATCH_SETTLE_SECONDS = 30    # серия в hot folder считается пришедшей, если файлы не менялись столько секунд
+BATCH_POLL_SECONDS = 10      # период пересканирования hot folder (--watch)
 # ============================
 
+DICOM_SUFFIXES = (".dcm", ".dicom", ".ima")
+NIFTI_SUFFIXES = (".nii", ".nii.gz")
+
 
 def _reorient_nifti_to_canonical(path_in: Path, path_out: Path) -> None:
     """Load NIfTI, reorient to closest canonical (like DICOM conversion), save. Fixes frontend NIfTI for TotalSegmentator."""
@@ -20,11 +37,326 @@ def _reorient_nifti_to_canonical(path_in: Path, path_out: Path) -> None:
     nib.save(img_can, str(path_out))
 
 
+def _convert_dicom(dicom_dir: Path, nifti_file: Path) -> None:
+    """DICOM series folder -> canonical NIfTI, loaded in process (dicom_loader, cached by SeriesInstanceUID).
+    Series the loader cannot build (multi-frame, mixed phases) fall back to TotalSegmentator's dcm2niix wrapper."""
+    try:
+        img = load_series(dicom_dir, cache_dir=DICOM_CACHE_DIR)
+    except ValueError as e:
+        print(f"  dicom_loader: {e!s}; конвертация через dcm2niix")
+        from totalsegmentator.dicom_io import dcm_to_nifti
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            dcm_to_nifti(dicom_dir, nifti_file, Path(tmp_dir), verbose=False)
+        return
+    nib.save(nib.as_closest_canonical(img), str(nifti_file))
+
+
+def _segment_heart(nifti_file: Path, seg_dir: Path, device: str) -> Path:
+    """Run TotalSegmentator heart ROI on a NIfTI file; returns the mask path."""
+    totalsegmentator(
+        input=str(nifti_file),
+        output=str(seg_dir),
+        task="total_mr",
+        roi_subset=["heart"],
+        ml=False,
+        device=device,
+        quiet=True,
+        verbose=False,
+    )
+    return seg_dir / "heart.nii.gz"
+
+
+def _is_nifti(path: Path) -> bool:
+    return path.name.lower().endswith(NIFTI_SUFFIXES)
+
+
+def _is_dicom(path: Path) -> bool:
+    """DICOM by extension, or by the "DICM" marker after the 128-byte preamble (extension-less exports)."""
+    if path.suffix.lower() in DICOM_SUFFIXES:
+        return True
+    try:
+        with open(path, "rb") as f:
+            f.seek(128)
+            return f.read(4) == b"DICM"
+    except OSError:
+        return False
+
+
+def _find_series(root: Path) -> dict:
+    """Cases under root: every NIfTI file and every folder that directly contains DICOM files.
+
+    Returns {case_id: (input_path, newest_mtime)}; case_id is the path relative to root.
+    """
+    cases = {}
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        folder = Path(dirpath)
+        files = [folder / name for name in sorted(filenames) if not name.startswith(".")]
+        for path in filter(_is_nifti, files):
+            cases[path.relative_to(root).as_posix()] = (path, path.stat().st_mtime)
+        others = [path for path in files if not _is_nifti(path)]
+        # One header read per folder: extension-less exports are recognised by their first file.
+        dicom_files = [path for path in others if path.suffix.lower() in DICOM_SUFFIXES]
+        if not dicom_files and others and _is_dicom(others[0]):
+            dicom_files = others
+        if dicom_files:
+            newest = max(p.stat().st_mtime for p in dicom_files)
+            cases[folder.relative_to(root).as_posix() or "."] = (folder, newest)
+    return cases
+
+
+def _case_out_dir(out_root: Path, case_id: str) -> Path:
+    """OUT_DIR/<case_id with "/" -> "__" and without the NIfTI suffix>/"""
+    name = "root" if case_id == "." else case_id.replace("/", "__")
+    for suffix in NIFTI_SUFFIXES[::-1]:  # .nii.gz before .nii
+        if name.lower().endswith(suffix):
+            name = name[: -len(suffix)]
+            break
+    return out_root / name
+
+
+def _run_case(input_path: str, out_dir: str, device: str) -> str:
+    """Convert (DICOM) and segment one case into out_dir (same layout as the single-case run). Worker process entry."""
+    input_path, out_dir = Path(input_path), Path(out_dir)
+    seg_dir = out_dir / "segmentation"
+    seg_dir.mkdir(parents=True, exist_ok=True)
+    nifti_file = out_dir / "lge_volume.nii.gz"
+    if input_path.is_dir():
+        _convert_dicom(input_path, nifti_file)
+    else:
+        _reorient_nifti_to_canonical(input_path, nifti_file)
+    mask_file = _segment_heart(nifti_file, seg_dir, device)
+    if not mask_file.exists():
+        raise FileNotFoundError(f"mask not created: {mask_file}")
+    return str(mask_file)
+
+
+def _worker_thread_env(threads: int) -> None:
+    # Spawned workers import torch (through totalsegmentator) while unpickling this module, before the pool
+    # initializer runs: OpenMP / MKL only see limits that are already in the environment they inherit.
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS"):
+        os.environ[var] = str(threads)
+
+
+def _init_worker(threads: int) -> None:
+    # torch is imported by now; size its intra-op pool explicitly as well.
+    import torch
+
+    torch.set_num_threads(threads)
+    try:
+        torch.set_num_interop_threads(1)
+    except RuntimeError:
+        pass  # inter-op pool already started
+
+
+class _Manifest:
+    """Per-case status of a batch run, saved as JSON after every change so an interrupted run can resume.
+
+    {"root": ..., "out_dir": ..., "cases": {case_id: {"input", "status", "output", "error", "started", "seconds", "finished", "attempts"}}}
+    status: pending -> running -> done | failed. "running" entries left by a killed run are reset to pending on load.
+    A hand-written manifest may list "cases" as a plain list of input paths (DICOM folders or NIfTI files).
+    """
+
+    def __init__(self, path: Path, root: Path = None, out_dir: Path = None):
+        self.path = path
+        self.data = {"root": None, "out_dir": None, "cases": {}}
+        if path.exists():
+            self.data = json.loads(path.read_text(encoding="utf-8"))
+            cases = self.data.setdefault("cases", {})
+            if isinstance(cases, list):
+                self.data["cases"] = {}
+                for input_path in cases:
+                    self.add(Path(input_path).as_posix().strip("/"), Path(input_path))
+            for case in self.data["cases"].values():
+                if case.setdefault("status", "pending") == "running":
+                    case["status"] = "pending"
+        if root is not None:
+            self.data["root"] = str(root)
+        if out_dir is not None:
+            self.data["out_dir"] = str(out_dir)
+        if not self.data.get("out_dir"):
+            self.data["out_dir"] = str(path.parent)
+
+    @property
+    def root(self):
+        return Path(self.data["root"]) if self.data.get("root") else None
+
+    @property
+    def out_dir(self) -> Path:
+        return Path(self.data["out_dir"])
+
+    @property
+    def cases(self) -> dict:
+        return self.data["cases"]
+
+    def add(self, case_id: str, input_path: Path) -> bool:
+        if case_id in self.cases:
+            return False
+        self.cases[case_id] = {"input": str(input_path), "status": "pending", "output": None, "error": None, "seconds": None, "finished": None}
+        return True
+
+    def set(self, case_id: str, **fields) -> None:
+        self.cases[case_id].update(fields)
+        self.save()
+
+    def save(self) -> None:
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = self.path.with_name(self.path.name + ".part")
+        tmp.write_text(json.dumps(self.data, indent=2, ensure_ascii=False), encoding="utf-8")
+        os.replace(tmp, self.path)  # atomic: a crash never leaves a truncated manifest
+
+    def counts(self) -> dict:
+        counts = {}
+        for case in self.cases.values():
+            counts[case["status"]] = counts.get(case["status"], 0) + 1
+        return counts
+
+
+def _scan(manifest: _Manifest, settle_seconds: float) -> int:
+    """Add newly arrived series under the manifest root; series still being copied (files changed within
+    settle_seconds) are picked up by a later scan. Returns the number of new cases."""
+    if manifest.root is None:
+        return 0
+    now = time.time()
+    added = 0
+    for case_id, (input_path, newest) in _find_series(manifest.root).items():
+        if now - newest >= settle_seconds and manifest.add(case_id, input_path):
+            added += 1
+    if added:
+        manifest.save()
+    return added
+
+
+def run_batch(manifest: _Manifest, workers: int, device: str, watch: float = None, settle_seconds: float = 0,
+              retry_failed: bool = False) -> dict:
+    """Segment every pending case of the manifest on a process pool. With watch (seconds), keep rescanning
+    the root for new series until interrupted. Returns the status counts."""
+    if retry_failed:
+        for case in manifest.cases.values():
+            if case["status"] == "failed":
+                case.update(status="pending", attempts=0)
+    _scan(manifest, settle_seconds)
+    manifest.save()
+    print(f"Манифест: {manifest.path}  {manifest.counts()}")
+
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    _worker_thread_env(threads)
+
+    def new_pool():
+        # spawn: CUDA cannot be initialised in forked children
+        return ProcessPoolExecutor(max_workers=workers, mp_context=get_context("spawn"), initializer=_init_worker, initargs=(threads,))
+
+    def settle(future, case_id) -> bool:
+        """Record a finished case in the manifest; True if its worker process died."""
+        case = manifest.cases[case_id]
+        seconds = time.time() - case["started"]
+        try:
+            output = future.result()
+        except (BrokenProcessPool, CancelledError):
+            # A worker died (e.g. killed for memory); every case in flight fails with it. Requeue them
+            # once, so only a case that crashes its worker twice ends up failed.
+            attempts = case.get("attempts", 0) + 1
+            status = "failed" if attempts >= 2 else "pending"
+            manifest.set(case_id, status=status, attempts=attempts, error="worker process died", seconds=seconds)
+            print(f"  ✗ {case_id}: worker process died" + (", requeued" if status == "pending" else ""))
+            return True
+        except Exception as e:
+            manifest.set(case_id, status="failed", error=str(e), seconds=seconds, finished=time.time())
+            print(f"  ✗ {case_id}: {e!s}")
+        else:
+            manifest.set(case_id, status="done", output=output, error=None, seconds=seconds, finished=time.time())
+            print(f"  ✓ {case_id} ({seconds:.1f}s)")
+        return False
+
+    pool = new_pool()
+    running = {}
+    next_scan = time.monotonic() + (watch or 0)
+    try:
+        while True:
+            queued = set(running.values())
+            for case_id, case in manifest.cases.items():
+                if len(running) >= workers:
+                    break
+                if case["status"] != "pending" or case_id in queued:
+                    continue
+                out_dir = _case_out_dir(manifest.out_dir, case_id)
+                future = pool.submit(_run_case, case["input"], str(out_dir), device)
+                running[future] = case_id
+                manifest.set(case_id, status="running", started=time.time())
+                print(f"  → {case_id}")
+            if not running and not watch:
+                break
+            timeout = max(0.0, next_scan - time.monotonic()) if watch else None
+            if running:
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                done = ()
+                time.sleep(timeout)
+            broken = False
+            for future in done:
+                broken |= settle(future, running.pop(future))
+            if broken:
+                # The rest of the dead pool's futures fail (or finished just before the crash): settle them all
+                # now, so none is left to tear down the replacement pool on a later pass.
+                for future, case_id in running.items():
+                    settle(future, case_id)
+                running.clear()
+                pool.shutdown(wait=False, cancel_futures=True)
+                pool = new_pool()
+            if watch and time.monotonic() >= next_scan:
+                added = _scan(manifest, settle_seconds)
+                if added:
+                    print(f"Новых серий: {added}")
+                next_scan = time.monotonic() + watch
+    except KeyboardInterrupt:
+        print("\nОстановка: незавершённые серии будут обработаны при следующем запуске")
+        pool.shutdown(wait=False, cancel_futures=True)
+    else:
+        pool.shutdown()
+    counts = manifest.counts()
+    print(f"Итого: {counts}")
+    return counts
+
+
+def _main_batch(args) -> None:
+    root = args.batch.resolve() if args.batch else None
+    if root is not None and not root.is_dir():
+        raise NotADirectoryError(f"Batch root not found: {root}")
+    manifest_path = args.manifest or OUT_DIR / "manifest.json"
+    if root is None and not manifest_path.exists():
+        raise FileNotFoundError(f"Manifest not found: {manifest_path}")
+    manifest = _Manifest(manifest_path.resolve(), root=root, out_dir=None if manifest_path.exists() else OUT_DIR)
+    counts = run_batch(
+        manifest,
+        workers=max(1, args.workers),
+        device=DEVICE,
+        watch=args.watch,
+        settle_seconds=args.settle if args.watch else 0,
+        retry_failed=args.retry_failed,
+    )
+    if counts.get("failed"):
+        raise SystemExit(1)
+
+
 def main():
     parser = argparse.ArgumentParser(description="LGE heart segmentation (DICOM or NIfTI input)")
     parser.add_argument("-n", "--nifti", type=Path, metavar="PATH", help="Use this NIfTI file as input (skip DICOM conversion)")
+    batch = parser.add_argument_group("batch mode")
+    batch.add_argument("--batch", type=Path, metavar="ROOT", help="Segment every series under ROOT (DICOM folders and NIfTI files)")
+    batch.add_argument("--manifest", type=Path, metavar="FILE", help="Status manifest (default OUT_DIR/manifest.json); resumes from it")
+    batch.add_argument("-w", "--workers", type=int, default=BATCH_WORKERS, help="Parallel segmentation processes")
+    batch.add_argument("--watch", type=float, nargs="?", const=BATCH_POLL_SECONDS, metavar="SECONDS",
+                       help="Keep watching ROOT as a hot folder, rescanning every SECONDS")
+    batch.add_argument("--settle", type=float, default=BATCH_SETTLE_SECONDS, metavar="SECONDS",
+                       help="With --watch: a series is taken once its files are unchanged for SECONDS")
+    batch.add_argument("--retry-failed", action="store_true", help="Run failed cases of the manifest again")
     args = parser.parse_args()
 
+    if args.batch is not None or args.manifest is not None:
+        _main_batch(args)
+        return
+
     OUT_DIR.mkdir(parents=True, exist_ok=True)
     seg_dir = OUT_DIR / "segmentation"
     seg_dir.mkdir(parents=True, exist_ok=True)
@@ -47,27 +379,13 @@ def main():
         print(f"Выход: {OUT_DIR}")
         # Конвертация DICOM -> NIfTI
         print("\n[1/2] Конвертация DICOM -> NIfTI...")
-        from totalsegmentator.dicom_io import dcm_to_nifti
-        import tempfile
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            dcm_to_nifti(DICOM_DIR, nifti_file, Path(tmp_dir), verbose=False)
+        _convert_dicom(DICOM_DIR, nifti_file)
         print(f"  ✓ Сохранено: {nifti_file}")
 
     # Сегментация сердца
     step = "[2/2]" if args.nifti is None else "[1/1]"
     print(f"\n{step} Сегментация сердца (TotalSegmentator)...")
-    totalsegmentator(
-        input=str(nifti_file),
-        output=str(seg_dir),
-        task="total_mr",
-        roi_subset=["heart"],
-        ml=False,
-        device=DEVICE,
-        quiet=True,
-        verbose=False,
-    )
-
-    mask_file = seg_dir / "heart.nii.gz"
+    mask_file = _segment_heart(nifti_file, seg_dir, DEVICE)
 
     if mask_file.exists():
         print(f"  ✓ Маска сердца: {mask_file}")
@@ -0,0 +1,146 @@
+"""
+ONNX Runtime (CPU) backend for the warm nnU-Net predictor in server.py (INFERENCE_BACKEND = "onnx").
+
+    install(predictor, model_folder, folds, cache_dir=Path("LGE3D_TS/onnx_cache"), intra_op_threads=4)
+
+Only the network is replaced: predictor.network becomes an OnnxNetwork, so nnU-Net's preprocessing, Gaussian-weighted
+sliding window and resampling run unchanged and each tile's forward pass runs in ONNX Runtime's CPU execution
+provider. Every fold is exported once (fixed patch size, dynamic batch) to cache_dir. The file name holds a digest of
+the checkpoint (path, size, mtime), the torch version and the opset, so new weights or a torch upgrade lead to a fresh
+export. Each export is compared with torch on a random patch before it is used.
+
+ONNX Runtime sessions are not fork-safe (their thread pools do not survive fork), so install() only exports and checks
+the files: OnnxNetwork opens its sessions on the first forward pass in each process. A predictor loaded in a gunicorn
+master (preload) therefore carries no session into the forked workers; each worker opens its own.
+"""
+
+import hashlib
+import os
+import threading
+import time
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+import torch
+
+ONNX_OPSET = 17
+# Export check: largest fraction of voxels of a random patch whose argmax label may differ from torch.
+EXPORT_MAX_LABEL_MISMATCH = 0.001
+
+
+def _cache_path(cache_dir: Path, model_folder: Path, fold, checkpoint: Path) -> Path:
+    stat = checkpoint.stat()
+    key = f"{checkpoint.resolve()}|{stat.st_size}|{stat.st_mtime_ns}|{torch.__version__}|{ONNX_OPSET}"
+    digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+    return Path(cache_dir) / f"{model_folder.parent.name}_{model_folder.name}_fold{fold}_{digest}.onnx"
+
+
+def session_options(intra_op_threads: int = 0, inter_op_threads: int = 1) -> "ort.SessionOptions":
+    """Sequential execution, all graph optimizations; 0 intra-op threads = ONNX Runtime default (one per core)."""
+    options = ort.SessionOptions()
+    options.intra_op_num_threads = intra_op_threads
+    options.inter_op_num_threads = inter_op_threads
+    options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+    options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+    return options
+
+
+def _session(path: Path, options) -> "ort.InferenceSession":
+    return ort.InferenceSession(str(path), options, providers=["CPUExecutionProvider"])
+
+
+def label_mismatch(expected: np.ndarray, actual: np.ndarray, axis: int = 1) -> float:
+    """Fraction of voxels whose argmax label over the class axis differs."""
+    return float(np.mean(np.argmax(expected, axis=axis) != np.argmax(actual, axis=axis)))
+
+
+def export_network(network, state_dict: dict, patch_size: tuple, channels: int, path: Path, options) -> None:
+    """Export network with state_dict loaded to path; raises RuntimeError if it disagrees with torch on a random patch."""
+    network.load_state_dict(state_dict)
+    network = network.to("cpu").eval()
+    x = torch.randn(1, channels, *patch_size, generator=torch.Generator().manual_seed(0))
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(path.name + ".part")
+    t0 = time.perf_counter()
+    with torch.no_grad():
+        torch.onnx.export(
+            network,
+            (x,),
+            str(tmp),
+            input_names=["input"],
+            output_names=["logits"],
+            dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+            opset_version=ONNX_OPSET,
+            do_constant_folding=True,
+        )
+        expected = network(x).numpy()
+    # Checked with a throwaway session, released before install() returns (this may run in a prefork master).
+    actual = _session(tmp, options).run(None, {"input": x.numpy()})[0]
+    mismatch = label_mismatch(expected, actual)
+    if mismatch > EXPORT_MAX_LABEL_MISMATCH:
+        tmp.unlink()
+        raise RuntimeError(
+            f"ONNX export of {path.name} disagrees with torch on {mismatch:.2%} of a test patch "
+            f"(max logit difference {np.abs(expected - actual).max():.3g})"
+        )
+    os.replace(tmp, path)
+    print(f"Exported {path.name} in {time.perf_counter() - t0:.1f}s (label mismatch on a test patch: {mismatch:.4%})")
+
+
+class OnnxNetwork(torch.nn.Module):
+    """Stand-in for the nnU-Net network: forward runs ONNX Runtime, load_state_dict switches to that fold's model.
+    Sessions are opened on first use per process (see the module docstring)."""
+
+    def __init__(self, paths: dict, options):
+        super().__init__()
+        self._paths = paths  # id(state dict in predictor.list_of_parameters) -> ONNX file
+        self._options = options
+        self._key = next(iter(paths))
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._pid = None
+
+    def load_state_dict(self, state_dict, *args, **kwargs):
+        self._key = id(state_dict)
+
+    def _session(self) -> "ort.InferenceSession":
+        with self._lock:
+            if self._pid != os.getpid():  # first use, or first use after a fork
+                self._sessions, self._pid = {}, os.getpid()
+            if self._key not in self._sessions:
+                self._sessions[self._key] = _session(self._paths[self._key], self._options)
+            return self._sessions[self._key]
+
+    def forward(self, x):
+        tile = np.ascontiguousarray(x.detach().cpu().numpy(), dtype=np.float32)
+        return torch.from_numpy(self._session().run(None, {"input": tile})[0])
+
+
+def install(
+    predictor,
+    model_folder,
+    folds,
+    cache_dir,
+    intra_op_threads: int = 0,
+    inter_op_threads: int = 1,
+    checkpoint_name: str = "checkpoint_final.pth",
+) -> list:
+    """Swap predictor.network (after initialize_from_trained_model_folder) for an OnnxNetwork, exporting folds that
+    are not cached yet. No session is left open. Returns the ONNX files in use."""
+    from nnunetv2.utilities.label_handling.label_handling import determine_num_input_channels
+
+    model_folder = Path(model_folder)
+    channels = determine_num_input_channels(
+        predictor.plans_manager, predictor.configuration_manager, predictor.dataset_json
+    )
+    patch_size = tuple(predictor.configuration_manager.patch_size)
+    options = session_options(intra_op_threads, inter_op_threads)
+    paths = {}
+    for fold, state_dict in zip(folds, predictor.list_of_parameters):
+        path = _cache_path(cache_dir, model_folder, fold, model_folder / f"fold_{fold}" / checkpoint_name)
+        if not path.exists():
+            export_network(predictor.network, state_dict, patch_size, channels, path, options)
+        paths[id(state_dict)] = path
+    predictor.network = OnnxNetwork(paths, options)
+    return list(paths.values())
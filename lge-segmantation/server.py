@@ -2,64 +2,275 @@
 LGE segmentation web server.
 Accepts volume data (NIfTI bytes or JSON with dimensions/spacing/data),
 runs TotalSegmentator (heart ROI), returns mask as NIfTI bytes for CornerstoneJS.
+The whole request path is in memory: the volume is built, reoriented and segmented
+as nibabel images without temporary NIfTI files.
 """
 
+import atexit
 import base64
+import binascii
+import gzip
+import hashlib
+import importlib
+import importlib.util
+import io
+import itertools
 import json
+import math
+import os
 import platform
-import shutil
-import tempfile
+import queue
+import re
+import select
+import socket
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import OrderedDict
 from pathlib import Path
 
+# Clock for the startup phases reported by /ready (before the third-party imports below).
+_IMPORT_STARTED = time.perf_counter()
+
 import numpy as np
 from flask import Flask, request, Response
 from flask_cors import CORS
 
-from totalsegmentator.python_api import totalsegmentator
-from totalsegmentator.alignment import undo_canonical
+from totalsegmentator.map_to_binary import class_map  # plain dicts, no heavy imports
 
-import SimpleITK as sitk
 
-try:
-    import nibabel as nib
-except ImportError:
-    nib = None
+class _LazyModule:
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(importlib.import_module(self._name), attr)
+
+
+def _lazy_import(name: str):
+    """_LazyModule for name, or None if its top-level package is not installed (checked without importing it)."""
+    if importlib.util.find_spec(name.partition(".")[0]) is None:
+        return None
+    return _LazyModule(name)
+
+
+# Heavy modules load on first use (or in the background warm-up, see start_warmup), so /health answers right away.
+nib = _lazy_import("nibabel")
+# Meshes / contours / centerlines; installed with nnU-Net (TotalSegmentator), None when missing.
+ndimage = _lazy_import("scipy.ndimage")
+sparse = _lazy_import("scipy.sparse")
+csgraph = _lazy_import("scipy.sparse.csgraph")
+measure = _lazy_import("skimage.measure")
+morphology = _lazy_import("skimage.morphology")
 
 try:
-    import torch
-    _mps_available = (
-        platform.system() == "Darwin"
-        and getattr(torch.backends, "mps", None) is not None
-        and torch.backends.mps.is_available()
-    )
-except Exception:
-    _mps_available = False
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+def totalsegmentator(*args, **kwargs):
+    """totalsegmentator.python_api.totalsegmentator, imported on first call (it pulls in torch and nnU-Net)."""
+    from totalsegmentator.python_api import totalsegmentator as run
+
+    return run(*args, **kwargs)
+
+
+def undo_canonical(img_can, img_orig):
+    from totalsegmentator.alignment import undo_canonical as undo
+
+    return undo(img_can, img_orig)
+
 
 app = Flask(__name__)
 CORS(app)
 
 # "gpu" = CUDA (NVIDIA); "mps" = Apple Silicon GPU (M1/M2/M3/M4); "cpu" = CPU. TotalSegmentator uses PyTorch.
-DEVICE = "mps" if _mps_available else ("cpu" if platform.system() == "Darwin" else "gpu")
+# Unset: probed on first use (that imports torch), see _device().
+DEVICE = os.environ.get("LGE_DEVICE") or None
 TASK = "total_mr"
 ROI_SUBSET = ["heart"]
 
-print(f"Using device: {DEVICE}")
+# Every mode is derived from one heartchambers_highres inference (cached per volume), so switching is a label remap:
+# "four_chambers": one multi-label mask (1=left atrium, 2=left ventricle, 3=right atrium, 4=right ventricle).
+# "left_only": left atrium + left ventricle as one binary mask (legacy).
+# "heart": whole heart (myocardium + 4 chambers) as one binary mask.
+HEART_MODES = ("four_chambers", "left_only", "heart")
+HEART_MODE = "four_chambers"  # default; requests can pick another with ?mode=
+# Mask file name per mode in the archived case folder.
+ARCHIVE_MASK_NAMES = {"four_chambers": "heart_four_chambers.nii", "left_only": "heart_left.nii", "heart": "heart.nii"}
+
+# Voxel types accepted from the frontend.
+VOLUME_DTYPES = ("float32", "uint16", "int16", "uint8")
+# Binary upload: raw voxel bytes as the body; dimensions/spacing/origin/dtype in the query string.
+RAW_VOLUME_CONTENT_TYPE = "application/x-lge-volume"
+# Bytes per read() for request streams without readinto() (the chunk is copied into the voxel array).
+RAW_READ_CHUNK_BYTES = 1 << 20
+
+# Compact mask response encodings the client can ask for with ?encoding= (see _encode_mask).
+MASK_ENCODINGS = ("bbox", "rle", "packed")
 
-# "four_chambers": run heartchambers_highres and return one multi-label mask (1=left atrium, 2=left ventricle, 3=right atrium, 4=right ventricle).
-# "left_only": same task but merge only left atrium + left ventricle into one binary mask (legacy).
-HEART_MODE = "four_chambers"  # or "left_only"
+# Surface meshes (POST /segment/mesh): marching cubes per label, vertex-clustering decimation down to
+# MESH_MAX_FACES triangles per label, then MESH_SMOOTH_ITERATIONS Taubin smoothing passes (no shrinkage).
+MESH_CONTENT_TYPE = "application/x-lge-mesh"
+MESH_MAX_FACES = 40000
+MESH_SMOOTH_ITERATIONS = 15
+MESH_SMOOTH_LAMBDA = 0.5
+MESH_SMOOTH_MU = -0.53
+# Contours (POST /segment/contours): outlines per slice and label along one frontend axis (default 2, i.e. the
+# slices of the stack), vertex coordinates in half-voxel steps delta-encoded as int8.
+CONTOUR_CONTENT_TYPE = "application/x-lge-contours"
+CONTOUR_DEFAULT_AXIS = 2
+# Centerlines (POST /centerline): 3D thinning of one label, radii from the distance transform; terminal
+# branches shorter than CENTERLINE_MIN_BRANCH_MM (thinning spurs) are pruned.
+CENTERLINE_MIN_BRANCH_MM = 5.0
+# Meshes / centerlines kept in memory per (volume, mode, parameters), least recently used evicted first.
+DERIVED_CACHE_MAX_ENTRIES = 32
 
 # Result folder (same layout as lge_segmentator.py: result/segmentation/heart.nii.gz)
 RESULT_DIR = Path(__file__).resolve().parent / "LGE3D_TS" / "result"
 
+# Archival of each case (input volume + mask) into RESULT_DIR/<timestamp>_<id>/, written by a background
+# thread after the response is built. ARCHIVE_COMPRESSION: "gzip" (.nii.gz, ARCHIVE_GZIP_LEVEL 1-9) or "none" (.nii).
+ARCHIVE_RESULTS = True
+ARCHIVE_COMPRESSION = "gzip"
+ARCHIVE_GZIP_LEVEL = 1
+# Cases waiting to be written; beyond this new cases are skipped (logged) rather than delaying responses.
+ARCHIVE_MAX_PENDING = 8
+# At process exit (atexit, gunicorn worker_exit) wait at most this many seconds for queued cases to be written.
+ARCHIVE_DRAIN_SECONDS = 30
+
+# Coarse-to-fine mode: the heart bounding box is found first, then the high-res chamber model runs only on that box
+# padded by ROI_CROP_MARGIN_MM (falls back to the full volume if no heart is found). With the warm model the box comes
+# from the resident crop model's pass (no extra inference); per call, from a fast low-resolution total_mr pass.
+ROI_CROP = False
+ROI_CROP_MARGIN_MM = 15.0
+
+# Content-addressed mask cache: identical volumes (voxels + geometry + task) return the stored label map
+# without inference. Stored on disk next to RESULT_DIR so it survives restarts; LRU-evicted beyond the limit.
+MASK_CACHE = True
+MASK_CACHE_DIR = RESULT_DIR.parent / "mask_cache"
+MASK_CACHE_MAX_ENTRIES = 64
+# Part of every key: bumped when the pipeline's output changes, so masks stored by an older version are not served.
+MASK_CACHE_VERSION = 2
+
+# Inference worker pool: at most INFERENCE_WORKERS segmentations run at once (1 with WARM_MODEL: the resident
+# predictors run one inference at a time); the rest wait in a FIFO queue where "interactive" requests (/segment,
+# default for jobs) go before "batch" jobs.
+INFERENCE_WORKERS = int(os.environ.get("LGE_INFERENCE_WORKERS", "1"))
+JOB_LANES = {"interactive": 0, "batch": 1}
+# Seconds between keepalive comments on an idle /segment/stream connection.
+SSE_KEEPALIVE_SECONDS = 15
+# /metrics: stage latency histogram buckets (seconds). METRICS_TRACEMALLOC records Python allocation peaks per
+# stage (tracemalloc: Python objects and numpy buffers only, not torch/OpenMP/ONNX Runtime native memory;
+# process-wide, so concurrent requests share the numbers; adds allocation overhead).
+METRICS_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+METRICS_TRACEMALLOC = os.environ.get("LGE_METRICS_TRACEMALLOC", "0") == "1"
+# Finished jobs (and their masks) are kept this many seconds for GET /segment/jobs/<id>/result.
+JOB_RESULT_TTL = 3600
+
+
+def _physical_memory_mb() -> int:
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // 2**20
+    except (AttributeError, ValueError, OSError):  # not reported on this platform
+        return 0
+
+
+# Admission control. At most ADMISSION_MAX_QUEUED requests wait for an inference worker; beyond that new ones get
+# 429 with Retry-After. Every admitted request is charged an estimate of its peak memory (voxels x (input itemsize +
+# PIPELINE_BYTES_PER_VOXEL)), known from dims x dtype before the body is decoded. Requests that would take the
+# in-flight total over MEMORY_BUDGET_MB get 503 with Retry-After; a single volume over MAX_REQUEST_MEMORY_MB (or the
+# whole budget) gets 413. The budget is per process (gunicorn.conf.py divides the default by LGE_WORKERS).
+# 0 disables a limit.
+ADMISSION_MAX_QUEUED = int(os.environ.get("LGE_MAX_QUEUED", "8"))
+MEMORY_BUDGET_MB = int(os.environ.get("LGE_MEMORY_BUDGET_MB", str(_physical_memory_mb() * 3 // 4)))
+MAX_REQUEST_MEMORY_MB = int(os.environ.get("LGE_MAX_REQUEST_MEMORY_MB", "0"))
+# Rough nnU-Net peak per voxel besides the input: float32 model input plus 8-class float32 logits at network and
+# original resolution.
+PIPELINE_BYTES_PER_VOXEL = 72
+# Retry-After before any inference has been timed (afterwards: queue length x mean inference time).
+RETRY_AFTER_DEFAULT_SECONDS = 30
+# Per-request deadline: seconds from arrival. Requests still queued when it passes are dropped before inference (504).
+DEADLINE_HEADER = "X-Request-Timeout"
+# How often a blocking request checks whether its client has disconnected (which cancels its job).
+DISCONNECT_POLL_SECONDS = 1.0
+
+# Warm-model mode: keep the heartchambers_highres nnU-Net predictor resident and reuse it for every
+# request instead of letting totalsegmentator() load weights / build the predictor on each call.
+WARM_MODEL = True
+# Load the predictor at startup (True) or on the first request (False).
+WARM_MODEL_PRELOAD = True
+# gunicorn worker processes serving this app (set by gunicorn.conf.py post_fork). POST /model/reload reloads only
+# the process that handles it, so it is refused (409) when there are several: restart gunicorn instead.
+PREFORK_WORKERS = 1
+
+# Startup. The server answers /health as soon as this module is imported; torch, nnU-Net and the weights are loaded
+# by a background warm-up (start_warmup) that ends with one inference on a synthetic WARMUP_SHAPE volume so the
+# first real request does not pay for lazy allocations. GET /ready returns 200 only after that (503 before).
+WARMUP_INFERENCE = os.environ.get("LGE_WARMUP", "1") == "1"
+WARMUP_SHAPE = tuple(int(v) for v in os.environ.get("LGE_WARMUP_SHAPE", "64,64,48").split(","))
+WARMUP_SPACING_MM = 1.5
+
+# TotalSegmentator model behind task "heartchambers_highres" (see totalsegmentator.python_api).
+CHAMBERS_TASK_ID = 301
+CHAMBERS_TRAINER = "nnUNetTrainer"
+CHAMBERS_PLANS = "nnUNetPlans"
+CHAMBERS_MODEL = "3d_fullres"
+CHAMBERS_FOLDS = (0,)
+CHAMBERS_STEP_SIZE = 0.5  # sliding-window tile step (TotalSegmentator default)
+# The warm path reproduces what totalsegmentator(task="heartchambers_highres") does around that model (its task config,
+# "robust_crop"): the 3 mm "total" model (CROP_*) segments the volume resampled to CROP_SPACING_MM, the chamber model
+# runs on the CHAMBERS_CROP_CLASSES box padded by CHAMBERS_CROP_ADDON_MM (voxels cast to int32, as TotalSegmentator
+# does), and labels outside CHAMBERS_REMOVE_OUTSIDE_CLASSES dilated by CHAMBERS_REMOVE_OUTSIDE_DILATION_MM are removed.
+# An empty crop gives an empty label map.
+CROP_TASK = "total"
+CROP_TASK_ID = 297
+CROP_TRAINER = "nnUNetTrainer_4000epochs_NoMirroring"
+CROP_FOLDS = (0,)
+CROP_SPACING_MM = 3.0
+CROP_RESAMPLING_ORDER = 1
+CHAMBERS_CROP_CLASSES = ("heart",)
+CHAMBERS_CROP_ADDON_MM = 20.0
+CHAMBERS_REMOVE_OUTSIDE_CLASSES = ("heart", "aorta", "inferior_vena_cava")
+CHAMBERS_REMOVE_OUTSIDE_DILATION_MM = 10.0
 
-def _reorient_to_canonical(path_in: Path, path_out: Path) -> None:
-    """Reorient NIfTI to canonical (RAS) using SimpleITK. Fixes frontend NIfTI for TotalSegmentator."""
-    img = sitk.ReadImage(str(path_in))
-    orient = sitk.DICOMOrientImageFilter()
-    orient.SetDesiredCoordinateOrientation("RAS")
-    img_ras = orient.Execute(img)
-    sitk.WriteImage(img_ras, str(path_out))
+# Warm predictor backend for the sliding-window forward passes: "torch" (PyTorch eager on DEVICE) or "onnx" (the network
+# is exported to ONNX once, cached in ONNX_CACHE_DIR, and run by ONNX Runtime's CPU execution provider; always on the CPU,
+# see onnx_backend.py). ONNX_INTRA_OP_THREADS 0 = ONNX Runtime's default (one thread per physical core).
+INFERENCE_BACKEND = os.environ.get("LGE_INFERENCE_BACKEND", "torch")
+INFERENCE_BACKENDS = ("torch", "onnx")
+ONNX_CACHE_DIR = RESULT_DIR.parent / "onnx_cache"
+ONNX_INTRA_OP_THREADS = int(os.environ.get("LGE_ORT_INTRA_THREADS", "0"))
+ONNX_INTER_OP_THREADS = int(os.environ.get("LGE_ORT_INTER_THREADS", "1"))
+
+
+def _device() -> str:
+    """DEVICE, probing torch for Apple MPS / CUDA the first time when it is not set (CPU if neither)."""
+    global DEVICE
+    if DEVICE is None:
+        try:
+            import torch
+
+            mps = (
+                platform.system() == "Darwin"
+                and getattr(torch.backends, "mps", None) is not None
+                and torch.backends.mps.is_available()
+            )
+            cuda = torch.cuda.is_available()
+        except Exception:
+            mps = cuda = False
+        DEVICE = "mps" if mps else ("gpu" if cuda else "cpu")
+        print(f"Using device: {DEVICE}")
+    return DEVICE
+
+
+def _reorient_to_canonical(img: "nib.Nifti1Image") -> "nib.Nifti1Image":
+    """Reorient image to canonical (RAS) in memory. Fixes frontend NIfTI for TotalSegmentator."""
+    return nib.as_closest_canonical(img)
 
 
 # Order for four_chambers: 1=left atrium, 2=left ventricle, 3=right atrium, 4=right ventricle (match TotalSegmentator filenames).
@@ -69,73 +280,447 @@ HEART_CHAMBER_FILES = [
     ("heart_atrium_right.nii.gz", 3),
     ("heart_ventricle_right.nii.gz", 4),
 ]
+# Voxels remapped per step when merging chamber labels (bounds the lookup temporaries to ~8 bytes x this).
+MERGE_CHUNK_VOXELS = 1 << 20
+# TotalSegmentator label name -> class id in the heartchambers_highres label map.
+CHAMBER_CLASS_IDS = {name: idx for idx, name in class_map["heartchambers_highres"].items()}
+# Same for the crop model's label map.
+CROP_CLASS_IDS = {name: idx for idx, name in class_map[CROP_TASK].items()}
+# Classes merged into the "heart" mode mask (aorta and pulmonary artery excluded).
+WHOLE_HEART_CLASSES = ("heart_myocardium", "heart_atrium_left", "heart_ventricle_left", "heart_atrium_right", "heart_ventricle_right")
+
+
+class _WarmPredictor:
+    """nnU-Net predictor for one TotalSegmentator model (default: heartchambers_highres), loaded once and shared by all
+    requests. licensed=True checks the TotalSegmentator license offline before loading, as totalsegmentator() does."""
+
+    def __init__(
+        self,
+        task_id: int = CHAMBERS_TASK_ID,
+        trainer: str = CHAMBERS_TRAINER,
+        folds: tuple = CHAMBERS_FOLDS,
+        licensed: bool = True,
+        backend: str = None,
+    ):
+        self._lock = threading.Lock()
+        self._predictor = None
+        self.task_id = task_id
+        self.trainer = trainer
+        self.folds = folds
+        self.licensed = licensed
+        self.backend = backend or INFERENCE_BACKEND
+        self.loaded_at = None
+        self.load_seconds = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._predictor is not None
+
+    def _build(self):
+        import torch
+        from nnunetv2.inference.predict_from_raw_data import nnUNetPredictor
+        from nnunetv2.utilities.file_path_utilities import get_output_folder
+        from totalsegmentator.config import has_valid_license_offline, setup_nnunet
+        from totalsegmentator.libs import download_pretrained_weights
+
+        if self.backend not in INFERENCE_BACKENDS:
+            raise ValueError(f"unknown inference backend {self.backend!r}, expected one of {INFERENCE_BACKENDS}")
+        setup_nnunet()
+        if self.licensed:
+            status, message = has_valid_license_offline()
+            if status != "yes":
+                raise RuntimeError(message)
+        download_pretrained_weights(self.task_id)
+        device_name = "cpu" if self.backend == "onnx" else _device()
+        if device_name == "gpu" and not torch.cuda.is_available():
+            print("No GPU detected, warm predictor runs on the CPU")
+            device_name = "cpu"
+        device = torch.device("cuda" if device_name == "gpu" else device_name)
+        predictor = nnUNetPredictor(
+            tile_step_size=CHAMBERS_STEP_SIZE,
+            use_gaussian=True,
+            use_mirroring=False,
+            perform_everything_on_device=device_name != "cpu",
+            device=device,
+            verbose=False,
+            verbose_preprocessing=False,
+            allow_tqdm=False,
+        )
+        model_folder = get_output_folder(self.task_id, self.trainer, CHAMBERS_PLANS, CHAMBERS_MODEL)
+        predictor.initialize_from_trained_model_folder(
+            model_folder, use_folds=self.folds, checkpoint_name="checkpoint_final.pth"
+        )
+        if self.backend == "onnx":
+            import onnx_backend
+
+            onnx_backend.install(
+                predictor, model_folder, self.folds, ONNX_CACHE_DIR, ONNX_INTRA_OP_THREADS, ONNX_INTER_OP_THREADS
+            )
+        elif len(predictor.list_of_parameters) == 1:
+            _load_single_fold(predictor)
+        # Every sliding-window tile is one forward pass: a cancelled job stops at the next tile.
+        predictor.network.register_forward_pre_hook(lambda module, args: _raise_if_cancelled())
+        return predictor
+
+    def load(self, force: bool = False) -> None:
+        """Load the predictor (no-op if already loaded unless force=True)."""
+        with self._lock:
+            if self._predictor is not None and not force:
+                return
+            t0 = time.perf_counter()
+            self._predictor = self._build()
+            self.load_seconds = time.perf_counter() - t0
+            self.loaded_at = time.time()
+            print(f"Warm predictor {self.task_id} ({self.backend}) loaded in {self.load_seconds:.1f}s")
+
+    def reload(self) -> None:
+        self.load(force=True)
+
+    def predict(self, img_can) -> np.ndarray:
+        """Run the model on a canonical (RAS) nibabel image; returns label map (x, y, z), uint8."""
+        self.load()
+        # nnU-Net expects (c, z, y, x) with spacing in the same reversed order (as NibabelIOWithReorient).
+        data = np.asarray(img_can.dataobj, dtype=np.float32).transpose((2, 1, 0))[None]
+        props = {"spacing": [float(z) for z in img_can.header.get_zooms()[:3][::-1]]}
+        with self._lock:
+            seg = self._predictor.predict_single_npy_array(data, props, None, None, False)
+        # Transposed view, no copy: the label map stays in the predictor's (z, y, x) buffer.
+        return np.asarray(seg, dtype=np.uint8).transpose((2, 1, 0))
 
 
-def _run_segmentation(input_nifti_path: Path, out_dir: Path) -> Path:
-    if HEART_MODE in ("four_chambers", "left_only"):
-        task = "heartchambers_highres"
-        roi_subset = None
+def _load_single_fold(predictor) -> None:
+    """Load the only fold's weights into the network once and make nnU-Net's per-prediction reload a no-op.
+
+    nnU-Net calls network.load_state_dict(params) before every prediction. That copies the weights into the
+    parameters again, i.e. writes to the pages a prefork master shares with its workers, so each worker ends up with
+    its own copy of the model. With one fold the copy changes nothing and is skipped; the state dict it was copied
+    from is dropped (it duplicated the weights in memory).
+    """
+    network = getattr(predictor.network, "_orig_mod", predictor.network)  # torch.compile wrapper
+    network.load_state_dict(predictor.list_of_parameters[0])
+    network.load_state_dict = lambda state_dict, *args, **kwargs: None
+    predictor.list_of_parameters = [None]
+
+
+_warm_predictor = _WarmPredictor()
+_crop_predictor = _WarmPredictor(CROP_TASK_ID, CROP_TRAINER, CROP_FOLDS, licensed=False)
+# Load / reload order: the crop model first (it runs first in every request).
+_warm_predictors = (_crop_predictor, _warm_predictor)
+
+
+def _chamber_lut(heart_mode: str) -> np.ndarray:
+    """Lookup table: heartchambers_highres class id -> output label for heart_mode."""
+    lut = np.zeros(256, dtype=np.uint8)
+    if heart_mode == "four_chambers":
+        for fname, label in HEART_CHAMBER_FILES:
+            lut[CHAMBER_CLASS_IDS[fname[: -len(".nii.gz")]]] = label
+    elif heart_mode == "left_only":
+        lut[CHAMBER_CLASS_IDS["heart_atrium_left"]] = 1
+        lut[CHAMBER_CLASS_IDS["heart_ventricle_left"]] = 1
     else:
-        task = TASK
-        roi_subset = ROI_SUBSET
-
-    totalsegmentator(
-        input=str(input_nifti_path),
-        output=str(out_dir),
-        task=task,
-        roi_subset=roi_subset,
-        ml=False,
-        device=DEVICE,
-        quiet=True,
-        verbose=False,
+        for name in WHOLE_HEART_CLASSES:
+            lut[CHAMBER_CLASS_IDS[name]] = 1
+    return lut
+
+
+def _chambers_from_labelmap(labelmap: np.ndarray, heart_mode: str = None, in_place: bool = False) -> np.ndarray:
+    """Map heartchambers_highres class ids to the output labels of heart_mode (default HEART_MODE), uint8.
+
+    Single pass through a lookup table into one uint8 array (in_place=True rewrites labelmap itself),
+    so peak memory is 1 byte/voxel — no per-chamber float64 volumes or accumulator.
+    """
+    lut = _chamber_lut(heart_mode or HEART_MODE)
+    labelmap = np.asarray(labelmap, dtype=np.uint8)
+    out = labelmap if in_place else np.empty_like(labelmap, order="K")
+    src = labelmap.ravel(order="K")  # views for C- or F-contiguous maps (e.g. the predictor's transposed output)
+    dst = out.ravel(order="K")
+    if not (np.shares_memory(src, labelmap) and np.shares_memory(dst, out)):
+        return lut[labelmap]
+    # Chunked so the intp index temporaries of the LUT lookup stay small.
+    for start in range(0, src.size, MERGE_CHUNK_VOXELS):
+        stop = start + MERGE_CHUNK_VOXELS
+        dst[start:stop] = lut[src[start:stop]]
+    return out
+
+
+def _organ_labelmap(img_can: "nib.Nifti1Image") -> np.ndarray:
+    """Warm crop-model pass as totalsegmentator() runs it: resample to CROP_SPACING_MM (int32 voxels), predict, then
+    nearest-neighbour back onto img_can's grid. Returns CROP_TASK class ids (x, y, z), uint8."""
+    from totalsegmentator.resampling import change_spacing
+
+    img_rsp = change_spacing(img_can, CROP_SPACING_MM, order=CROP_RESAMPLING_ORDER, dtype=np.int32, nr_cpus=1)
+    labels = nib.Nifti1Image(_crop_predictor.predict(img_rsp), img_rsp.affine)
+    organs = change_spacing(
+        labels, CROP_SPACING_MM, img_can.shape[:3], order=0, dtype=np.uint8, nr_cpus=1, force_affine=img_can.affine
     )
-    if HEART_MODE == "four_chambers":
-        if nib is None:
-            raise RuntimeError("nibabel required for four-chamber segmentation")
-        ref_img = None
-        combined = None
-        for fname, label in HEART_CHAMBER_FILES:
-            f = out_dir / fname
-            if not f.exists():
-                raise FileNotFoundError(f"TotalSegmentator did not produce {f.name}")
-            arr = nib.load(str(f)).get_fdata()
-            if combined is None:
-                combined = np.zeros(arr.shape, dtype=np.uint8)
-                ref_img = nib.load(str(f))
-            combined[arr > 0] = label
-        mask_file = out_dir / "heart_four_chambers.nii.gz"
-        nib.save(nib.Nifti1Image(combined, ref_img.affine), str(mask_file))
-    elif HEART_MODE == "left_only":
-        left_files = [out_dir / "heart_atrium_left.nii.gz", out_dir / "heart_ventricle_left.nii.gz"]
-        for f in left_files:
-            if not f.exists():
-                raise FileNotFoundError(f"TotalSegmentator did not produce {f.name}")
-        if nib is None:
-            raise RuntimeError("nibabel required for merging left-heart masks")
-        ref_img = nib.load(str(left_files[0]))
-        ref_affine = ref_img.affine
-        combined = np.zeros(ref_img.shape, dtype=np.float32)
-        for f in left_files:
-            arr = nib.load(str(f)).get_fdata()
-            combined = np.maximum(combined, arr)
-        merged_img = nib.Nifti1Image(combined.astype(np.uint8), ref_affine)
-        mask_file = out_dir / "heart_left.nii.gz"
-        nib.save(merged_img, str(mask_file))
+    return np.asarray(organs.dataobj, dtype=np.uint8)
+
+
+def _warm_heartchambers(img_can: "nib.Nifti1Image", organs: np.ndarray) -> np.ndarray:
+    """heartchambers_highres on the warm predictors with totalsegmentator()'s crop and remove-outside steps, given the
+    crop model's label map of img_can (_organ_labelmap). Returns class ids (x, y, z), uint8."""
+    from totalsegmentator.cropping import get_bbox_from_mask
+    from totalsegmentator.postprocessing import remove_outside_of_mask
+
+    crop_mask = np.isin(organs, [CROP_CLASS_IDS[name] for name in CHAMBERS_CROP_CLASSES])
+    labelmap = np.zeros(img_can.shape[:3], dtype=np.uint8)
+    if not crop_mask.any():
+        return labelmap
+    zooms = np.array(img_can.header.get_zooms()[:3])
+    addon = (np.full(3, CHAMBERS_CROP_ADDON_MM) / zooms).astype(int)  # mm to voxels, truncated like TotalSegmentator
+    box = tuple(slice(lo, hi) for lo, hi in get_bbox_from_mask(crop_mask, outside_value=0, addon=addon))
+    crop = img_can.slicer[box]
+    crop = nib.Nifti1Image(np.asarray(crop.dataobj).astype(np.int32), crop.affine)
+    labelmap[box] = _warm_predictor.predict(crop)
+    keep = np.isin(organs, [CROP_CLASS_IDS[name] for name in CHAMBERS_REMOVE_OUTSIDE_CLASSES])
+    dilation = int(CHAMBERS_REMOVE_OUTSIDE_DILATION_MM / np.mean(zooms))
+    return remove_outside_of_mask(labelmap, keep, addon=dilation)
+
+
+def _heart_roi(img_can: "nib.Nifti1Image", organs: np.ndarray = None):
+    """Heart bounding box (padded by ROI_CROP_MARGIN_MM) as a tuple of slices, or None if no heart found. Taken from
+    organs (the warm crop model's label map) when given, else from a per-call fast total_mr pass."""
+    if organs is not None:
+        heart = organs == CROP_CLASS_IDS["heart"]
+    else:
+        seg_img = totalsegmentator(
+            input=img_can,
+            output=None,
+            task=TASK,
+            roi_subset=ROI_SUBSET,
+            fast=True,
+            ml=True,
+            device=_device(),
+            quiet=True,
+            verbose=False,
+        )
+        heart_id = {name: idx for idx, name in class_map[TASK].items()}["heart"]
+        heart = np.asarray(seg_img.dataobj) == heart_id
+    roi = []
+    for axis, zoom in enumerate(img_can.header.get_zooms()[:3]):
+        other = tuple(a for a in range(3) if a != axis)
+        idx = np.flatnonzero(heart.any(axis=other))
+        if idx.size == 0:
+            return None
+        pad = int(np.ceil(ROI_CROP_MARGIN_MM / float(zoom)))
+        roi.append(slice(max(0, idx[0] - pad), min(heart.shape[axis], idx[-1] + 1 + pad)))
+    return tuple(roi)
+
+
+def _run_segmentation(img_can: "nib.Nifti1Image", clock: "_StageClock" = None) -> "nib.Nifti1Image":
+    """Segment a canonical (RAS) image in memory; returns the heartchambers_highres class label map (uint8)
+    in the same space. Per-mode masks are derived from it with _chambers_from_labelmap."""
+    clock = clock or _StageClock()
+    # Warm mode: the resident crop model's pass serves both the heart crop and (with ROI_CROP) the ROI box.
+    organs = _organ_labelmap(img_can) if WARM_MODEL else None
+    # Coarse-to-fine: run the high-res chamber model only on the padded heart box, paste the result back.
+    roi = _heart_roi(img_can, organs) if ROI_CROP else None
+    work_img = img_can.slicer[roi] if roi else img_can
+    if roi:
+        print(f"Heart ROI: {work_img.shape[:3]} of {img_can.shape[:3]} voxels")
+    if ROI_CROP or WARM_MODEL:
+        clock.mark("roi")
+    if WARM_MODEL:
+        labelmap = _warm_heartchambers(work_img, organs[roi] if roi else organs)
     else:
-        mask_file = out_dir / "heart.nii.gz"
-        if not mask_file.exists():
-            raise FileNotFoundError("TotalSegmentator did not produce heart.nii.gz")
-    return mask_file
+        seg_img = totalsegmentator(
+            input=work_img,
+            output=None,
+            task="heartchambers_highres",
+            ml=True,
+            device=_device(),
+            quiet=True,
+            verbose=False,
+        )
+        labelmap = np.asarray(seg_img.dataobj, dtype=np.uint8)
+    if roi:
+        full = np.zeros(img_can.shape[:3], dtype=np.uint8)
+        full[roi] = labelmap
+        labelmap = full
+    clock.mark("inference")
+    return nib.Nifti1Image(labelmap, img_can.affine)
+
+
+def _segmentation_task() -> str:
+    """TotalSegmentator task (and pipeline variant) whose label map is cached."""
+    return "heartchambers_highres+roi" if ROI_CROP else "heartchambers_highres"
+
+
+def _mask_cache_key(img: "nib.Nifti1Image") -> str:
+    """SHA-256 of the voxel buffer, shape, dtype, affine (dims/spacing/origin) and task — not the mode."""
+    arr = np.asanyarray(img.dataobj)
+    # Hash the buffer in memory order without copying (F-contiguous arrays hash through their transpose).
+    if arr.flags.f_contiguous and not arr.flags.c_contiguous:
+        arr = arr.T
+    h = hashlib.sha256()
+    h.update(memoryview(np.ascontiguousarray(arr)).cast("B"))
+    h.update(json.dumps([list(img.shape), arr.dtype.str, np.round(img.affine, 6).tolist(), _segmentation_task(), "labels", MASK_CACHE_VERSION]).encode())
+    return h.hexdigest()
+
+
+class _MaskCache:
+    """Bounded LRU cache of chamber label maps (original orientation, uint8 class ids) stored as .npy files."""
+
+    def __init__(self, directory: Path, max_entries: int):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._entries = None  # OrderedDict key -> path, least recently used first; built lazily from disk
+
+    def _index(self) -> OrderedDict:
+        if self._entries is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            files = []
+            for f in self.directory.glob("*.npy"):
+                try:
+                    files.append((f.stat().st_mtime_ns, f))
+                except FileNotFoundError:  # evicted by another worker meanwhile
+                    pass
+            self._entries = OrderedDict((f.stem, f) for _, f in sorted(files))
+        return self._entries
+
+    def get(self, key: str):
+        # The index is per process: under gunicorn another worker may have stored (or evicted) the entry, so the
+        # file on disk decides.
+        path = self.directory / f"{key}.npy"
+        with self._lock:
+            entries = self._index()
+        try:
+            mask = np.load(path)
+            os.utime(path)  # mtime is the LRU order, across restarts and workers
+        except OSError:
+            with self._lock:
+                entries.pop(key, None)
+                self.misses += 1
+            return None
+        with self._lock:
+            entries[key] = path
+            entries.move_to_end(key)
+            self.hits += 1
+            self._evict(entries)
+        return mask
+
+    def put(self, key: str, mask: np.ndarray) -> None:
+        with self._lock:
+            self._index()
+        path = self.directory / f"{key}.npy"
+        tmp = self.directory / f".{key}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            np.save(f, mask)
+        os.replace(tmp, path)
+        with self._lock:
+            # Re-read the directory (file mtimes are the LRU order, see get) so the bound holds across workers.
+            self._entries = None
+            self._evict(self._index())
+
+    def _evict(self, entries: OrderedDict) -> None:
+        while len(entries) > self.max_entries:
+            _, old = entries.popitem(last=False)
+            old.unlink(missing_ok=True)  # may already be gone (evicted by another worker)
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._index()
+            return {
+                "entries": len(entries),
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+            }
+
+
+_mask_cache = _MaskCache(MASK_CACHE_DIR, MASK_CACHE_MAX_ENTRIES)
+
+
+def _volume_dtype(dtype) -> np.dtype:
+    """Frontend sends actual type: float32 (streaming 16-bit DICOM), uint16, int16, or uint8."""
+    if dtype not in VOLUME_DTYPES:
+        dtype = "float32"
+    return np.dtype(dtype)
+
+
+def _nifti_from_json(body: dict, clock: "_StageClock" = None) -> "nib.Nifti1Image":
+    """Build NIfTI image in memory from JSON (base64 voxel data), keeping the source dtype.
+
+    The decoded bytes are the voxel array: peak memory is the JSON body plus 1.0x the voxel payload.
+    """
+    clock = clock or _StageClock()
+    # a2b_base64 decodes the str directly; base64.b64decode would first copy it to ASCII bytes (1.33x the payload).
+    raw = binascii.a2b_base64(body["data"])
+    arr = np.frombuffer(raw, dtype=_volume_dtype(body.get("dtype", "float32")))
+    clock.mark("decode")
+    return _nifti_from_flat(arr, body["dimensions"], body.get("spacing", [1.0, 1.0, 1.0]), body.get("origin", [0.0, 0.0, 0.0]))
 
 
-def _nifti_from_json(body: dict, output_path: Path) -> None:
-    """Build NIfTI from JSON using SimpleITK. Correct for TotalSegmentator.
+def _raw_volume_header(args) -> dict:
+    """Parse dimensions/spacing/origin/dtype of a binary upload from the query string (comma-separated lists)."""
+
+    def floats(name, default):
+        value = args.get(name)
+        return [float(v) for v in value.split(",")] if value else list(default)
+
+    value = args.get("dimensions")
+    if not value:
+        raise ValueError("query string must include dimensions")
+    return {
+        "dimensions": [int(v) for v in value.split(",")],
+        "spacing": floats("spacing", [1.0, 1.0, 1.0]),
+        "origin": floats("origin", [0.0, 0.0, 0.0]),
+        "dtype": args.get("dtype", "float32"),
+    }
+
+
+def _raw_volume_buffer(content_length, header: dict) -> np.ndarray:
+    """Empty flat voxel array for a binary upload, after checking the body length against dimensions and dtype."""
+    dimensions = header["dimensions"]
+    if len(dimensions) < 3:
+        raise ValueError("dimensions must have at least 3 elements")
+    dtype_np = _volume_dtype(header["dtype"])
+    n = int(np.prod(dimensions[:3]))
+    if content_length is not None and content_length != n * dtype_np.itemsize:
+        raise ValueError(
+            f"body length {content_length} does not match dimensions {dimensions[:3]} and dtype {dtype_np.name} "
+            f"(expected {n * dtype_np.itemsize})"
+        )
+    return np.empty(n, dtype=dtype_np)
+
+
+def _nifti_from_raw(stream, content_length, header: dict, clock: "_StageClock" = None) -> "nib.Nifti1Image":
+    """Build NIfTI image in memory from raw voxel bytes, read straight from the request stream into the array."""
+    clock = clock or _StageClock()
+    arr = _raw_volume_buffer(content_length, header)
+    view = memoryview(arr).cast("B")
+    # gunicorn hands Flask its own input stream (wsgi.input_terminated), which has read() but no readinto().
+    readinto = getattr(stream, "readinto", None)
+    pos = 0
+    while pos < view.nbytes:
+        if readinto is not None:
+            read = readinto(view[pos:])
+        else:
+            chunk = stream.read(min(view.nbytes - pos, RAW_READ_CHUNK_BYTES))
+            read = len(chunk)
+            view[pos : pos + read] = chunk
+        if not read:
+            raise ValueError(f"body ended after {pos} bytes (expected {view.nbytes})")
+        pos += read
+    clock.mark("decode")
+    return _nifti_from_flat(arr, header["dimensions"], header["spacing"], header["origin"])
+
+
+def _nifti_from_flat(arr: np.ndarray, dimensions, spacing, origin) -> "nib.Nifti1Image":
+    """Build NIfTI image in memory from a flat voxel buffer. Correct for TotalSegmentator.
     Frontend (Cornerstone) often sends (nz, ny, nx) and (sz, sy, sx) — we convert to (nx, ny, nz) and (sx, sy, sz).
+    No copy: the image data is a strided view of arr in its own dtype (the model input is cast to float32 at inference).
     """
-    dimensions = list(body["dimensions"])
+    dimensions = list(dimensions)
     if len(dimensions) < 3:
         raise ValueError("dimensions must have at least 3 elements")
-    spacing = list(body.get("spacing", [1.0, 1.0, 1.0]))
+    spacing = list(spacing)
     while len(spacing) < 3:
         spacing.append(1.0)
     # Normalize to mm: if values are large (e.g. µm), convert to mm
@@ -144,41 +729,1125 @@ def _nifti_from_json(body: dict, output_path: Path) -> None:
         spacing = [float(s) / 1000.0 if s else 1.0 for s in spacing[:3]]
         while len(spacing) < 3:
             spacing.append(1.0)
-    origin = list(body.get("origin", [0.0, 0.0, 0.0]))
+    origin = list(origin)
     while len(origin) < 3:
         origin.append(0.0)
-    data_b64 = body["data"]
-    # Frontend sends actual type: float32 (streaming 16-bit DICOM), uint16, int16, or uint8
-    dtype = body.get("dtype", "float32")
-    if dtype not in ("float32", "uint16", "int16", "uint8"):
-        dtype = "float32"
 
-    raw = base64.b64decode(data_b64)
-    dtype_np = np.dtype(dtype)
     n = int(np.prod(dimensions[:3]))
-    arr = np.frombuffer(raw, dtype=dtype_np)
     if arr.size != n:
         raise ValueError(f"data length {arr.size} does not match dimensions {dimensions[:3]} (expected {n})")
     # Frontend (Cornerstone) sends flat buffer with first dimension varying fastest: index = i + j*nx + k*nx*ny (Fortran order).
-    # NumPy default reshape is C-order (last index fastest); use order='F' to match.
-    arr = arr.reshape(dimensions[:3], order="F").astype(np.float32)
+    # NumPy default reshape is C-order (last index fastest); use order='F' to match (a view, not a copy).
+    arr = arr.reshape(dimensions[:3], order="F")
 
     # NIfTI/SimpleITK expect (nx, ny, nz). If first dim is smallest, treat as (nz, ny, nx) and reorder.
     nx, ny, nz = dimensions[0], dimensions[1], dimensions[2]
     sx, sy, sz = spacing[0], spacing[1], spacing[2]
     ox, oy, oz = origin[0], origin[1], origin[2]
     if dimensions[0] <= dimensions[1] and dimensions[0] <= dimensions[2]:
-        arr = np.transpose(arr, (2, 1, 0))
+        arr = np.transpose(arr, (2, 1, 0))  # view: the F-order buffer read as C-order (nx, ny, nz)
         nx, ny, nz = dimensions[2], dimensions[1], dimensions[0]
         sx, sy, sz = spacing[2], spacing[1], spacing[0]
         ox, oy, oz = origin[2], origin[1], origin[0]
 
-    # SimpleITK GetImageFromArray expects numpy order (z, y, x) and maps to image (x, y, z); so pass (nz, ny, nx).
-    arr_sitk = np.transpose(arr, (2, 1, 0))
-    img = sitk.GetImageFromArray(arr_sitk)
-    img.SetSpacing((float(sx), float(sy), float(sz)))
-    img.SetOrigin((float(ox), float(oy), float(oz)))
-    sitk.WriteImage(img, str(output_path))
+    # Spacing/origin are in ITK/DICOM patient space (LPS, identity direction); NIfTI affine is RAS,
+    # so x and y flip sign — the same affine SimpleITK writes for this image.
+    affine = np.array(
+        [
+            [-float(sx), 0.0, 0.0, -float(ox)],
+            [0.0, -float(sy), 0.0, -float(oy)],
+            [0.0, 0.0, float(sz), float(oz)],
+            [0.0, 0.0, 0.0, 1.0],
+        ]
+    )
+    return nib.Nifti1Image(arr, affine)
+
+
+def _nifti_from_bytes(volume_bytes: bytes) -> "nib.Nifti1Image":
+    """Parse raw NIfTI bytes (.nii or gzip-compressed .nii.gz) in memory."""
+    if len(volume_bytes) >= 2 and volume_bytes[0] == 0x1F and volume_bytes[1] == 0x8B:
+        volume_bytes = gzip.decompress(volume_bytes)
+    return nib.Nifti1Image.from_bytes(volume_bytes)
+
+
+def _rss_bytes():
+    """(current, peak) resident set size of this process in bytes; None where the platform does not report it."""
+    peak = None
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        peak *= 1 if platform.system() == "Darwin" else 1024  # ru_maxrss is bytes on macOS, KiB on Linux
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        current = None
+    return current, peak
+
+
+class _Metrics:
+    """Process metrics for GET /metrics (Prometheus text format)."""
+
+    def __init__(self, buckets):
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._stage_hist = {}  # stage -> [bucket counts..., +Inf count, sum]
+        self._stage_end_rss = {}  # stage -> max RSS seen at the end of the stage
+        self._stage_peak_growth = {}  # stage -> max rise of the process peak RSS (ru_maxrss) during the stage
+        self._stage_traced = {}  # stage -> max tracemalloc peak growth during the stage
+        self._jobs = {"done": 0, "failed": 0, "expired": 0, "cancelled": 0}
+        self._rejected = {}  # HTTP status -> requests refused by admission control
+
+    def observe_stage(self, stage: str, seconds: float, traced_peak=None, peak_rss_growth=None) -> None:
+        rss, _ = _rss_bytes()
+        with self._lock:
+            hist = self._stage_hist.setdefault(stage, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist[i] += 1
+            hist[len(self.buckets)] += 1
+            hist[-1] += seconds
+            if rss is not None:
+                self._stage_end_rss[stage] = max(self._stage_end_rss.get(stage, 0), rss)
+            if peak_rss_growth is not None:
+                self._stage_peak_growth[stage] = max(self._stage_peak_growth.get(stage, 0), peak_rss_growth)
+            if traced_peak is not None:
+                self._stage_traced[stage] = max(self._stage_traced.get(stage, 0), traced_peak)
+
+    def count_job(self, status: str) -> None:
+        with self._lock:
+            self._jobs[status] = self._jobs.get(status, 0) + 1
+
+    def count_rejection(self, status: int) -> None:
+        with self._lock:
+            self._rejected[status] = self._rejected.get(status, 0) + 1
+
+    def mean_stage_seconds(self, stage: str):
+        """Mean duration of a stage so far, None if it has not been observed."""
+        with self._lock:
+            hist = self._stage_hist.get(stage)
+            return hist[-1] / hist[len(self.buckets)] if hist else None
+
+    def render(self) -> str:
+        lines = []
+
+        def metric(name, kind, help_text, samples):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in samples:
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels.items())
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+        with self._lock:
+            lines.append("# HELP lge_stage_duration_seconds Duration of /segment pipeline stages.")
+            lines.append("# TYPE lge_stage_duration_seconds histogram")
+            for stage, hist in sorted(self._stage_hist.items()):
+                for bound, count in zip(self.buckets, hist):
+                    lines.append(f'lge_stage_duration_seconds_bucket{{stage="{stage}",le="{bound}"}} {count}')
+                lines.append(f'lge_stage_duration_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist[len(self.buckets)]}')
+                lines.append(f'lge_stage_duration_seconds_sum{{stage="{stage}"}} {hist[-1]:.6f}')
+                lines.append(f'lge_stage_duration_seconds_count{{stage="{stage}"}} {hist[len(self.buckets)]}')
+            metric("lge_stage_end_rss_bytes", "gauge", "Largest process RSS seen at the end of each stage.",
+                   [({"stage": k}, v) for k, v in sorted(self._stage_end_rss.items())])
+            metric("lge_stage_peak_rss_growth_bytes", "gauge",
+                   "Largest rise of the process peak RSS (ru_maxrss) within each stage; 0 below an earlier peak.",
+                   [({"stage": k}, v) for k, v in sorted(self._stage_peak_growth.items())])
+            if self._stage_traced:
+                metric("lge_stage_tracemalloc_peak_bytes", "gauge",
+                       "Largest Python allocation peak growth within each stage (METRICS_TRACEMALLOC; "
+                       "excludes native memory).",
+                       [({"stage": k}, v) for k, v in sorted(self._stage_traced.items())])
+            metric("lge_jobs_total", "counter", "Segmentations finished on the inference pool.",
+                   [({"status": k}, v) for k, v in sorted(self._jobs.items())])
+            metric("lge_admission_rejected_total", "counter", "Requests refused by admission control.",
+                   [({"status": k}, v) for k, v in sorted(self._rejected.items())])
+
+        rss, peak = _rss_bytes()
+        if rss is not None:
+            metric("lge_process_rss_bytes", "gauge", "Current resident set size.", [({}, rss)])
+        if peak is not None:
+            metric("lge_process_peak_rss_bytes", "gauge", "Peak resident set size since start.", [({}, peak)])
+        pool = _inference_pool.stats()
+        metric("lge_inference_workers", "gauge", "Size of the inference worker pool.", [({}, pool["workers"])])
+        metric("lge_inference_in_flight", "gauge", "Segmentations currently running.", [({}, pool["running"])])
+        metric("lge_inference_queue_depth", "gauge", "Segmentations waiting for a worker.",
+               [({"lane": k}, v) for k, v in pool["queued"].items()])
+        metric("lge_inference_reserved_bytes", "gauge", "Estimated memory of admitted (queued and running) requests.",
+               [({}, pool["reserved_bytes"])])
+        startup = _readiness.to_dict()
+        metric("lge_ready", "gauge", "1 once the model is loaded and the warm-up inference has run.",
+               [({}, int(startup["ready"]))])
+        metric("lge_startup_seconds", "gauge", "Seconds from server.py import to each startup phase (see /ready).",
+               [({"phase": k[: -len("_seconds")]}, startup[k])
+                for k in ("import_seconds", "first_health_seconds", "ready_seconds") if startup[k] is not None])
+        cache = _mask_cache.stats()
+        metric("lge_mask_cache_hits_total", "counter", "Mask cache hits.", [({}, cache["hits"])])
+        metric("lge_mask_cache_misses_total", "counter", "Mask cache misses.", [({}, cache["misses"])])
+        metric("lge_mask_cache_entries", "gauge", "Masks stored in the cache.", [({}, cache["entries"])])
+        return "\n".join(lines) + "\n"
+
+
+_metrics = _Metrics(METRICS_BUCKETS)
+if METRICS_TRACEMALLOC:
+    tracemalloc.start()
+
+
+class _StageClock:
+    """Times consecutive pipeline stages: mark(stage) closes the stage that just finished and reports it."""
+
+    def __init__(self, listener=None, record: bool = True):
+        self.start = self._last = time.perf_counter()
+        self.listener = listener  # callable(event dict) or None
+        self.record = record  # report stage durations to /metrics
+        self._traced_base = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None
+        self._peak_base = _rss_bytes()[1]
+
+    def mark(self, stage: str) -> None:
+        _raise_if_cancelled()  # stage boundary: a cancelled job stops here
+        now = time.perf_counter()
+        seconds = now - self._last
+        traced_peak = None
+        if self._traced_base is not None and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            traced_peak = max(0, peak - self._traced_base)
+            tracemalloc.reset_peak()
+            self._traced_base = current
+        peak_growth = None
+        if self._peak_base is not None:
+            peak = _rss_bytes()[1]
+            peak_growth, self._peak_base = peak - self._peak_base, peak
+        if self.record:
+            _metrics.observe_stage(stage, seconds, traced_peak, peak_growth)
+        event = {"stage": stage, "seconds": round(seconds, 4), "elapsed": round(now - self.start, 4)}
+        self._last = now
+        if self.listener is not None:
+            self.listener(event)
+
+
+class _BadRequest(ValueError):
+    """Client error in a /segment request body (returned as 400)."""
+
+
+class _HTTPError(Exception):
+    """Error returned with its own HTTP status (and a Retry-After header when retry_after is set)."""
+
+    def __init__(self, message: str, status: int, retry_after: int = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+
+class _Cancelled(Exception):
+    """The job was cancelled (client disconnected or DELETE /segment/jobs/<id>); returned as 410."""
+
+
+# Job run by the current inference worker thread, for _raise_if_cancelled.
+_current_job = threading.local()
+
+
+def _raise_if_cancelled() -> None:
+    """Cancellation point (stage and sliding-window boundaries): raise _Cancelled if this thread's job was cancelled."""
+    job = getattr(_current_job, "job", None)
+    if job is not None and job.cancel_reason is not None:
+        raise _Cancelled(job.cancel_reason)
+
+
+def _error_status(e: Exception) -> tuple:
+    """(HTTP status, message, extra headers) of the JSON error response for an exception raised by a request."""
+    if isinstance(e, _BadRequest):
+        return 400, str(e), {}
+    if isinstance(e, _Cancelled):
+        return 410, f"cancelled: {e!s}", {}
+    if isinstance(e, _HTTPError):
+        return e.status, str(e), {"Retry-After": str(e.retry_after)} if e.retry_after else {}
+    return 500, _segment_error_message(e), {}
+
+
+def _error_response(message: str, status: int, headers: dict = None) -> Response:
+    return Response(json.dumps({"error": message}), status=status, mimetype="application/json", headers=headers)
+
+
+def _exception_response(e: Exception) -> Response:
+    status, message, headers = _error_status(e)
+    return _error_response(message, status, headers)
+
+
+def _request_deadline(headers):
+    """Absolute deadline (time.time()) from the DEADLINE_HEADER seconds budget; None when the header is absent."""
+    value = headers.get(DEADLINE_HEADER)
+    if not value:
+        return None
+    try:
+        seconds = float(value)
+    except ValueError:
+        seconds = 0.0
+    if not seconds > 0:
+        raise _BadRequest(f"{DEADLINE_HEADER} must be a positive number of seconds, got {value!r}")
+    return time.time() + seconds
+
+
+def _volume_memory(dimensions, dtype) -> int:
+    """Estimated peak bytes of segmenting a volume of these dimensions and input dtype (see PIPELINE_BYTES_PER_VOXEL)."""
+    try:
+        voxels = math.prod(int(d) for d in list(dimensions)[:3])
+    except (TypeError, ValueError) as e:
+        raise _BadRequest(f"invalid dimensions {dimensions!r}") from e
+    return voxels * (np.dtype(dtype).itemsize + PIPELINE_BYTES_PER_VOXEL)
+
+
+def _image_memory(img: "nib.Nifti1Image") -> int:
+    return _volume_memory(img.shape[:3], img.get_data_dtype())
+
+
+def _nifti_memory(volume_bytes) -> int:
+    """_volume_memory of raw (optionally gzipped) NIfTI bytes from their header alone; 0 if it cannot be read."""
+    head = bytes(volume_bytes[:352])
+    try:
+        if head[:2] == b"\x1f\x8b":
+            head = gzip.GzipFile(fileobj=io.BytesIO(volume_bytes)).read(352)
+        header = nib.Nifti1Header.from_fileobj(io.BytesIO(head), check=False)
+        return _volume_memory(header.get_data_shape()[:3], header.get_data_dtype())
+    except Exception:
+        return 0  # not a NIfTI-1 header: left to the decoder to reject
+
+
+def _read_segment_input(clock: "_StageClock" = None):
+    """Read the volume from the current request. Returns (input_img, frontend_dims)."""
+    clock = clock or _StageClock()
+    content_type = (request.content_type or "").split(";")[0].strip().lower()
+    frontend_dims = None  # (d0, d1, d2) when input was JSON so we can match byte order
+
+    if content_type == "application/json":
+        body = request.get_json(force=True, silent=True)
+        if not isinstance(body, dict) or "data" not in body or "dimensions" not in body:
+            raise _BadRequest("JSON body must include dimensions and data (base64)")
+        try:
+            _inference_pool.admit(_volume_memory(body["dimensions"], _volume_dtype(body.get("dtype", "float32"))))
+            frontend_dims = list(body["dimensions"][:3])
+            input_img = _nifti_from_json(body, clock)
+        except (ValueError, TypeError) as e:  # incl. binascii.Error (bad base64) and short / mismatched data
+            raise _BadRequest(str(e)) from e
+        clock.mark("nifti")
+        return input_img, frontend_dims
+    if content_type == RAW_VOLUME_CONTENT_TYPE:
+        try:
+            header = _raw_volume_header(request.args)
+            _inference_pool.admit(_volume_memory(header["dimensions"], _volume_dtype(header["dtype"])))
+            input_img = _nifti_from_raw(request.stream, request.content_length, header, clock)
+        except ValueError as e:
+            raise _BadRequest(str(e)) from e
+        frontend_dims = list(header["dimensions"][:3])
+        clock.mark("nifti")
+        return input_img, frontend_dims
+    # Raw NIfTI bytes
+    volume_bytes = request.get_data()
+    if not volume_bytes:
+        raise _BadRequest("Empty body: send NIfTI bytes or JSON with dimensions/data")
+    _inference_pool.admit(_nifti_memory(volume_bytes))
+    clock.mark("decode")
+    input_img = _nifti_from_bytes(volume_bytes)
+    clock.mark("nifti")
+    return input_img, frontend_dims
+
+
+class _ResultArchiver:
+    """Background writer: saves each case's volume and mask to RESULT_DIR/<case_id>/ (same layout as lge_segmentator.py)."""
+
+    def __init__(self, max_pending: int):
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def submit(self, volume_img, mask_img, mask_name: str) -> None:
+        if not ARCHIVE_RESULTS:
+            return
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._work, name="archiver", daemon=True)
+                self._thread.start()
+        case_id = f"{time.strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}"
+        try:
+            self._queue.put_nowait((case_id, volume_img, mask_img, mask_name))
+        except queue.Full:
+            print(f"Archive queue full, case {case_id} not archived")
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def drain(self, timeout: float = None) -> bool:
+        """Wait until every queued case is written (at most timeout seconds, default ARCHIVE_DRAIN_SECONDS).
+        False if some are still pending then."""
+        deadline = time.monotonic() + (ARCHIVE_DRAIN_SECONDS if timeout is None else timeout)
+        with self._queue.all_tasks_done:
+            while self._queue.unfinished_tasks:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    print(f"Archive: {self._queue.unfinished_tasks} case(s) not written before exit")
+                    return False
+                self._queue.all_tasks_done.wait(remaining)
+        return True
+
+    def _work(self) -> None:
+        while True:
+            case_id, volume_img, mask_img, mask_name = self._queue.get()
+            try:
+                case_dir = RESULT_DIR / case_id
+                (case_dir / "segmentation").mkdir(parents=True, exist_ok=True)
+                _save_nifti(volume_img, case_dir / "lge_volume.nii")
+                _save_nifti(mask_img, case_dir / "segmentation" / mask_name)
+            except Exception as e:
+                print(f"Archiving case {case_id} failed: {e!s}")
+            finally:
+                self._queue.task_done()
+
+
+def _save_nifti(img: "nib.Nifti1Image", path: Path) -> Path:
+    """Write img to path (.nii) or path.gz with ARCHIVE_COMPRESSION / ARCHIVE_GZIP_LEVEL. Written to a .part file
+    first and renamed, so an interrupted write never leaves a truncated NIfTI under the final name."""
+    if ARCHIVE_COMPRESSION == "gzip":
+        path = path.with_name(path.name + ".gz")
+    tmp = path.with_name(path.name + ".part")
+    try:
+        if ARCHIVE_COMPRESSION == "gzip":
+            with gzip.open(tmp, "wb", compresslevel=ARCHIVE_GZIP_LEVEL) as f:
+                img.to_stream(f)
+        else:
+            with open(tmp, "wb") as f:
+                img.to_stream(f)
+        os.replace(tmp, path)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+    return path
+
+
+_archiver = _ResultArchiver(ARCHIVE_MAX_PENDING)
+# The writer is a daemon thread: let it finish the queued cases before the interpreter exits.
+atexit.register(_archiver.drain)
+
+
+def _parse_mask_encoding(value) -> tuple:
+    """?encoding= value -> tuple of steps; "" / "raw" is the plain full mask."""
+    if not value or value == "raw":
+        return ()
+    steps = tuple(v.strip() for v in value.split(",") if v.strip())
+    unknown = [v for v in steps if v not in MASK_ENCODINGS]
+    if unknown:
+        raise _BadRequest(f"unknown mask encoding {unknown[0]!r} (expected any of {', '.join(MASK_ENCODINGS)})")
+    if "rle" in steps and "packed" in steps:
+        raise _BadRequest("mask encodings rle and packed cannot be combined")
+    return tuple(v for v in MASK_ENCODINGS if v in steps)
+
+
+def _encode_mask(mask_arr: np.ndarray, encoding: tuple) -> dict:
+    """Mask payload fields for the requested encoding steps; mask_arr is in frontend (d0, d1, d2) order.
+
+    bbox:   crop to the label bounding box — "bbox": {"offset": [o0,o1,o2], "size": [s0,s1,s2]}.
+    rle:    runs over the F-order stream (fastest axis first) — data = uint32 LE lengths then uint8 values, "runs": count.
+    packed: 1 bit per voxel for binary masks, 4 bits (low nibble first) for multi-label — "bitsPerVoxel".
+    Voxels are always flattened first-dimension-fastest, as in the plain form.
+    """
+    fields = {}
+    if encoding:
+        fields["encoding"] = ",".join(encoding)
+    if "bbox" in encoding:
+        offset, size = [0, 0, 0], [0, 0, 0]
+        if mask_arr.any():
+            for axis in range(3):
+                other = tuple(a for a in range(3) if a != axis)
+                idx = np.flatnonzero(mask_arr.any(axis=other))
+                offset[axis], size[axis] = int(idx[0]), int(idx[-1] - idx[0] + 1)
+        mask_arr = mask_arr[tuple(slice(o, o + n) for o, n in zip(offset, size))]
+        fields["bbox"] = {"offset": offset, "size": size}
+    flat = mask_arr.ravel(order="F")
+    if "rle" in encoding:
+        if flat.size:
+            starts = np.concatenate(([0], np.flatnonzero(flat[1:] != flat[:-1]) + 1))
+        else:
+            starts = np.zeros(0, dtype=np.intp)
+        lengths = np.diff(np.append(starts, flat.size)).astype("<u4")
+        data = lengths.tobytes() + flat[starts].tobytes()
+        fields["runs"] = int(starts.size)
+    elif "packed" in encoding:
+        if flat.max(initial=0) <= 1:
+            data = np.packbits(flat, bitorder="little").tobytes()
+            fields["bitsPerVoxel"] = 1
+        else:
+            if flat.size % 2:
+                flat = np.append(flat, np.uint8(0))
+            data = (flat[0::2] | (flat[1::2] << 4)).astype(np.uint8).tobytes()
+            fields["bitsPerVoxel"] = 4
+    else:
+        data = flat.tobytes()
+    fields["data"] = base64.b64encode(data).decode("ascii")
+    return fields
+
+
+def _mesh_decimate(verts: np.ndarray, faces: np.ndarray, max_faces: int):
+    """Vertex-clustering decimation: merge vertices per grid cell (cluster mean), drop collapsed and duplicate
+    triangles. The cell grows until at most max_faces remain."""
+    if len(faces) <= max_faces:
+        return verts, faces
+    edge = np.linalg.norm(verts[faces[:, 0]] - verts[faces[:, 1]], axis=1).mean()
+    cell = edge * np.sqrt(len(faces) / max_faces)
+    lo = verts.min(axis=0)
+    while True:
+        cells = np.floor((verts - lo) / cell).astype(np.int64)
+        dims = cells.max(axis=0) + 1
+        _, cluster = np.unique((cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2], return_inverse=True)
+        cluster = cluster.ravel()
+        count = np.bincount(cluster)
+        new_verts = np.stack([np.bincount(cluster, weights=verts[:, a]) for a in range(3)], axis=1) / count[:, None]
+        f = cluster[faces]
+        f = f[(f[:, 0] != f[:, 1]) & (f[:, 1] != f[:, 2]) & (f[:, 0] != f[:, 2])]
+        _, first = np.unique(np.sort(f, axis=1), axis=0, return_index=True)
+        f = f[np.sort(first)]
+        if len(f) <= max_faces:
+            break
+        cell *= 1.25
+    used, f = np.unique(f, return_inverse=True)
+    return new_verts[used], f.reshape(-1, 3)
+
+
+def _mesh_smooth(verts: np.ndarray, faces: np.ndarray, iterations: int) -> np.ndarray:
+    """Taubin lambda/mu smoothing (umbrella operator over the edge graph); removes the voxel staircase without
+    shrinking the surface like plain Laplacian smoothing."""
+    if not iterations or not len(faces):
+        return verts
+    edges = np.concatenate([faces[:, [0, 1]], faces[:, [1, 2]], faces[:, [2, 0]]])
+    edges = np.unique(np.concatenate([edges, edges[:, ::-1]]), axis=0)
+    src, dst = edges[:, 0], edges[:, 1]
+    degree = np.maximum(np.bincount(src, minlength=len(verts)), 1)[:, None]
+    verts = verts.astype(np.float64)
+    for _ in range(iterations):
+        for factor in (MESH_SMOOTH_LAMBDA, MESH_SMOOTH_MU):
+            mean = np.stack([np.bincount(src, weights=verts[dst, a], minlength=len(verts)) for a in range(3)], axis=1)
+            verts += factor * (mean / degree - verts)
+    return verts
+
+
+def _label_mesh(mask: np.ndarray, affine: np.ndarray):
+    """Triangle mesh of one binary mask in LPS world coordinates (mm, as Cornerstone); (float32 verts, uint32 faces)."""
+    nz = [np.flatnonzero(mask.any(axis=axes)) for axes in ((1, 2), (0, 2), (0, 1))]
+    lo = np.array([a[0] for a in nz])
+    box = tuple(slice(a[0], a[-1] + 1) for a in nz)
+    # Zero border so surfaces touching the crop edge are closed
+    crop = np.pad(mask[box], 1).astype(np.float32)
+    verts, faces, _, _ = measure.marching_cubes(crop, level=0.5, allow_degenerate=False)
+    verts += lo - 1
+    verts, faces = _mesh_decimate(verts, faces, MESH_MAX_FACES)
+    # Smooth in world space so anisotropic voxels are treated correctly
+    world = verts @ affine[:3, :3].T + affine[:3, 3]
+    world[:, :2] *= -1  # RAS -> LPS
+    world = _mesh_smooth(world, faces, MESH_SMOOTH_ITERATIONS)
+    # marching_cubes winds triangles clockwise seen from outside (in index space); make them counter-clockwise
+    # in world space (outward normals), unless the affine mirrors and already did so
+    if np.linalg.det(np.diag([-1.0, -1.0, 1.0]) @ affine[:3, :3]) > 0:
+        faces = faces[:, ::-1]
+    return world.astype(np.float32), np.ascontiguousarray(faces, dtype=np.uint32)
+
+
+def _encode_meshes(mask_arr: np.ndarray, affine: np.ndarray) -> bytes:
+    """Binary mesh response (little-endian): b"LGEM", uint32 version (1), uint32 label count, then per label
+    uint32 label, uint32 vertex count, uint32 triangle count, float32 xyz * vertices, uint32 abc * triangles.
+    Every section starts 4-byte aligned, so the client can view it as Float32Array/Uint32Array without copying."""
+    labels = [int(v) for v in np.flatnonzero(np.bincount(mask_arr.ravel(order="K"), minlength=256)[1:]) + 1]
+    parts = [b"LGEM", np.array([1, len(labels)], dtype="<u4").tobytes()]
+    for label in labels:
+        verts, faces = _label_mesh(mask_arr == label, affine)
+        parts.append(np.array([label, len(verts), len(faces)], dtype="<u4").tobytes())
+        parts.append(verts.astype("<f4").tobytes())
+        parts.append(faces.astype("<u4").tobytes())
+    return b"".join(parts)
+
+
+def _skeleton_branches(adjacency: list) -> list:
+    """Split a tree (adjacency sets) into branches: vertex paths between nodes of degree != 2."""
+    branches = []
+    seen = set()
+    for start, neighbors in enumerate(adjacency):
+        if len(neighbors) == 2 or not neighbors:
+            continue
+        for nxt in neighbors:
+            if (start, nxt) in seen:
+                continue
+            path = [start, nxt]
+            while len(adjacency[path[-1]]) == 2:
+                a, b = adjacency[path[-1]]
+                path.append(b if a == path[-2] else a)
+            seen.add((path[-1], path[-2]))
+            branches.append(path)
+    return branches
+
+
+def _label_centerline(mask: np.ndarray, affine: np.ndarray, min_branch_mm: float) -> list:
+    """Centerline polylines of one binary mask: [{"points": [[x,y,z], ...] (LPS mm), "radii": [mm], "length": mm}],
+    longest first. Skeleton by 3D thinning; the 26-connected skeleton graph is reduced to its minimum spanning
+    tree (removes the small cycles thinning leaves at corners) and split into branches between end/junction points."""
+    nz = [np.flatnonzero(mask.any(axis=axes)) for axes in ((1, 2), (0, 2), (0, 1))]
+    lo = np.array([a[0] for a in nz])
+    crop = np.pad(mask[tuple(slice(a[0], a[-1] + 1) for a in nz)], 1)
+    spacing = np.sqrt((affine[:3, :3] ** 2).sum(axis=0))
+    radius = ndimage.distance_transform_edt(crop, sampling=spacing)
+    coords = np.argwhere(morphology.skeletonize(crop))
+    if len(coords) < 2:
+        return []
+
+    # Edges to the 13 "forward" neighbours of the 26-neighbourhood, found by binary search on sorted linear indices
+    lin = np.ravel_multi_index(coords.T, crop.shape)
+    src, dst, weight = [], [], []
+    for offset in np.argwhere(np.ones((3, 3, 3), bool)) - 1:
+        if tuple(offset) <= (0, 0, 0):
+            continue
+        target = np.ravel_multi_index((coords + offset).T, crop.shape)
+        idx = np.minimum(np.searchsorted(lin, target), len(lin) - 1)
+        hit = lin[idx] == target
+        src.append(np.flatnonzero(hit))
+        dst.append(idx[hit])
+        weight.append(np.full(hit.sum(), np.linalg.norm(offset * spacing)))
+    src, dst, weight = np.concatenate(src), np.concatenate(dst), np.concatenate(weight)
+    tree = csgraph.minimum_spanning_tree(sparse.coo_matrix((weight, (src, dst)), shape=(len(lin), len(lin)))).tocoo()
+    adjacency = [set() for _ in range(len(lin))]
+    for a, b in zip(tree.row.tolist(), tree.col.tolist()):
+        adjacency[a].add(b)
+        adjacency[b].add(a)
+
+    world = (coords + lo - 1) @ affine[:3, :3].T + affine[:3, 3]
+    world[:, :2] *= -1  # RAS -> LPS
+
+    def length(path):
+        return float(np.linalg.norm(np.diff(world[path], axis=0), axis=1).sum())
+
+    # Prune short terminal branches (spurs) until none is left
+    while True:
+        branches = _skeleton_branches(adjacency)
+        spurs = [
+            path for path in branches
+            if len(branches) > 1 and min(len(adjacency[path[0]]), len(adjacency[path[-1]])) == 1 and length(path) < min_branch_mm
+        ]
+        if not spurs:
+            break
+        if len(spurs) == len(branches):
+            spurs.remove(max(spurs, key=length))  # small structure: keep its longest branch
+        for path in spurs:
+            # drop the path up to (not including) its junction end
+            inner = path if len(adjacency[path[0]]) == 1 else path[::-1]
+            for a, b in zip(inner[:-1], inner[1:]):
+                adjacency[a].discard(b)
+                adjacency[b].discard(a)
+
+    polylines = [
+        {
+            "points": np.round(world[path], 3).tolist(),
+            "radii": np.round(radius[tuple(coords[path].T)], 3).tolist(),
+            "length": round(length(path), 3),
+        }
+        for path in branches
+    ]
+    return sorted(polylines, key=lambda p: -p["length"])
+
+
+def _encode_contours(mask_arr: np.ndarray, axis: int) -> bytes:
+    """Binary per-slice contours of every label along `axis` of mask_arr (little-endian):
+      b"LGEC", uint32 version (1), uint32 axis, uint32 slice count, uint32 contour count, then per contour
+      uint16 label, uint16 closed (1/0), uint32 slice, uint32 point count, int32 u0, int32 v0,
+      int8 (du, dv) * (point count - 1).
+    (u, v) are the two other axes in increasing order, in half-voxel units (vertex = value / 2, voxel index space):
+    marching squares on a binary slice puts vertices on voxel-edge midpoints, so consecutive steps fit in int8.
+    Closed contours do not repeat their first point."""
+    slices = np.moveaxis(mask_arr, axis, 0)  # view
+    labels = [int(v) for v in np.flatnonzero(np.bincount(mask_arr.ravel(order="K"), minlength=256)[1:]) + 1]
+    records = []
+    for label in labels:
+        # Only the slices and the in-plane box that contain the label are scanned.
+        in_label = slices == label
+        for k in np.flatnonzero(in_label.any(axis=(1, 2))):
+            plane = in_label[k]
+            rows, cols = np.flatnonzero(plane.any(axis=1)), np.flatnonzero(plane.any(axis=0))
+            crop = np.pad(plane[rows[0] : rows[-1] + 1, cols[0] : cols[-1] + 1], 1).astype(np.float32)
+            origin = np.array([rows[0] - 1, cols[0] - 1])
+            for contour in measure.find_contours(crop, 0.5):
+                q = np.rint((contour + origin) * 2).astype(np.int32)
+                closed = len(q) > 2 and (q[0] == q[-1]).all()
+                if closed:
+                    q = q[:-1]
+                records.append(
+                    np.array([label | (int(closed) << 16), k, len(q)], dtype="<u4").tobytes()
+                    + q[0].astype("<i4").tobytes()
+                    + np.diff(q, axis=0).astype(np.int8).tobytes()
+                )
+    header = b"LGEC" + np.array([1, axis, slices.shape[0], len(records)], dtype="<u4").tobytes()
+    return header + b"".join(records)
+
+
+class _DerivedCache:
+    """In-memory LRU of results derived from a label map (meshes, centerlines, contours), keyed per volume, mode and parameters."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            result = self._entries.get(key)
+            if result is not None:
+                self._entries.move_to_end(key)
+            return result
+
+    def put(self, key: str, result) -> None:
+        with self._lock:
+            self._entries[key] = result
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_derived_cache = _DerivedCache(DERIVED_CACHE_MAX_ENTRIES)
+
+
+def _parse_heart_mode(value) -> str:
+    """?mode= query value -> one of HEART_MODES (HEART_MODE when absent)."""
+    if not value:
+        return HEART_MODE
+    if value not in HEART_MODES:
+        raise _BadRequest(f"unknown mode {value!r} (expected one of {', '.join(HEART_MODES)})")
+    return value
+
+
+def _parse_volume_key(value) -> str:
+    """<volumeKey> of /segment/masks: a _mask_cache_key digest (64 lowercase hex); checked before it names a file."""
+    if not re.fullmatch(r"[0-9a-f]{64}", value or ""):
+        raise _BadRequest("volume key must be the 64-character hex volumeKey of a /segment response")
+    return value
+
+
+def _parse_contour_axis(value) -> int:
+    """?axis= of /segment/contours: 0, 1 or 2 (frontend dimension order), default CONTOUR_DEFAULT_AXIS."""
+    axis = str(CONTOUR_DEFAULT_AXIS) if value is None else value
+    if axis not in ("0", "1", "2"):
+        raise _BadRequest(f"axis must be 0, 1 or 2, got {axis!r}")
+    return int(axis)
+
+
+def _parse_centerline_args(args) -> tuple:
+    """(label, min_branch_mm) from the /centerline query string."""
+    try:
+        return int(args.get("label", 1)), float(args.get("min_branch_mm", CENTERLINE_MIN_BRANCH_MM))
+    except ValueError as e:
+        raise _BadRequest(str(e)) from e
+
+
+def _frontend_order(mask_arr: np.ndarray, frontend_dims) -> np.ndarray:
+    """View of a server-orientation mask indexed (d0, d1, d2) like the frontend volume."""
+    # If we transposed in _nifti_from_json, server shape is (d2,d1,d0); else (d0,d1,d2).
+    shape = tuple(mask_arr.shape)
+    if frontend_dims and len(frontend_dims) >= 3:
+        d0, d1, d2 = int(frontend_dims[0]), int(frontend_dims[1]), int(frontend_dims[2])
+        if shape == (d2, d1, d0):
+            return np.transpose(mask_arr, (2, 1, 0))
+    return mask_arr  # (d0,d1,d2) already, or raw NIfTI input (server order)
+
+
+def _mask_payload(mask_arr: np.ndarray, frontend_dims, encoding: tuple, heart_mode: str) -> dict:
+    """The /segment JSON payload for a heart_mode mask (server orientation)."""
+    # Frontend (Cornerstone) expects flat buffer with first dimension varying fastest (Fortran order): emit (d0,d1,d2) F-order.
+    mask_arr = _frontend_order(mask_arr, frontend_dims)
+
+    # Return JSON with dimensions + base64 mask so frontend format matches exactly (no guesswork).
+    out_dims = frontend_dims if frontend_dims else list(mask_arr.shape)
+    payload = {"dimensions": out_dims[:3], "mode": heart_mode}
+    payload.update(_encode_mask(mask_arr, encoding))
+    if heart_mode == "four_chambers":
+        payload["multiLabel"] = True
+        payload["segmentLabels"] = ["Left atrium", "Left ventricle", "Right atrium", "Right ventricle"]
+    return payload
+
+
+def _volume_labelmap(input_img: "nib.Nifti1Image", cache_key: str = None, clock: "_StageClock" = None) -> np.ndarray:
+    """heartchambers_highres class label map (uint8) of input_img in its original orientation; from the mask
+    cache when cache_key is given and stored, else segmented (and stored)."""
+    clock = clock or _StageClock()
+    cached = _mask_cache.get(cache_key) if cache_key else None
+    if cached is not None and cached.shape == input_img.shape[:3]:
+        print("Segmentation: mask cache hit")
+        clock.mark("cache_hit")
+        return cached
+
+    # Reorient to canonical (same as DICOM conversion) so TotalSegmentator works correctly
+    input_can = _reorient_to_canonical(input_img)
+    clock.mark("reorient")
+
+    t0 = time.perf_counter()
+    labels_can = _run_segmentation(input_can, clock)
+    print(f"Segmentation ({'warm' if WARM_MODEL else 'per-call'}): {time.perf_counter() - t0:.2f}s")
+
+    # Put labels back in original input orientation — same voxel count as volume (undo_canonical preserves shape)
+    labels_orig = undo_canonical(labels_can, input_img)
+    labelmap = np.asarray(labels_orig.dataobj, dtype=np.uint8)
+    if cache_key:
+        _mask_cache.put(cache_key, labelmap)
+    clock.mark("undo_canonical")
+    return labelmap
+
+
+def _mask_view_payload(volume_key: str, frontend_dims, encoding: tuple, heart_mode: str):
+    """/segment payload for heart_mode from the cached label map of volume_key; None if it is not cached."""
+    labelmap = _mask_cache.get(volume_key) if MASK_CACHE else None
+    if labelmap is None:
+        return None
+    payload = _mask_payload(_chambers_from_labelmap(labelmap, heart_mode), frontend_dims, encoding, heart_mode)
+    payload["volumeKey"] = volume_key
+    return payload
+
+
+def _segment_volume(
+    input_img: "nib.Nifti1Image", frontend_dims, encoding: tuple = (), clock: "_StageClock" = None, heart_mode: str = None
+) -> dict:
+    """Segment an input volume and archive it; returns the /segment JSON payload for heart_mode (default HEART_MODE)."""
+    clock = clock or _StageClock()
+    heart_mode = heart_mode or HEART_MODE
+    clock.mark("queue")
+    cache_key = _mask_cache_key(input_img) if MASK_CACHE else None
+    labelmap = _volume_labelmap(input_img, cache_key, clock)
+    # Vectorized label remap into a fresh array, so the cached label map serves every mode
+    mask_arr = _chambers_from_labelmap(labelmap, heart_mode)
+    clock.mark("merge")
+
+    # Save original volume and mask (in original orientation) to a per-case result folder, off the request path
+    _archiver.submit(input_img, nib.Nifti1Image(mask_arr, input_img.affine), ARCHIVE_MASK_NAMES[heart_mode])
+
+    payload = _mask_payload(mask_arr, frontend_dims, encoding, heart_mode)
+    if cache_key:
+        payload["volumeKey"] = cache_key  # GET /segment/masks/<volumeKey>?mode=... re-derives other views
+    clock.mark("encode")
+    return payload
+
+
+def _derived_result(input_img: "nib.Nifti1Image", heart_mode: str, name: str, params: tuple, build, clock: "_StageClock" = None):
+    """build(mask_arr, affine) on the heart_mode mask of input_img, cached per volume, mode and params.
+    The label map comes from the mask cache when present (else it is segmented); `name` is the stage marked."""
+    clock = clock or _StageClock()
+    heart_mode = heart_mode or HEART_MODE
+    clock.mark("queue")
+    cache_key = _mask_cache_key(input_img)
+    derived_key = ":".join([name, cache_key, heart_mode, *map(str, params)])
+    result = _derived_cache.get(derived_key)
+    if result is not None:
+        clock.mark("cache_hit")
+        return result
+    labelmap = _volume_labelmap(input_img, cache_key if MASK_CACHE else None, clock)
+    mask_arr = _chambers_from_labelmap(labelmap, heart_mode)
+    clock.mark("merge")
+    result = build(mask_arr, input_img.affine)
+    _derived_cache.put(derived_key, result)
+    clock.mark(name)
+    return result
+
+
+def _segment_mesh(input_img: "nib.Nifti1Image", heart_mode: str = None, clock: "_StageClock" = None) -> bytes:
+    """Per-label surface meshes of the heart_mode mask (see _encode_meshes), cached per volume and mode."""
+    return _derived_result(input_img, heart_mode, "mesh", (MESH_MAX_FACES, MESH_SMOOTH_ITERATIONS), _encode_meshes, clock)
+
+
+def _segment_contours(
+    input_img: "nib.Nifti1Image", frontend_dims, heart_mode: str = None, axis: int = CONTOUR_DEFAULT_AXIS,
+    clock: "_StageClock" = None,
+) -> bytes:
+    """Per-slice contours of the heart_mode mask along frontend axis `axis` (see _encode_contours), cached."""
+
+    def build(mask_arr, affine):
+        return _encode_contours(_frontend_order(mask_arr, frontend_dims), axis)
+
+    params = (axis, ",".join(map(str, frontend_dims or ())))
+    return _derived_result(input_img, heart_mode, "contours", params, build, clock)
+
+
+def _segment_centerline(
+    input_img: "nib.Nifti1Image", heart_mode: str = None, label: int = 1, min_branch_mm: float = CENTERLINE_MIN_BRANCH_MM,
+    clock: "_StageClock" = None,
+) -> dict:
+    """Centerline polylines of one label of the heart_mode mask (see _label_centerline), cached per volume and mode."""
+
+    def build(mask_arr, affine):
+        mask = mask_arr == label
+        return {"polylines": _label_centerline(mask, affine, min_branch_mm) if mask.any() else []}
+
+    payload = _derived_result(input_img, heart_mode, "centerline", (label, min_branch_mm), build, clock)
+    return {"mode": heart_mode or HEART_MODE, "label": label, **payload}
+
+
+def _segment_error_message(e: Exception) -> str:
+    if isinstance(e, FileNotFoundError):
+        return f"Segmentation output not found: {e!s}"
+    return str(e)
+
+
+class _Job:
+    """One queued segmentation; result is the /segment payload."""
+
+    def __init__(self, lane: str, fn, args: tuple, memory: int = 0, deadline: float = None):
+        self.id = uuid.uuid4().hex
+        self.lane = lane
+        self.fn = fn
+        self.args = args
+        self.memory = memory  # estimated peak bytes, reserved from MEMORY_BUDGET_MB until the job finishes
+        self.deadline = deadline  # time.time() after which the job is dropped if it has not started
+        self.status = "queued"  # queued -> running -> done | failed | cancelled, or queued -> expired | cancelled
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self.result = None
+        self.error = None
+        self.error_status = None  # HTTP status for error
+        self.cancel_reason = None  # set by _InferencePool.cancel; a running job stops at its next cancellation point
+        self._done = threading.Event()
+        self._callbacks = []
+        self._callbacks_lock = threading.Lock()
+
+    def wait(self, timeout=None) -> bool:
+        return self._done.wait(timeout)
+
+    def add_done_callback(self, fn) -> None:
+        """Call fn(job) once the job has finished: from the worker thread, or right away if it already has."""
+        with self._callbacks_lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+    def _finish(self) -> None:
+        with self._callbacks_lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            fn(self)
+
+    def to_dict(self) -> dict:
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "lane": self.lane,
+            "created": self.created,
+            "started": self.started,
+            "finished": self.finished,
+            "deadline": self.deadline,
+            "cancel_reason": self.cancel_reason,
+            "error": self.error,
+        }
+
+
+class _InferencePool:
+    """Fixed-size worker pool behind a bounded FIFO queue with priority lanes (interactive before batch)."""
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self._queue = queue.PriorityQueue()
+        self._seq = itertools.count()  # FIFO order within a lane
+        self._lock = threading.Lock()
+        self._jobs = {}  # job id -> _Job, for jobs submitted through /segment/jobs
+        self._threads = []
+        self.running = 0
+        self.queued = 0  # jobs waiting for a worker (expired ones excluded)
+        self.reserved_bytes = 0  # memory estimate of queued and running jobs
+
+    @property
+    def concurrency(self) -> int:
+        """Segmentations that can run at once: 1 with the warm model (the resident predictors run one inference at a
+        time, see _WarmPredictor.predict), else workers (every per-call totalsegmentator() builds its own)."""
+        return 1 if WARM_MODEL else self.workers
+
+    def _start(self) -> None:
+        with self._lock:
+            if self._threads:
+                return
+            if self.concurrency < self.workers:
+                print(f"Warm model: {self.workers} inference workers requested, running 1")
+            for i in range(self.concurrency):
+                t = threading.Thread(target=self._work, name=f"inference-{i}", daemon=True)
+                t.start()
+                self._threads.append(t)
+
+    def _retry_after(self) -> int:
+        """Seconds until a queue slot is likely free: jobs ahead per concurrent inference x mean inference time (caller
+        holds _lock)."""
+        per_job = _metrics.mean_stage_seconds("inference") or RETRY_AFTER_DEFAULT_SECONDS
+        return max(1, min(600, math.ceil((self.queued / self.concurrency + 1) * per_job)))
+
+    def _check_admission(self, memory: int) -> None:
+        """Raise _HTTPError if a job estimated at `memory` bytes cannot be admitted now (caller holds _lock)."""
+        budget = MEMORY_BUDGET_MB * 2**20
+        limit = min(v for v in (MAX_REQUEST_MEMORY_MB * 2**20, budget, float("inf")) if v)
+        if memory > limit:
+            error = _HTTPError(
+                f"volume needs about {memory / 2**20:.0f} MB to segment, over the {limit / 2**20:.0f} MB limit", 413
+            )
+        elif ADMISSION_MAX_QUEUED and self.queued >= ADMISSION_MAX_QUEUED:
+            error = _HTTPError(f"{self.queued} segmentations already queued; retry later", 429, self._retry_after())
+        elif budget and self.reserved_bytes + memory > budget:
+            error = _HTTPError(
+                f"server memory budget in use ({self.reserved_bytes / 2**20:.0f} of {budget / 2**20:.0f} MB); retry later",
+                503,
+                self._retry_after(),
+            )
+        else:
+            return
+        _metrics.count_rejection(error.status)
+        raise error
+
+    def admit(self, memory: int) -> None:
+        """Admission check before the request body is decoded; submit() checks again and reserves the memory."""
+        self._expire_queued()
+        with self._lock:
+            self._check_admission(memory)
+
+    def submit(self, lane: str, fn, *args, track: bool = True, memory: int = 0, deadline: float = None) -> _Job:
+        if lane not in JOB_LANES:
+            raise _BadRequest(f"unknown priority {lane!r} (expected one of {', '.join(JOB_LANES)})")
+        if deadline is not None and time.time() >= deadline:
+            raise _HTTPError("deadline passed before the request was queued", 504)
+        self._start()
+        self._expire_queued()
+        job = _Job(lane, fn, args, memory, deadline)
+        with self._lock:
+            self._check_admission(memory)
+            self.queued += 1
+            self.reserved_bytes += memory
+            if track:
+                self._prune()
+                self._jobs[job.id] = job
+        self._queue.put((JOB_LANES[lane], next(self._seq), job))
+        return job
+
+    def get(self, job_id: str):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _prune(self) -> None:
+        cutoff = time.time() - JOB_RESULT_TTL
+        for job_id in [j.id for j in self._jobs.values() if j.finished and j.finished < cutoff]:
+            del self._jobs[job_id]
+
+    def _expire_queued(self) -> None:
+        """Finish queued jobs whose deadline has passed; workers skip their queue entries."""
+        now = time.time()
+        with self._lock:
+            expired = [
+                job
+                for _, _, job in list(self._queue.queue)
+                if job.status == "queued" and job.deadline is not None and now >= job.deadline
+            ]
+            for job in expired:
+                job.status = "expired"
+                self.queued -= 1
+        for job in expired:
+            self._complete(job, error=_HTTPError(f"deadline passed after {now - job.created:.1f}s in the queue", 504))
+
+    def cancel(self, job: _Job, reason: str) -> bool:
+        """Cancel a job: a queued one finishes now, a running one at its next stage or sliding-window boundary.
+        False if it had already finished."""
+        with self._lock:
+            if job.status == "running":
+                job.cancel_reason = reason
+                return True
+            if job.status != "queued":
+                return False
+            job.status, job.cancel_reason = "cancelled", reason
+            self.queued -= 1
+        self._complete(job, error=_Cancelled(reason))
+        return True
+
+    def forget(self, job_id: str) -> None:
+        """Drop a finished job (and its result) from the registry."""
+        with self._lock:
+            self._jobs.pop(job_id, None)
+
+    def _complete(self, job: _Job, result=None, error: Exception = None) -> None:
+        """Record the outcome (job.status is already final for expired and queued-cancelled jobs), release the
+        memory and wake waiters."""
+        if error is not None:
+            job.error_status, job.error, _ = _error_status(error)
+            if job.status not in ("expired", "cancelled"):
+                job.status = "cancelled" if isinstance(error, _Cancelled) else "failed"
+        else:
+            job.result, job.status = result, "done"
+        _metrics.count_job(job.status)
+        job.args = ()  # drop the input volume
+        job.finished = time.time()
+        with self._lock:
+            self.reserved_bytes -= job.memory
+            if job.started is not None:
+                self.running -= 1
+        job._finish()
+
+    def _work(self) -> None:
+        while True:
+            _, _, job = self._queue.get()
+            with self._lock:
+                if job.status != "queued":
+                    continue  # expired or cancelled while queued
+                self.queued -= 1
+                expired = job.deadline is not None and time.time() >= job.deadline
+                if expired:
+                    job.status = "expired"
+                else:
+                    self.running += 1
+                    job.status, job.started = "running", time.time()
+            if expired:
+                wait = time.time() - job.created
+                self._complete(job, error=_HTTPError(f"deadline passed after {wait:.1f}s in the queue", 504))
+                continue
+            _current_job.job = job
+            try:
+                result = job.fn(*job.args)
+            except Exception as e:
+                self._complete(job, error=e)
+            else:
+                self._complete(job, result)
+            finally:
+                _current_job.job = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            queued = {lane: 0 for lane in JOB_LANES}
+            for job in list(self._queue.queue):
+                if job[2].status == "queued":
+                    queued[job[2].lane] += 1
+            return {
+                "workers": self.concurrency,
+                "running": self.running,
+                "queued": queued,
+                "max_queued": ADMISSION_MAX_QUEUED,
+                "reserved_bytes": self.reserved_bytes,
+                "memory_budget_bytes": MEMORY_BUDGET_MB * 2**20,
+            }
+
+
+_inference_pool = _InferencePool(INFERENCE_WORKERS)
+
+
+def _client_disconnected(sock) -> bool:
+    """True once the client has closed the connection: readable with nothing to read (pipelined bytes are only peeked)."""
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        return bool(readable) and sock.recv(1, socket.MSG_PEEK) == b""
+    except ValueError:  # TLS sockets cannot peek
+        return False
+    except OSError:
+        return True
+
+
+def _client_socket():
+    """Client connection of the current request where the WSGI server exposes it (gunicorn, werkzeug dev server)."""
+    return request.environ.get("gunicorn.socket") or request.environ.get("werkzeug.socket")
+
+
+def _wait_for_job(job: _Job) -> None:
+    """Block until job finishes. If the client disconnects first, cancel the job and raise _Cancelled."""
+    sock = _client_socket()
+    while not job.wait(DISCONNECT_POLL_SECONDS):
+        if sock is not None and _client_disconnected(sock):
+            _inference_pool.cancel(job, "client disconnected")
+            raise _Cancelled("client disconnected")
 
 
 @app.route("/segment", methods=["POST"])
@@ -188,101 +1857,435 @@ def segment():
       Content-Type: application/json
       Body: { "dimensions": [nx,ny,nz], "spacing": [sx,sy,sz], "origin": [ox,oy,oz], "data": "<base64>", "dtype": "float32"|"uint16" }
       dimensions/spacing/origin in (x,y,z) order; data is row-major (x fastest).
+    Input (binary): same volume without base64 — Content-Type: application/x-lge-volume,
+      body = raw voxel bytes (x fastest), query string ?dimensions=nx,ny,nz&spacing=sx,sy,sz&origin=ox,oy,oz&dtype=int16.
     Input (optional): raw NIfTI bytes (Content-Type: application/octet-stream).
 
     Output: raw mask bytes (uint8, 0/1) as application/octet-stream. Mask has the same dimensions
     and voxel count as the input volume; bytes are in first-dimension-fastest order to match Cornerstone.
+    Runs on the inference pool (interactive lane) and blocks until the mask is ready.
+    Optional ?encoding=bbox,rle | bbox,packed (any subset) for a compact mask, see _encode_mask.
+    Optional ?mode=four_chambers | left_only | heart (default HEART_MODE). The payload's "volumeKey" (when the
+    mask cache is on) lets GET /segment/masks/<volumeKey>?mode=... return the other views without re-segmenting.
+    Optional X-Request-Timeout: <seconds> header; still queued after that -> 504. Admission control answers 413 (too
+    large), 429 (queue full) or 503 (memory budget) with Retry-After before the body is decoded.
     """
     try:
-        content_type = (request.content_type or "").split(";")[0].strip().lower()
-        frontend_dims = None  # (d0, d1, d2) when input was JSON so we can match byte order
-
-        with tempfile.TemporaryDirectory() as tmp_dir:
-            tmp = Path(tmp_dir)
-            if content_type == "application/json":
-                body = request.get_json(force=True)
-                if not body or "data" not in body or "dimensions" not in body:
-                    return Response(
-                        '{"error":"JSON body must include dimensions and data (base64)"}',
-                        status=400,
-                        mimetype="application/json",
-                    )
-                frontend_dims = list(body["dimensions"][:3])
-                input_nifti = tmp / "input_volume.nii"
-                _nifti_from_json(body, input_nifti)
-            else:
-                # Raw NIfTI bytes
-                volume_bytes = request.get_data()
-                if not volume_bytes:
-                    return Response(
-                        '{"error":"Empty body: send NIfTI bytes or JSON with dimensions/data"}',
-                        status=400,
-                        mimetype="application/json",
-                    )
-                is_gzip = len(volume_bytes) >= 2 and volume_bytes[0] == 0x1F and volume_bytes[1] == 0x8B
-                input_nifti = tmp / ("input_volume.nii.gz" if is_gzip else "input_volume.nii")
-                input_nifti.write_bytes(volume_bytes)
-
-            # Reorient to canonical (same as DICOM conversion) so TotalSegmentator works correctly
-            input_can = tmp / "input_canonical.nii.gz"
-            _reorient_to_canonical(input_nifti, input_can)
-
-            seg_dir = tmp / "segmentation"
-            seg_dir.mkdir(parents=True, exist_ok=True)
-
-            mask_file = _run_segmentation(input_can, seg_dir)
-
-            # Put mask back in original input orientation — same voxel count as volume (undo_canonical preserves shape)
-            orig_img = nib.load(str(input_nifti))
-            mask_img = nib.load(str(mask_file))
-            mask_orig = undo_canonical(mask_img, orig_img)
-            mask_arr = mask_orig.get_fdata().astype(np.uint8)
-            # Frontend (Cornerstone) expects flat buffer with first dimension varying fastest (Fortran order).
-            # If we transposed in _nifti_from_json, server shape is (d2,d1,d0); else (d0,d1,d2). Emit in (d0,d1,d2) F-order.
-            shape = tuple(mask_arr.shape)
-            if frontend_dims and len(frontend_dims) >= 3:
-                d0, d1, d2 = int(frontend_dims[0]), int(frontend_dims[1]), int(frontend_dims[2])
-                if shape == (d2, d1, d0):
-                    mask_arr = np.transpose(mask_arr, (2, 1, 0))
-                elif shape != (d0, d1, d2):
-                    pass  # keep as-is, flatten F
-            mask_bytes = mask_arr.flatten(order="F").tobytes()
-
-            # Copy original volume and mask (in original orientation) to result folder
-            RESULT_DIR.mkdir(parents=True, exist_ok=True)
-            result_volume = RESULT_DIR / ("lge_volume.nii.gz" if input_nifti.suffix == ".gz" else "lge_volume.nii")
-            shutil.copy2(input_nifti, result_volume)
-            result_seg_dir = RESULT_DIR / "segmentation"
-            result_seg_dir.mkdir(parents=True, exist_ok=True)
-            result_mask_name = "heart_four_chambers.nii.gz" if HEART_MODE == "four_chambers" else "heart.nii.gz"
-            nib.save(mask_orig, str(result_seg_dir / result_mask_name))
-
-        # Return JSON with dimensions + base64 mask so frontend format matches exactly (no guesswork).
-        out_dims = frontend_dims if frontend_dims else list(mask_arr.shape)
-        payload = {"dimensions": out_dims[:3], "data": base64.b64encode(mask_bytes).decode("ascii")}
-        if HEART_MODE == "four_chambers":
-            payload["multiLabel"] = True
-            payload["segmentLabels"] = ["Left atrium", "Left ventricle", "Right atrium", "Right ventricle"]
-        return Response(json.dumps(payload), mimetype="application/json")
-
-    except FileNotFoundError as e:
-        return Response(
-            f'{{"error":"Segmentation output not found: {e!s}"}}',
-            status=500,
-            mimetype="application/json",
+        deadline = _request_deadline(request.headers)
+        encoding = _parse_mask_encoding(request.args.get("encoding"))
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        input_img, frontend_dims = _read_segment_input()
+        job = _inference_pool.submit(
+            "interactive", _segment_volume, input_img, frontend_dims, encoding, None, heart_mode,
+            track=False, memory=_image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        _wait_for_job(job)
+    except Exception as e:
+        return _exception_response(e)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    return Response(json.dumps(job.result), mimetype="application/json")
+
+
+@app.route("/segment/stream", methods=["POST"])
+def segment_stream():
+    """
+    Same input and result as /segment, streamed as Server-Sent Events (text/event-stream):
+      event: stage   data: {"stage": "decode"|"nifti"|"queue"|"reorient"|"roi"|"inference"|"merge"|"undo_canonical"|"encode"|"cache_hit",
+                            "seconds": <stage duration>, "elapsed": <since request start>}
+      event: result  data: <the /segment JSON payload>
+      event: error   data: {"error": "..."}
+    Stage events are sent as each stage finishes.
+    """
+    events = queue.Queue()
+    clock = _StageClock(lambda event: events.put(("stage", event)))
+
+    def run(input_img):
+        events.put(("result", _segment_volume(input_img, frontend_dims, encoding, clock, heart_mode)))
+
+    def on_done(job):
+        if job.error is not None:  # failed, or expired before it ran
+            events.put(("error", {"error": job.error}))
+
+    try:
+        deadline = _request_deadline(request.headers)
+        encoding = _parse_mask_encoding(request.args.get("encoding"))
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        input_img, frontend_dims = _read_segment_input(clock)
+        job = _inference_pool.submit(
+            "interactive", run, input_img, track=False, memory=_image_memory(input_img), deadline=deadline
+        )
+        del input_img
+    except Exception as e:
+        return _exception_response(e)
+    job.add_done_callback(on_done)
+
+    sock = _client_socket()
+
+    def generate():
+        kind, idle = None, 0.0
+        try:
+            while kind in (None, "stage"):
+                try:
+                    kind, data = events.get(timeout=DISCONNECT_POLL_SECONDS)
+                except queue.Empty:
+                    if sock is not None and _client_disconnected(sock):
+                        return
+                    idle += DISCONNECT_POLL_SECONDS
+                    if idle >= SSE_KEEPALIVE_SECONDS:
+                        idle = 0.0
+                        yield ": keepalive\n\n"  # keeps proxies from closing an idle stream during inference
+                    continue
+                idle = 0.0
+                yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+        finally:
+            if kind in (None, "stage"):  # client gone (or the server closed the stream after a failed write)
+                _inference_pool.cancel(job, "client disconnected")
+
+    return Response(generate(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/segment/jobs", methods=["POST"])
+def segment_job_submit():
+    """
+    Same input as /segment; returns 202 {"job_id", "status"} immediately and segments in the background.
+    Query ?priority=interactive (default) or batch — interactive jobs are taken from the queue first.
+    """
+    try:
+        deadline = _request_deadline(request.headers)
+        encoding = _parse_mask_encoding(request.args.get("encoding"))
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        input_img, frontend_dims = _read_segment_input()
+        lane = request.args.get("priority", "interactive")
+        job = _inference_pool.submit(
+            lane, _segment_volume, input_img, frontend_dims, encoding, None, heart_mode,
+            memory=_image_memory(input_img), deadline=deadline,
+        )
+    except Exception as e:
+        return _exception_response(e)
+    return Response(json.dumps(job.to_dict()), status=202, mimetype="application/json")
+
+
+@app.route("/segment/masks/<volume_key>", methods=["GET"])
+def segment_mask_view(volume_key):
+    """
+    Another view of an already segmented volume, derived from its cached chamber label map (no inference).
+    Query: ?mode=four_chambers | left_only | heart, ?encoding= as for /segment, and ?dimensions=d0,d1,d2
+    (the frontend dimensions sent with the original request) so the mask comes back in the same byte order.
+    400 for a malformed volume key, 404 if the volume is not (or no longer) in the mask cache.
+    """
+    try:
+        volume_key = _parse_volume_key(volume_key)
+        encoding = _parse_mask_encoding(request.args.get("encoding"))
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        dims = request.args.get("dimensions")
+        frontend_dims = [int(v) for v in dims.split(",")][:3] if dims else None
+    except ValueError as e:
+        return _error_response(str(e), 400)
+    payload = _mask_view_payload(volume_key, frontend_dims, encoding, heart_mode)
+    if payload is None:
+        return _error_response(f"volume {volume_key} is not in the mask cache; POST it to /segment", 404)
+    return Response(json.dumps(payload), mimetype="application/json")
+
+
+@app.route("/segment/mesh", methods=["POST"])
+def segment_mesh():
+    """
+    Same input (and ?mode=) as /segment; returns per-label triangle meshes of the mask instead of the voxels, so the
+    browser does not run marching cubes. Body is application/x-lge-mesh (see _encode_meshes): vertices in
+    LPS world coordinates (mm), the same space as the viewer's volume. Decimated to MESH_MAX_FACES triangles per
+    label and Taubin-smoothed; cached per volume and mode (the label map comes from the mask cache when present).
+    """
+    if measure is None:
+        return _error_response("surface meshes need scikit-image (pip install scikit-image)", 501)
+    try:
+        deadline = _request_deadline(request.headers)
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        input_img, _ = _read_segment_input()
+        job = _inference_pool.submit(
+            "interactive", _segment_mesh, input_img, heart_mode,
+            track=False, memory=_image_memory(input_img), deadline=deadline,
         )
+        del input_img
+        _wait_for_job(job)
     except Exception as e:
-        return Response(
-            f'{{"error":"{e!s}"}}',
-            status=500,
-            mimetype="application/json",
+        return _exception_response(e)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    return Response(job.result, mimetype=MESH_CONTENT_TYPE, headers={"X-Mesh-Mode": heart_mode})
+
+
+@app.route("/segment/contours", methods=["POST"])
+def segment_contours():
+    """
+    Same input (and ?mode=) as /segment; returns the outline of every label on every slice along
+    ?axis=0|1|2 (frontend dimension order, default CONTOUR_DEFAULT_AXIS) as application/x-lge-contours
+    (see _encode_contours): delta-encoded polylines in voxel index space, a few KB instead of the whole mask.
+    """
+    if measure is None:
+        return _error_response("contours need scikit-image (pip install scikit-image)", 501)
+    try:
+        deadline = _request_deadline(request.headers)
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        axis = _parse_contour_axis(request.args.get("axis"))
+        input_img, frontend_dims = _read_segment_input()
+        job = _inference_pool.submit(
+            "interactive", _segment_contours, input_img, frontend_dims, heart_mode, axis,
+            track=False, memory=_image_memory(input_img), deadline=deadline,
+        )
+        del input_img
+        _wait_for_job(job)
+    except Exception as e:
+        return _exception_response(e)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    return Response(job.result, mimetype=CONTOUR_CONTENT_TYPE)
+
+
+@app.route("/centerline", methods=["POST"])
+def centerline():
+    """
+    Same input (and ?mode=) as /segment; returns the centerline of one label of the mask as JSON:
+      {"mode", "label", "polylines": [{"points": [[x,y,z], ...], "radii": [...], "length": mm}, ...]}
+    Points are ordered along each branch, in LPS world coordinates (mm); radii are distances to the label
+    boundary (mm). Branches run between end and junction points, longest first.
+    Query: ?label=<value in the mode's mask> (default 1), ?min_branch_mm= (spur pruning, default
+    CENTERLINE_MIN_BRANCH_MM), ?priority=interactive|batch (inference pool lane, for bulk runs).
+    """
+    if morphology is None or ndimage is None:
+        return _error_response("centerlines need scikit-image and scipy (pip install scikit-image)", 501)
+    try:
+        deadline = _request_deadline(request.headers)
+        heart_mode = _parse_heart_mode(request.args.get("mode"))
+        label, min_branch_mm = _parse_centerline_args(request.args)
+        input_img, _ = _read_segment_input()
+        lane = request.args.get("priority", "interactive")
+        job = _inference_pool.submit(
+            lane, _segment_centerline, input_img, heart_mode, label, min_branch_mm,
+            track=False, memory=_image_memory(input_img), deadline=deadline,
         )
+        del input_img
+        _wait_for_job(job)
+    except Exception as e:
+        return _exception_response(e)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    return Response(json.dumps(job.result), mimetype="application/json")
+
+
+@app.route("/segment/jobs/<job_id>", methods=["GET"])
+def segment_job_status(job_id):
+    job = _inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    return Response(json.dumps(job.to_dict()), mimetype="application/json")
+
+
+@app.route("/segment/jobs/<job_id>", methods=["DELETE"])
+def segment_job_cancel(job_id):
+    """
+    Cancel a job. A queued job is dropped at once (200); a running one stops at its next stage or sliding-window
+    boundary without archiving (202, then status "cancelled"). A finished job is removed with its result (200).
+    """
+    job = _inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    if not _inference_pool.cancel(job, "job deleted"):
+        _inference_pool.forget(job_id)
+    return Response(json.dumps(job.to_dict()), status=200 if job.finished else 202, mimetype="application/json")
+
+
+@app.route("/segment/jobs/<job_id>/result", methods=["GET"])
+def segment_job_result(job_id):
+    """The /segment payload once the job is done; 202 with job status while queued/running, 410 if cancelled."""
+    job = _inference_pool.get(job_id)
+    if job is None:
+        return _error_response(f"unknown job {job_id}", 404)
+    if job.error is not None:
+        return _error_response(job.error, job.error_status)
+    if job.status != "done":
+        return Response(json.dumps(job.to_dict()), status=202, mimetype="application/json")
+    return Response(json.dumps(job.result), mimetype="application/json")
+
+
+@app.route("/segment/jobs", methods=["GET"])
+def segment_job_stats():
+    """Worker pool size, running jobs and queue depth per lane."""
+    return Response(json.dumps(_inference_pool.stats()), mimetype="application/json")
 
 
 @app.route("/health", methods=["GET"])
 def health():
+    """Liveness: answers as soon as the process is up (also starts the warm-up if nothing else has)."""
+    _readiness.health_checked()
+    start_warmup()
     return Response('{"status":"ok"}', mimetype="application/json")
 
 
+@app.route("/ready", methods=["GET"])
+def ready():
+    """Readiness: 200 once the model is loaded and the warm-up inference has run, else 503 with the startup phase."""
+    start_warmup()
+    payload = _readiness.to_dict()
+    return Response(json.dumps(payload), status=200 if payload["ready"] else 503, mimetype="application/json")
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    """Prometheus text exposition: per-stage latency histograms and memory, pool queue depth / in-flight, cache."""
+    return Response(_metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/cache/stats", methods=["GET"])
+def cache_stats():
+    """Mask cache hit/miss counters."""
+    return Response(json.dumps(_mask_cache.stats()), mimetype="application/json")
+
+
+@app.route("/model/reload", methods=["POST"])
+def model_reload():
+    """Reload the resident predictors (e.g. after updating weights on disk). Only this process reloads: 409 when
+    several gunicorn workers serve the app (PREFORK_WORKERS), or when warm-model mode is off."""
+    try:
+        payload = reload_models()
+    except Exception as e:
+        return _exception_response(e)
+    return Response(json.dumps(payload), mimetype="application/json")
+
+
+def reload_models() -> dict:
+    """Reload the crop and chamber predictors; /model/reload payload."""
+    if not WARM_MODEL:
+        raise _HTTPError("warm-model mode is disabled", 409)
+    if PREFORK_WORKERS > 1:
+        raise _HTTPError(
+            f"/model/reload would reload only one of {PREFORK_WORKERS} gunicorn workers; restart gunicorn to load "
+            "new weights in all of them",
+            409,
+        )
+    for predictor in _warm_predictors:
+        predictor.reload()
+    return {
+        "status": "ok",
+        "backend": _warm_predictor.backend,
+        "loaded_at": _warm_predictor.loaded_at,
+        "load_seconds": round(sum(p.load_seconds for p in _warm_predictors), 3),
+    }
+
+
+def preload_model() -> None:
+    """Load the resident predictors now if warm-model preloading is enabled (startup / prefork master)."""
+    if WARM_MODEL and WARM_MODEL_PRELOAD:
+        for predictor in _warm_predictors:
+            predictor.load()
+
+
+def _warmup_volume() -> "nib.Nifti1Image":
+    """Small synthetic canonical volume: a bright ellipsoid in noise, WARMUP_SHAPE voxels of WARMUP_SPACING_MM."""
+    grid = np.ogrid[tuple(slice(0, n) for n in WARMUP_SHAPE)]
+    r2 = sum(((g - n / 2) / (n / 4)) ** 2 for g, n in zip(grid, WARMUP_SHAPE))
+    data = np.random.default_rng(0).normal(100.0, 20.0, WARMUP_SHAPE).astype(np.float32)
+    data[r2 <= 1] += 300.0
+    return nib.Nifti1Image(data, np.diag([WARMUP_SPACING_MM] * 3 + [1.0]))
+
+
+def _warmup_inference(img_can: "nib.Nifti1Image") -> None:
+    """Warm-up: one inference per resident model on img_can (the chamber model on the whole volume, as the synthetic
+    volume has no heart for the crop to find), or one run of the per-call pipeline without warm models."""
+    if WARM_MODEL:
+        _organ_labelmap(img_can)
+        _warm_predictor.predict(img_can)
+    else:
+        _run_segmentation(img_can, _StageClock(record=False))
+
+
+class _Readiness:
+    """Startup phases for /ready: starting -> loading -> warming -> ready (or failed), with their timings."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self.status = "starting"
+        self.error = None
+        self.import_seconds = None  # process clock: server.py imported
+        self.first_health_seconds = None  # first /health answered
+        self.load_seconds = None  # heavy imports, device probe and weights
+        self.warmup_seconds = None  # warm-up inference
+        self.ready_seconds = None  # /ready turned 200
+
+    def _since_import(self) -> float:
+        return round(time.perf_counter() - _IMPORT_STARTED, 3)
+
+    def imported(self) -> None:
+        self.import_seconds = self._since_import()
+
+    def health_checked(self) -> None:
+        if self.first_health_seconds is None:
+            self.first_health_seconds = self._since_import()
+
+    @property
+    def ready(self) -> bool:
+        return self.status == "ready"
+
+    def start(self) -> None:
+        """Run the warm-up in a background thread (once per process)."""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="warmup", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        try:
+            self.status = "loading"
+            t0 = time.perf_counter()
+            for module in (nib, ndimage, sparse, csgraph, measure, morphology):
+                if module is not None:
+                    importlib.import_module(module._name)
+            _device()
+            preload_model()
+            self.load_seconds = round(time.perf_counter() - t0, 3)
+            if WARMUP_INFERENCE:
+                self.status = "warming"
+                t0 = time.perf_counter()
+                # Through the pool (batch lane) so its worker threads are started too; not cached or timed in /metrics.
+                job = _inference_pool.submit("batch", _warmup_inference, _warmup_volume(), track=False)
+                job.wait()
+                if job.error is not None:
+                    raise RuntimeError(job.error)
+                self.warmup_seconds = round(time.perf_counter() - t0, 3)
+            self.ready_seconds = self._since_import()
+            self.status = "ready"
+            print(f"Ready {self.ready_seconds:.1f}s after import (model load {self.load_seconds:.1f}s)")
+        except Exception as e:
+            self.error = _segment_error_message(e)
+            self.status = "failed"
+            print(f"Warm-up failed: {self.error}")
+
+    def to_dict(self) -> dict:
+        return {
+            "status": self.status,
+            "ready": self.ready,
+            "error": self.error,
+            "import_seconds": self.import_seconds,
+            "first_health_seconds": self.first_health_seconds,
+            "load_seconds": self.load_seconds,
+            "warmup_seconds": self.warmup_seconds,
+            "ready_seconds": self.ready_seconds,
+        }
+
+
+_readiness = _Readiness()
+
+
+def start_warmup() -> None:
+    """Start loading and warming the model in the background (idempotent; call after forking, not before)."""
+    _readiness.start()
+
+
+_readiness.imported()
+
 if __name__ == "__main__":
+    start_warmup()
     app.run(host="0.0.0.0", port=5001, threaded=True)
@@ -0,0 +1,85 @@
+"""
+_chambers_from_labelmap must give byte-identical masks to the per-chamber float merge it replaced (one binary
+volume per TotalSegmentator class, read back as float64 and combined).
+
+    python3.10 -m pytest tests
+"""
+
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+SHAPE = (37, 29, 23)
+
+
+def _class_volume(labelmap: np.ndarray, name: str) -> np.ndarray:
+    """One class as TotalSegmentator wrote it with ml=False and nib.load(...).get_fdata() read it back."""
+    return (labelmap == server.CHAMBER_CLASS_IDS[name]).astype(np.uint8).astype(np.float64)
+
+
+def _float_merge(labelmap: np.ndarray, heart_mode: str) -> np.ndarray:
+    """The old merge: four_chambers paints each chamber file's label in order; the binary modes take the maximum."""
+    if heart_mode == "four_chambers":
+        combined = np.zeros(labelmap.shape, dtype=np.uint8)
+        for fname, label in server.HEART_CHAMBER_FILES:
+            combined[_class_volume(labelmap, fname[: -len(".nii.gz")]) > 0] = label
+        return combined
+    names = ("heart_atrium_left", "heart_ventricle_left") if heart_mode == "left_only" else server.WHOLE_HEART_CLASSES
+    combined = np.zeros(labelmap.shape, dtype=np.float32)
+    for name in names:
+        combined = np.maximum(combined, _class_volume(labelmap, name))
+    return combined.astype(np.uint8)
+
+
+def _synthetic_labelmap(seed: int = 0) -> np.ndarray:
+    """Overlapping boxes of every heartchambers_highres class (later boxes overwrite earlier ones), plus voxels with
+    class ids the model never outputs (8..255)."""
+    rng = np.random.default_rng(seed)
+    labelmap = np.zeros(SHAPE, dtype=np.uint8)
+    for class_id in sorted(server.CHAMBER_CLASS_IDS.values()) * 3:
+        lo = rng.integers(0, np.array(SHAPE) - 4)
+        hi = lo + rng.integers(4, np.array(SHAPE) // 2)
+        labelmap[tuple(slice(a, b) for a, b in zip(lo, hi))] = class_id
+    stray = rng.random(SHAPE) < 0.05
+    labelmap[stray] = rng.integers(max(server.CHAMBER_CLASS_IDS.values()) + 1, 256, stray.sum())
+    return labelmap
+
+
+LAYOUTS = {
+    "C": lambda a: np.ascontiguousarray(a),
+    "F": lambda a: np.asfortranarray(a),
+    "transposed": lambda a: np.ascontiguousarray(a.transpose(2, 1, 0)).transpose(2, 1, 0),  # warm predictor output
+    "strided": lambda a: np.pad(a, ((0, 0), (0, 0), (0, 1)))[:, :, :-1],  # neither C- nor F-contiguous
+}
+
+
+@pytest.mark.parametrize("heart_mode", server.HEART_MODES)
+@pytest.mark.parametrize("layout", sorted(LAYOUTS))
+@pytest.mark.parametrize("in_place", [False, True])
+def test_matches_float_merge(heart_mode, layout, in_place):
+    labelmap = _synthetic_labelmap()
+    expected = _float_merge(labelmap, heart_mode)
+    arranged = LAYOUTS[layout](labelmap.copy())
+    assert np.array_equal(arranged, labelmap)
+
+    out = server._chambers_from_labelmap(arranged, heart_mode, in_place=in_place)
+
+    assert out.dtype == np.uint8
+    assert out.shape == labelmap.shape
+    assert np.array_equal(out, expected)
+    assert np.array_equal(np.ascontiguousarray(out).tobytes(), expected.tobytes())
+    if not in_place:
+        assert np.array_equal(arranged, labelmap)  # input untouched
+
+
+def test_chunk_boundaries(monkeypatch):
+    """Chunked remap with a chunk size that does not divide the volume."""
+    monkeypatch.setattr(server, "MERGE_CHUNK_VOXELS", 1000)
+    labelmap = _synthetic_labelmap(seed=1)
+    out = server._chambers_from_labelmap(labelmap.copy(), "four_chambers", in_place=True)
+    assert np.array_equal(out, _float_merge(labelmap, "four_chambers"))
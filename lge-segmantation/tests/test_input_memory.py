@@ -0,0 +1,75 @@
+"""
+Decode + NIfTI build of a /segment upload must peak at no more than INPUT_MEMORY_CEILING times the voxel payload
+(tracemalloc; the request body itself is not counted). benchmark.py --max-input-memory checks the same on large volumes.
+
+    python3.10 -m pytest tests
+"""
+
+import base64
+import io
+import sys
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+INPUT_MEMORY_CEILING = 1.2
+DIMENSIONS = [40, 64, 48]  # first dimension smallest: the (nz, ny, nx) branch of _nifti_from_flat
+
+
+class _ReadOnlyStream:
+    """Request stream with read() but no readinto(), as gunicorn passes to Flask."""
+
+    def __init__(self, data: bytes):
+        self._stream = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self._stream.read(size)
+
+
+def _volume(dtype: str) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    return (rng.random(int(np.prod(DIMENSIONS))) * 1000).astype(dtype)
+
+
+def _traced_peak(build) -> int:
+    build()  # first call imports lazily (nibabel); not part of the per-request peak
+    tracemalloc.start()
+    try:
+        img = build()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    assert img.shape == tuple(reversed(DIMENSIONS))
+    return peak
+
+
+@pytest.mark.parametrize("dtype", server.VOLUME_DTYPES)
+def test_json_decode_peak(dtype):
+    voxels = _volume(dtype)
+    body = {"data": base64.b64encode(voxels.tobytes()).decode("ascii"), "dimensions": DIMENSIONS, "dtype": dtype}
+
+    peak = _traced_peak(lambda: server._nifti_from_json(body, server._StageClock(record=False)))
+
+    assert peak <= INPUT_MEMORY_CEILING * voxels.nbytes
+
+
+@pytest.mark.parametrize("dtype", server.VOLUME_DTYPES)
+@pytest.mark.parametrize("stream", ["readinto", "read"])
+def test_raw_decode_peak(dtype, stream, monkeypatch):
+    voxels = _volume(dtype)
+    payload = voxels.tobytes()
+    make_stream = io.BytesIO if stream == "readinto" else _ReadOnlyStream
+    # read() copies each chunk; keep chunks small relative to the payload, as 1 MiB is for a real volume.
+    monkeypatch.setattr(server, "RAW_READ_CHUNK_BYTES", max(1, len(payload) // 16))
+    header = {"dimensions": DIMENSIONS, "spacing": [1.0, 1.0, 1.0], "origin": [0.0, 0.0, 0.0], "dtype": dtype}
+
+    peak = _traced_peak(
+        lambda: server._nifti_from_raw(make_stream(payload), len(payload), header, server._StageClock(record=False))
+    )
+
+    assert peak <= INPUT_MEMORY_CEILING * len(payload)
@@ -0,0 +1,116 @@
+"""
+_MaskCache (.npy label maps keyed by _mask_cache_key): hits, LRU eviction by file mtime, persistence across
+instances (restarts, prefork workers) and keys that change with MASK_CACHE_VERSION and the task.
+
+    python3.10 -m pytest tests
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import nibabel as nib
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+SHAPE = (6, 5, 4)
+
+
+def _mask(value: int) -> np.ndarray:
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[1:4, 1:3, :value] = value
+    return mask
+
+
+def _age(cache: server._MaskCache, key: str, seconds_ago: int) -> None:
+    """Backdate an entry (filesystem mtimes can be too coarse to order back-to-back writes)."""
+    t = (int(1e9) * (1_000_000 - seconds_ago),) * 2
+    os.utime(cache.directory / f"{key}.npy", ns=t)
+
+
+def test_put_then_hit(tmp_path):
+    cache = server._MaskCache(tmp_path, 4)
+    assert cache.get("a") is None
+    cache.put("a", _mask(1))
+
+    out = cache.get("a")
+
+    assert out.dtype == np.uint8 and np.array_equal(out, _mask(1))
+    assert cache.stats() == {"entries": 1, "max_entries": 4, "hits": 1, "misses": 1, "evictions": 0}
+    assert [f.name for f in tmp_path.iterdir()] == ["a.npy"]  # no temp file left behind
+
+
+def test_evicts_least_recently_used(tmp_path):
+    cache = server._MaskCache(tmp_path, 2)
+    cache.put("a", _mask(1))
+    cache.put("b", _mask(2))
+    _age(cache, "a", 20)
+    _age(cache, "b", 10)
+    assert cache.get("a") is not None  # a is now the most recently used
+
+    cache.put("c", _mask(3))
+
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["a.npy", "c.npy"]
+    assert cache.get("b") is None
+    assert cache.stats() == {"entries": 2, "max_entries": 2, "hits": 1, "misses": 1, "evictions": 1}
+
+
+def test_persists_across_instances(tmp_path):
+    server._MaskCache(tmp_path, 4).put("a", _mask(2))
+
+    cache = server._MaskCache(tmp_path, 4)
+
+    assert cache.stats()["entries"] == 1
+    assert np.array_equal(cache.get("a"), _mask(2))
+    assert cache.stats()["hits"] == 1
+
+
+def test_sees_entries_of_other_workers(tmp_path):
+    """Each prefork worker has its own instance; one stores, the other (index already built) hits."""
+    reader, writer = server._MaskCache(tmp_path, 2), server._MaskCache(tmp_path, 2)
+    assert reader.stats()["entries"] == 0
+
+    writer.put("a", _mask(1))
+    assert np.array_equal(reader.get("a"), _mask(1))
+
+    writer.put("b", _mask(2))
+    _age(writer, "a", 20)
+    _age(writer, "b", 10)
+    reader.put("c", _mask(3))  # the bound holds for the directory, not per instance
+    assert sorted(f.name for f in tmp_path.iterdir()) == ["b.npy", "c.npy"]
+    assert writer.get("a") is None
+
+
+def test_key_changes_with_version_and_task(tmp_path, monkeypatch):
+    img = nib.Nifti1Image(np.arange(np.prod(SHAPE), dtype=np.int16).reshape(SHAPE), np.diag([-1.5, -1.5, 8.0, 1.0]))
+    cache = server._MaskCache(tmp_path, 4)
+    monkeypatch.setattr(server, "ROI_CROP", False)
+    key = server._mask_cache_key(img)
+    assert len(key) == 64 and key == server._mask_cache_key(img)
+    cache.put(key, _mask(1))
+
+    version = server.MASK_CACHE_VERSION
+    monkeypatch.setattr(server, "MASK_CACHE_VERSION", version + 1)
+    assert cache.get(server._mask_cache_key(img)) is None
+    monkeypatch.setattr(server, "MASK_CACHE_VERSION", version)
+    monkeypatch.setattr(server, "ROI_CROP", True)  # task heartchambers_highres+roi
+    assert cache.get(server._mask_cache_key(img)) is None
+    monkeypatch.setattr(server, "ROI_CROP", False)
+    assert cache.get(server._mask_cache_key(img)) is not None
+    assert cache.stats()["misses"] == 2 and cache.stats()["hits"] == 1
+
+
+@pytest.mark.parametrize("key", ["..", "A" * 64, "a" * 63, "a" * 65, "g" * 64, "a" * 64 + ".npy"])
+def test_mask_view_rejects_malformed_keys(key, tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "_mask_cache", server._MaskCache(tmp_path / "cache", 4))
+    resp = server.app.test_client().get(f"/segment/masks/{key}")
+    assert resp.status_code == 400
+    assert not (tmp_path / "cache").exists()  # rejected before the cache touched the filesystem
+
+
+def test_mask_view_unknown_key(tmp_path, monkeypatch):
+    monkeypatch.setattr(server, "_mask_cache", server._MaskCache(tmp_path, 4))
+    assert server.app.test_client().get(f"/segment/masks/{'0' * 64}").status_code == 404
@@ -0,0 +1,117 @@
+"""
+Every ?encoding= of _encode_mask must decode back to the plain mask. _decode follows decodeMaskResponse in
+src/js/maskEncoding.js (the viewer's decoder) step by step.
+
+    python3.10 -m pytest tests
+"""
+
+import base64
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+import server  # noqa: E402
+
+ENCODINGS = ["raw", "bbox", "rle", "packed", "bbox,rle", "bbox,packed"]
+SHAPE = (9, 7, 5)  # 315 voxels: a partial last byte for 1 and 4 bits per voxel
+
+
+def _decode(payload: dict, dims) -> np.ndarray:
+    """Full mask in (d0, d1, d2) order from an _encode_mask payload."""
+    data = base64.b64decode(payload["data"])
+    encoding = payload.get("encoding", "").split(",")
+    size = payload["bbox"]["size"] if "bbox" in payload else list(dims)
+    count = int(np.prod(size))
+    if "rle" in encoding:
+        runs = payload["runs"]
+        lengths = np.frombuffer(data, dtype="<u4", count=runs)
+        values = np.frombuffer(data, dtype=np.uint8, offset=4 * runs, count=runs)
+        assert len(data) == 5 * runs
+        flat = np.repeat(values, lengths)
+    elif "packed" in encoding:
+        bits = payload["bitsPerVoxel"]
+        assert len(data) == -(-count * bits // 8)  # whole bytes, last one partial
+        raw = np.frombuffer(data, dtype=np.uint8)
+        if bits == 1:
+            flat = np.unpackbits(raw, bitorder="little")
+        else:
+            flat = np.stack([raw & 15, raw >> 4], axis=1).ravel()
+        assert not flat[count:].any()  # padding bits are zero
+        flat = flat[:count]
+    else:
+        flat = np.frombuffer(data, dtype=np.uint8)
+    assert flat.size == count
+    values = flat.reshape(size, order="F")
+    if "bbox" not in payload:
+        return values
+    mask = np.zeros(dims, dtype=np.uint8)
+    offset = payload["bbox"]["offset"]
+    mask[tuple(slice(o, o + n) for o, n in zip(offset, size))] = values
+    return mask
+
+
+def _binary_blob() -> np.ndarray:
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[2:7, 1:5, 1:4] = 1
+    mask[4, 5, 2] = 1
+    return mask
+
+
+def _multi_label() -> np.ndarray:
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    for label, corner in zip((1, 2, 3, 4), ((1, 1, 1), (4, 1, 1), (1, 3, 2), (4, 3, 2))):
+        mask[tuple(slice(c, c + 3) for c in corner)] = label
+    return mask
+
+
+def _edges() -> np.ndarray:
+    """Labels on the first and last voxel of every axis, so the bbox is the whole volume."""
+    mask = np.zeros(SHAPE, dtype=np.uint8)
+    mask[0, 0, 0] = 1
+    mask[-1, -1, -1] = 2
+    mask[0, -1, 2] = 3
+    return mask
+
+
+MASKS = {
+    "binary": _binary_blob,
+    "multi_label": _multi_label,
+    "edges": _edges,
+    "edges_binary": lambda: (_edges() > 0).astype(np.uint8),
+    "empty": lambda: np.zeros(SHAPE, dtype=np.uint8),
+    "full": lambda: np.full(SHAPE, 3, dtype=np.uint8),
+    "random": lambda: np.random.default_rng(0).integers(0, 5, SHAPE).astype(np.uint8),
+}
+
+
+@pytest.mark.parametrize("encoding", ENCODINGS)
+@pytest.mark.parametrize("name", sorted(MASKS))
+def test_round_trip(name, encoding):
+    mask = MASKS[name]()
+    payload = server._encode_mask(mask, server._parse_mask_encoding(encoding))
+    assert np.array_equal(_decode(payload, mask.shape), mask)
+
+
+@pytest.mark.parametrize("name, bits", [("binary", 1), ("edges_binary", 1), ("empty", 1), ("multi_label", 4)])
+def test_packed_bits_per_voxel(name, bits):
+    payload = server._encode_mask(MASKS[name](), ("packed",))
+    assert payload["bitsPerVoxel"] == bits
+
+
+def test_bbox_crops_to_labels():
+    payload = server._encode_mask(_binary_blob(), ("bbox",))
+    assert payload["bbox"] == {"offset": [2, 1, 1], "size": [5, 5, 3]}
+
+
+def test_bbox_at_volume_edges():
+    payload = server._encode_mask(_edges(), ("bbox",))
+    assert payload["bbox"] == {"offset": [0, 0, 0], "size": list(SHAPE)}
+
+
+def test_empty_mask_bbox_has_no_voxels():
+    payload = server._encode_mask(np.zeros(SHAPE, dtype=np.uint8), ("bbox", "rle"))
+    assert payload["bbox"]["size"] == [0, 0, 0]
+    assert payload["runs"] == 0 and payload["data"] == ""
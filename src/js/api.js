@@ -1,4 +1,6 @@
 import config_api from '../config-api.json';
+import { decodeContourBuffer } from './contourEncoding';
+import { decodeMeshBuffer } from './meshEncoding';
 
 
 
@@ -114,18 +116,163 @@ export const addMarkupAPI =
 
 const SEGMENTATION_BASE_URL = window.__API_SEGMENTATION__ || (config_api.SEGMENTATION && config_api.SEGMENTATION.URL) || 'http://localhost:5001';
 
+const parseSegmentResponse = async (resp) => {
+	if (!resp.ok) return resp.text().then(t => Promise.reject(new Error(t || resp.statusText)));
+	const ct = (resp.headers.get('Content-Type') || '').toLowerCase();
+	if (ct.includes('application/json')) {
+		return resp.json();
+	}
+	const buf = await resp.arrayBuffer();
+	return { dimensions: null, data: buf };
+};
+
 /** POST volume as JSON; server builds NIfTI and runs segmentation. Returns { dimensions: [d0,d1,d2], data: base64 } (mask uint8 0/1). */
 export const segmentVolumeAPI = (volumePayload) =>
 	fetch(`${ SEGMENTATION_BASE_URL }/segment`, {
 		method: 'POST',
 		headers: { 'Content-Type': 'application/json' },
 		body: JSON.stringify(volumePayload),
-	}).then(async (resp) => {
-		if (!resp.ok) return resp.text().then(t => Promise.reject(new Error(t || resp.statusText)));
-		const ct = (resp.headers.get('Content-Type') || '').toLowerCase();
-		if (ct.includes('application/json')) {
-			return resp.json();
-		}
-		const buf = await resp.arrayBuffer();
-		return { dimensions: null, data: buf };
+	}).then(parseSegmentResponse);
+
+/**
+ * POST raw voxel bytes (no base64); dimensions/spacing/origin/dtype go in the query string. Same response as segmentVolumeAPI.
+ * encoding (e.g. MASK_ENCODING from ./maskEncoding) asks for a compact mask; decode it with decodeMaskResponse.
+ */
+export const segmentVolumeRawAPI = (scalarData, { dimensions, spacing, origin, dtype }, encoding) => {
+	const query = new URLSearchParams({
+		dimensions: dimensions.join(','),
+		spacing: spacing.join(','),
+		origin: origin.join(','),
+		dtype,
+	});
+	if (encoding) query.set('encoding', encoding);
+	return fetch(`${ SEGMENTATION_BASE_URL }/segment?${ query }`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/x-lge-volume' },
+		body: new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength),
+	}).then(parseSegmentResponse);
+};
+
+/**
+ * Another view (mode: four_chambers | left_only | heart) of a volume already segmented, by the volumeKey of its
+ * /segment response; no upload or inference. Rejects with status 404 when the server no longer caches the volume.
+ */
+export const getSegmentMaskAPI = async (volumeKey, mode, dimensions, encoding) => {
+	const query = new URLSearchParams({ mode, dimensions: dimensions.join(',') });
+	if (encoding) query.set('encoding', encoding);
+	const resp = await fetch(`${ SEGMENTATION_BASE_URL }/segment/masks/${ volumeKey }?${ query }`);
+	if (!resp.ok) throw Object.assign(new Error(await resp.text() || resp.statusText), { status: resp.status });
+	return resp.json();
+};
+
+/**
+ * POST raw voxel bytes (as segmentVolumeRawAPI) to /segment/mesh; resolves with per-label surface meshes
+ * ({ label, points, triangles }, see decodeMeshBuffer) so the browser does not run marching cubes.
+ */
+export const segmentMeshRawAPI = async (scalarData, { dimensions, spacing, origin, dtype }, mode) => {
+	const query = new URLSearchParams({
+		dimensions: dimensions.join(','),
+		spacing: spacing.join(','),
+		origin: origin.join(','),
+		dtype,
+	});
+	if (mode) query.set('mode', mode);
+	const resp = await fetch(`${ SEGMENTATION_BASE_URL }/segment/mesh?${ query }`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/x-lge-volume' },
+		body: new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength),
+	});
+	if (!resp.ok) throw new Error(await resp.text() || resp.statusText);
+	return decodeMeshBuffer(await resp.arrayBuffer());
+};
+
+/**
+ * POST raw voxel bytes to /segment/contours; resolves with per-slice label outlines along axis (0, 1, 2 = d0, d1, d2;
+ * see decodeContourBuffer), so the viewer can draw outlines without the full labelmap.
+ */
+export const segmentContoursRawAPI = async (scalarData, { dimensions, spacing, origin, dtype }, axis, mode) => {
+	const query = new URLSearchParams({
+		dimensions: dimensions.join(','),
+		spacing: spacing.join(','),
+		origin: origin.join(','),
+		dtype,
+	});
+	if (axis != null) query.set('axis', axis);
+	if (mode) query.set('mode', mode);
+	const resp = await fetch(`${ SEGMENTATION_BASE_URL }/segment/contours?${ query }`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/x-lge-volume' },
+		body: new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength),
+	});
+	if (!resp.ok) throw new Error(await resp.text() || resp.statusText);
+	return decodeContourBuffer(await resp.arrayBuffer());
+};
+
+/**
+ * POST raw voxel bytes to /centerline; resolves with { mode, label, polylines: [{ points: [[x,y,z]], radii, length }] }
+ * (world coordinates, longest branch first). options: { mode, label, minBranchMm, priority }.
+ */
+export const segmentCenterlineRawAPI = async (scalarData, { dimensions, spacing, origin, dtype }, options = {}) => {
+	const query = new URLSearchParams({
+		dimensions: dimensions.join(','),
+		spacing: spacing.join(','),
+		origin: origin.join(','),
+		dtype,
+	});
+	if (options.mode) query.set('mode', options.mode);
+	if (options.label != null) query.set('label', options.label);
+	if (options.minBranchMm != null) query.set('min_branch_mm', options.minBranchMm);
+	if (options.priority) query.set('priority', options.priority);
+	const resp = await fetch(`${ SEGMENTATION_BASE_URL }/centerline?${ query }`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/x-lge-volume' },
+		body: new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength),
 	});
+	if (!resp.ok) throw new Error(await resp.text() || resp.statusText);
+	return resp.json();
+};
+
+/**
+ * Same as segmentVolumeRawAPI, via /segment/stream: onStage({ stage, seconds, elapsed }) is called as each
+ * server stage (decode, reorient, inference, ...) finishes; resolves with the final mask payload.
+ */
+export const segmentVolumeRawStreamAPI = async (scalarData, { dimensions, spacing, origin, dtype }, encoding, onStage) => {
+	const query = new URLSearchParams({
+		dimensions: dimensions.join(','),
+		spacing: spacing.join(','),
+		origin: origin.join(','),
+		dtype,
+	});
+	if (encoding) query.set('encoding', encoding);
+	const resp = await fetch(`${ SEGMENTATION_BASE_URL }/segment/stream?${ query }`, {
+		method: 'POST',
+		headers: { 'Content-Type': 'application/x-lge-volume' },
+		body: new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength),
+	});
+	if (!resp.ok) throw new Error(await resp.text() || resp.statusText);
+
+	const reader = resp.body.getReader();
+	const decoder = new TextDecoder();
+	let buffer = '';
+	for (;;) {
+		const { value, done } = await reader.read();
+		if (done) throw new Error('Segmentation stream ended without a result');
+		buffer += decoder.decode(value, { stream: true });
+		let end;
+		while ((end = buffer.indexOf('\n\n')) >= 0) {
+			const block = buffer.slice(0, end);
+			buffer = buffer.slice(end + 2);
+			let event = 'message';
+			let data = '';
+			for (const line of block.split('\n')) {
+				if (line.startsWith('event: ')) event = line.slice(7);
+				else if (line.startsWith('data: ')) data += line.slice(6);
+			}
+			if (!data) continue; // keepalive comment
+			const payload = JSON.parse(data);
+			if (event === 'stage') onStage?.(payload);
+			else if (event === 'result') return payload;
+			else if (event === 'error') throw new Error(payload.error);
+		}
+	}
+};
@@ -0,0 +1,43 @@
+/**
+ * Decoding of /segment/contours responses (LGE segmentation server, application/x-lge-contours), little-endian:
+ * "LGEC", uint32 version, axis, slice count, contour count; per contour uint16 label, uint16 closed,
+ * uint32 slice, uint32 point count, int32 u0, int32 v0, then int8 (du, dv) steps. Coordinates are in
+ * half-voxel units of the two axes other than `axis` (in increasing order), in voxel index space.
+ */
+
+/**
+ * @param {ArrayBuffer} buffer
+ * @returns {{ axis: number, sliceCount: number, contours: { label: number, closed: boolean, slice: number, points: Float32Array }[] }}
+ *   points: flat u,v pairs in voxel index units (pass through imageData.indexToWorld with the slice index on `axis`)
+ */
+export function decodeContourBuffer(buffer) {
+	const view = new DataView(buffer);
+	if (new TextDecoder().decode(new Uint8Array(buffer, 0, 4)) !== 'LGEC') throw new Error('Not an LGE contour response');
+	if (view.getUint32(4, true) !== 1) throw new Error(`Unsupported LGE contour version ${ view.getUint32(4, true) }`);
+	const axis = view.getUint32(8, true);
+	const sliceCount = view.getUint32(12, true);
+	const count = view.getUint32(16, true);
+
+	const contours = [];
+	let offset = 20;
+	for (let c = 0; c < count; c++) {
+		const label = view.getUint16(offset, true);
+		const closed = view.getUint16(offset + 2, true) === 1;
+		const slice = view.getUint32(offset + 4, true);
+		const pointCount = view.getUint32(offset + 8, true);
+		let u = view.getInt32(offset + 12, true);
+		let v = view.getInt32(offset + 16, true);
+		offset += 20;
+		const points = new Float32Array(pointCount * 2);
+		points[0] = u / 2;
+		points[1] = v / 2;
+		for (let i = 1; i < pointCount; i++, offset += 2) {
+			u += view.getInt8(offset);
+			v += view.getInt8(offset + 1);
+			points[i * 2] = u / 2;
+			points[i * 2 + 1] = v / 2;
+		}
+		contours.push({ label, closed, slice, points });
+	}
+	return { axis, sliceCount, contours };
+}
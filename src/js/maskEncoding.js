@@ -0,0 +1,66 @@
+/**
+ * Decoding of compact /segment mask responses (LGE segmentation server, ?encoding=...).
+ * bbox: data covers only bbox.size at bbox.offset; rle: uint32 LE run lengths then uint8 values;
+ * packed: bitsPerVoxel 1 (LSB first) or 4 (low nibble first). Voxel order is always first dimension fastest.
+ */
+
+/** Compact form the viewer asks for: crop to the label box, then run-length encode. */
+export const MASK_ENCODING = 'bbox,rle';
+
+const base64ToBytes = (data) => {
+	const binary = atob(data);
+	const bytes = new Uint8Array(binary.length);
+	for (let i = 0; i < binary.length; i++) bytes[i] = binary.charCodeAt(i);
+	return bytes;
+};
+
+/**
+ * @param {{ dimensions: number[], data: string | ArrayBuffer, encoding?: string, bbox?: { offset: number[], size: number[] }, runs?: number, bitsPerVoxel?: number }} response
+ * @param {number[]} dims - full mask dimensions [d0, d1, d2]
+ * @returns {Uint8Array} full mask, first dimension fastest
+ */
+export function decodeMaskResponse(response, dims) {
+	const bytes = typeof response.data === 'string' ? base64ToBytes(response.data) : new Uint8Array(response.data);
+	const encoding = (response.encoding || '').split(',');
+	if (!response.encoding) return bytes;
+
+	const [d0, d1, d2] = dims;
+	const size = response.bbox ? response.bbox.size : [d0, d1, d2];
+	const count = size[0] * size[1] * size[2];
+
+	let values;
+	if (encoding.includes('rle')) {
+		const runs = response.runs;
+		const view = new DataView(bytes.buffer, bytes.byteOffset, bytes.byteLength);
+		values = new Uint8Array(count);
+		let pos = 0;
+		for (let r = 0; r < runs; r++) {
+			const length = view.getUint32(r * 4, true);
+			const value = bytes[runs * 4 + r];
+			if (value) values.fill(value, pos, pos + length);
+			pos += length;
+		}
+	} else if (encoding.includes('packed')) {
+		values = new Uint8Array(count);
+		if (response.bitsPerVoxel === 1) {
+			for (let i = 0; i < count; i++) values[i] = (bytes[i >> 3] >> (i & 7)) & 1;
+		} else {
+			for (let i = 0; i < count; i++) values[i] = (bytes[i >> 1] >> ((i & 1) * 4)) & 15;
+		}
+	} else {
+		values = bytes;
+	}
+
+	if (!response.bbox) return values;
+
+	const mask = new Uint8Array(d0 * d1 * d2);
+	const [o0, o1, o2] = response.bbox.offset;
+	const [s0, s1, s2] = size;
+	for (let k = 0; k < s2; k++) {
+		for (let j = 0; j < s1; j++) {
+			const src = (k * s1 + j) * s0;
+			mask.set(values.subarray(src, src + s0), o0 + (j + o1) * d0 + (k + o2) * d0 * d1);
+		}
+	}
+	return mask;
+}
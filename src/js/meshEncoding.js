@@ -0,0 +1,28 @@
+/**
+ * Decoding of /segment/mesh responses (LGE segmentation server, application/x-lge-mesh), little-endian:
+ * "LGEM", uint32 version, uint32 label count; per label uint32 label, vertex count, triangle count,
+ * float32 xyz per vertex (LPS world mm), uint32 vertex indices per triangle. Sections are 4-byte aligned.
+ */
+
+/**
+ * @param {ArrayBuffer} buffer
+ * @returns {{ label: number, points: Float32Array, triangles: Uint32Array }[]} views into buffer (no copies)
+ */
+export function decodeMeshBuffer(buffer) {
+	const header = new Uint32Array(buffer, 0, 3);
+	if (new TextDecoder().decode(new Uint8Array(buffer, 0, 4)) !== 'LGEM') throw new Error('Not an LGE mesh response');
+	if (header[1] !== 1) throw new Error(`Unsupported LGE mesh version ${ header[1] }`);
+
+	const meshes = [];
+	let offset = 12;
+	for (let i = 0; i < header[2]; i++) {
+		const [label, vertexCount, triangleCount] = new Uint32Array(buffer, offset, 3);
+		offset += 12;
+		const points = new Float32Array(buffer, offset, vertexCount * 3);
+		offset += vertexCount * 12;
+		const triangles = new Uint32Array(buffer, offset, triangleCount * 3);
+		offset += triangleCount * 12;
+		meshes.push({ label, points, triangles });
+	}
+	return meshes;
+}
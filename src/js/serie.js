@@ -16,6 +16,7 @@ import * as cornerstoneTools from '@cornerstonejs/tools';
 import MCWorker from '../workers/mc.worker';
 
 import { addMarkupAPI, getMarkupAPI } from './api';
+import { decodeMaskResponse } from './maskEncoding';
 
 import { getViewportUIVolume, getViewportUIVolume3D, getContourLineWidth } from './viewport-ui';
 import { addContourLineActorsToViewport, addCenterlineToViewport3D, updateSphereActorCenter, updateCenterlineLinePoints, createCenterlinePlaneActor, updateCenterlinePlane, setCenterlinePlaneContour } from './contourLinesAsVtk';
@@ -2901,14 +2902,8 @@ export default class Serie
 		const d1 = dims[1];
 		const d2 = dims[2];
 		const n = d0 * d1 * d2;
-		let mask;
-		if (typeof response.data === 'string') {
-			const binary = atob(response.data);
-			mask = new Uint8Array(binary.length);
-			for (let i = 0; i < binary.length; i++) mask[i] = binary.charCodeAt(i);
-		} else {
-			mask = new Uint8Array(response.data);
-		}
+		// Plain or compact (bbox / rle / packed) response, expanded to the full first-dimension-fastest mask
+		const mask = decodeMaskResponse(response, [d0, d1, d2]);
 		if (mask.length !== n) throw new Error(`Mask size ${mask.length} does not match dimensions ${d0}*${d1}*${d2}=${n}`);
 
 		const multiLabel = response.multiLabel === true;
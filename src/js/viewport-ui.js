@@ -9,7 +9,8 @@ import { getWebWorkerManager, cache } from '@cornerstonejs/core';
 import JSZip from 'jszip';
 
 import locale from '../locale.json';
-import { segmentVolumeAPI } from './api';
+import { segmentVolumeRawStreamAPI } from './api';
+import { MASK_ENCODING } from './maskEncoding';
 import { addContourLineActorsToViewport, removeContourLineActorsFromViewport } from './contourLinesAsVtk';
 
 /** viewportId -> Map(sliceIndex -> polyDataResults) for VTK contour lines per slice */
@@ -528,13 +529,6 @@ export const getViewportUIVolume = (_this, viewport_input, viewport_input_index)
       segmentBtn.textContent = '…';
       try {
         const scalarData = _this.volume.voxelManager.getCompleteScalarDataArray();
-        const bytes = new Uint8Array(scalarData.buffer, scalarData.byteOffset, scalarData.byteLength);
-        let base64 = '';
-        const chunk = 8192;
-        for (let i = 0; i < bytes.length; i += chunk) {
-          base64 += String.fromCharCode.apply(null, bytes.subarray(i, i + chunk));
-        }
-        base64 = btoa(base64);
         // Use imageData so spacing/origin/dimensions match viewport (always in mm, same order as volume layout)
         const imageData = _this.volume.imageData;
         const dimensions = imageData.getDimensions?.() ?? _this.volume.dimensions;
@@ -546,14 +540,18 @@ export const getViewportUIVolume = (_this, viewport_input, viewport_input_index)
           : scalarData instanceof Int16Array ? 'int16'
           : scalarData instanceof Uint8Array ? 'uint8'
           : 'float32';
-        const volumePayload = {
+        // Raw voxel bytes (no base64): ~33% less upload and no string building on the client
+        const volumeHeader = {
           dimensions: Array.isArray(dimensions) ? dimensions.slice(0, 3) : [dimensions[0], dimensions[1], dimensions[2]],
           spacing,
           origin,
-          data: base64,
           dtype,
         };
-        const maskResponse = await segmentVolumeAPI(volumePayload);
+        // Progress: show the last finished server stage on the button
+        const maskResponse = await segmentVolumeRawStreamAPI(scalarData, volumeHeader, MASK_ENCODING, ({ stage, elapsed }) => {
+          segmentBtn.textContent = `${ stage } ${ elapsed.toFixed(0) }s`;
+          LOG('segment stage', stage, elapsed);
+        });
 				LOG('maskResponse', maskResponse);
         await _this.loadSegmentationFromMaskBytes(maskResponse);
       } catch (err) {